@@ -5,11 +5,8 @@ Created on 2011-02-11
 '''
 import math
 import random
-import multiprocessing
 
 import numpy as np
-from scipy.cluster.vq import kmeans2
-
 
 from joint_snv_mix import constants
 from joint_snv_mix.classification.data import JointData
@@ -19,10 +16,13 @@ from joint_snv_mix.classification.lower_bounds import EMLowerBound
 from joint_snv_mix.classification.model_runners import ModelRunner
 from joint_snv_mix.classification.models import EMModel, EMModelTrainer
 from joint_snv_mix.classification.posteriors import EMPosterior
-from joint_snv_mix.classification.utils.beta_binomial_map_estimators import get_mle_p
+from joint_snv_mix.classification.utils.beta_binomial_map_estimators import get_map_estimates, CountHistogram
+from joint_snv_mix.classification.utils.blocks import BlockProfiler, get_block_size
+from joint_snv_mix.classification.utils.initialisation import cluster_frequencies, get_indicator_responsibilities, \
+    get_restart_centers
 from joint_snv_mix.classification.utils.log_pdf import log_translated_gamma_pdf, log_beta_pdf
 from joint_snv_mix.file_formats.cncnt import ConanCountsReader
-from joint_snv_mix.file_formats.cnsm import ConanSnvMixWriter
+from joint_snv_mix.file_formats.cnsm import ConanSnvMixReader, ConanSnvMixWriter
 
 def run_conan( args ):
     if args.density == 'binomial':
@@ -38,6 +38,8 @@ def run_conan( args ):
 # Runner
 #=======================================================================================================================
 class ConanModelRunner( ModelRunner ):
+    init_reader_class = ConanSnvMixReader
+    
     def __init__( self ):
         ModelRunner.__init__( self )
         
@@ -47,15 +49,20 @@ class ConanModelRunner( ModelRunner ):
     
     def run( self, args ):
         self.reader = ConanCountsReader( args.cncnt_file_name )
-        self.writer = ConanSnvMixWriter( args.cnsm_file_name )
+        self.writer = ConanSnvMixWriter( args.cnsm_file_name, args.sparse_epsilon, args.storage_profile )
         
         ModelRunner.run( self, args )
     
     def _classify( self, args ):
+        self.memory_budget = args.memory_budget
+        self.profiler = BlockProfiler( args.profile_blocks )
+        
         cn_states = self.reader.get_cn_states()
         
         for cn_state in sorted( cn_states ):
             self._classify_cn_state( cn_state )
+        
+        self.profiler.print_summary()
                 
     def _classify_cn_state( self, cn_state ):        
         chr_list = self.reader.get_chr_list( cn_state )
@@ -87,11 +94,12 @@ class ConanModelRunner( ModelRunner ):
         
         data = self.data_class( counts )
         
-        self.parameters[cn_state] = model.train( 
-                                                data, priors,
-                                                args.max_iters,
-                                                args.convergence_threshold
-                                                )
+        if self.init_parameters is None:
+            init_parameters = None
+        else:
+            init_parameters = self.init_parameters.get( cn_state )
+        
+        self.parameters[cn_state] = self._train_model( model, data, priors, args, init_parameters )
         
         self.priors[cn_state] = priors
     
@@ -107,13 +115,18 @@ class ConanModelRunner( ModelRunner ):
         jcnt_rows = self.reader.get_rows( cn_state, chr_name )
         
         end = self.reader.get_chr_size( cn_state, chr_name )
+        
+        self.writer.set_expected_rows( cn_state, chr_name, end )
 
-        n = int( 1e5 )
+        # Copy number states have different numbers of classes so blocks are sized for each.
+        n = get_block_size( self.memory_budget, nclass['normal'] * nclass['tumour'] )
         start = 0
         stop = min( n, end )
         
 
         while start < end:
+            self.profiler.start()
+            
             sub_counts = counts[start:stop]
             sub_rows = jcnt_rows[start:stop]
                               
@@ -123,6 +136,8 @@ class ConanModelRunner( ModelRunner ):
         
             self.writer.write_data( cn_state, chr_name, sub_rows, resp )
             
+            self.profiler.stop( chr_name, stop - start )
+            
             start = stop
             stop = min( stop + n, end )
             
@@ -213,19 +228,9 @@ class ConanBetaBinomialModel( EMModel ):
         
         self.nclass = nclass
         
-    def train( self, data, priors, max_iters, tolerance ):
-        '''
-        Train the model using EM.
-        
-        Input: JointData object
-        '''   
-        trainer = self.trainer_class( data, self.nclass, max_iters, tolerance, priors )
-        
-        parameters = trainer.run()
-        
-        trainer.responsibilities = []
-                
-        return parameters
+    def _get_trainer( self, data, priors, max_iters, tolerance, responsibilities=None, parameters=None, seed=None ):
+        return self.trainer_class( data, self.nclass, max_iters, tolerance, priors, responsibilities, parameters,
+                                   seed )
     
 class ConanBinomialModel( EMModel ):
     def __init__( self, nclass ):
@@ -235,31 +240,23 @@ class ConanBinomialModel( EMModel ):
         
         self.nclass = nclass
         
-    def train( self, data, priors, max_iters, tolerance ):
-        '''
-        Train the model using EM.
-        
-        Input: JointData object
-        '''   
-        trainer = self.trainer_class( data, self.nclass, max_iters, tolerance, priors )
-        
-        parameters = trainer.run()
-        
-        trainer.responsibilities = []
-                
-        return parameters
+    def _get_trainer( self, data, priors, max_iters, tolerance, responsibilities=None, parameters=None, seed=None ):
+        return self.trainer_class( data, self.nclass, max_iters, tolerance, priors, responsibilities, parameters,
+                                   seed )
 
 #=======================================================================================================================
 # Model Trainers
 #=======================================================================================================================
 class ConanBetaBinomialModelTrainer( EMModelTrainer ):
-    def __init__( self, data, nclass, max_iters, tolerance, priors ):
+    def __init__( self, data, nclass, max_iters, tolerance, priors, responsibilities=None, parameters=None,
+                  seed=None ):
         self.nclass = nclass
         
-        EMModelTrainer.__init__( self, data, max_iters, tolerance, priors )        
+        EMModelTrainer.__init__( self, data, max_iters, tolerance, priors, responsibilities, parameters, seed )
         
     def _init_components( self ):
-        self.latent_variables = ConanBetaBinomialLatentVariables( self.data, self.nclass )
+        self.latent_variables = ConanBetaBinomialLatentVariables( self.data, self.nclass, self.init_responsibilities,
+                                                                  self.seed )
         
         self.responsibilities = self.latent_variables.responsibilities
         
@@ -269,13 +266,15 @@ class ConanBetaBinomialModelTrainer( EMModelTrainer ):
         self.lower_bound = ConanBetaBinomialLowerBound( self.data, self.priors )
         
 class ConanBinomialModelTrainer( EMModelTrainer ):
-    def __init__( self, data, nclass, max_iters, tolerance, priors ):
+    def __init__( self, data, nclass, max_iters, tolerance, priors, responsibilities=None, parameters=None,
+                  seed=None ):
         self.nclass = nclass
         
-        EMModelTrainer.__init__( self, data, max_iters, tolerance, priors )        
+        EMModelTrainer.__init__( self, data, max_iters, tolerance, priors, responsibilities, parameters, seed )
         
     def _init_components( self ):
-        self.latent_variables = ConanBinomialLatentVariables( self.data, self.nclass )
+        self.latent_variables = ConanBinomialLatentVariables( self.data, self.nclass, self.init_responsibilities,
+                                                              self.seed )
         
         self.responsibilities = self.latent_variables.responsibilities
         
@@ -288,20 +287,16 @@ class ConanBinomialModelTrainer( EMModelTrainer ):
 # Latent Variables
 #=======================================================================================================================
 class ConanLatentVariables( EMLatentVariables ):
-    def __init__( self, data, nclass ):
+    def __init__( self, data, nclass, responsibilities=None, seed=None ):
         self.nclass = nclass
         self.ncomponents = self.nclass['normal'] * self.nclass['tumour']
         
-        EMLatentVariables.__init__( self, data )
+        EMLatentVariables.__init__( self, data, responsibilities, seed )
     
     def _init_responsibilities( self, data ):
         '''
         Intialise responsibilities via k-means clustering.
         '''
-        shape = ( data.nrows, self.ncomponents )
-        
-        responsibilities = np.zeros( shape )
-        
         labels = {}
         for genome in constants.genomes:
             a = np.asarray( data.a[genome], dtype=np.float64 )
@@ -309,32 +304,25 @@ class ConanLatentVariables( EMLatentVariables ):
             d = a + b
             p = a / d
               
-            init_centers = np.linspace( 1, 0, self.nclass[genome] )                    
+            init_centers = get_restart_centers( np.linspace( 1, 0, self.nclass[genome] ), self.random_state )
             
-            clustering_result = kmeans2( p, init_centers, minit='matrix' )
+            cluster_centers, labels[genome] = cluster_frequencies( p, init_centers, self.kmeans_iters )
             
-            labels[genome] = clustering_result[1]
-            
-            print "Initial class ceneters : ", clustering_result[0]
+            print "Initial class ceneters : ", cluster_centers
 
         labels = self.nclass['normal'] * labels['normal'] + labels['tumour']
-
-        for id in range( self.ncomponents ):
-            indices = ( labels == id )
-            
-            responsibilities[indices, id] = 1.
         
-        self.responsibilities = responsibilities
+        self.responsibilities = get_indicator_responsibilities( labels, self.ncomponents )
         
 class ConanBetaBinomialLatentVariables( ConanLatentVariables ):
-    def __init__( self, data, nclass ):
-        ConanLatentVariables.__init__( self, data, nclass )
+    def __init__( self, data, nclass, responsibilities=None, seed=None ):
+        ConanLatentVariables.__init__( self, data, nclass, responsibilities, seed )
         
         self.likelihood_func = joint_beta_binomial_log_likelihood
         
 class ConanBinomialLatentVariables( ConanLatentVariables ):
-    def __init__( self, data, nclass ):
-        ConanLatentVariables.__init__( self, data, nclass )
+    def __init__( self, data, nclass, responsibilities=None, seed=None ):
+        ConanLatentVariables.__init__( self, data, nclass, responsibilities, seed )
         
         self.likelihood_func = joint_binomial_log_likelihood
 
@@ -362,6 +350,11 @@ class ConanBetaBinomialPosterior( ConanPosterior ):
     def __init__( self, data, priors, responsibilities, nclass ):
         self.nclass = nclass
         self.ncomponents = self.nclass['normal'] * self.nclass['tumour']
+        
+        self.histograms = {}
+        
+        for genome in constants.genomes:
+            self.histograms[genome] = CountHistogram( data.a[genome], data.b[genome] )
                
         EMPosterior.__init__( self, data, priors, responsibilities )
     
@@ -389,36 +382,16 @@ class ConanBetaBinomialPosterior( ConanPosterior ):
         
         print "Begining numerical optimisation of alpha and beta."
         
-        vars = []
-        
-        for genome in constants.genomes:
-            for component in range( self.nclass[genome] ):
-                a = self.data.a[genome]
-                b = self.data.b[genome]
-                
-                x = np.zeros( ( 2, ) )
-                
-                x[0] = self.parameters[genome]['alpha'][component]
-                x[1] = self.parameters[genome]['beta'][component]
-                
-                resp = marginals[genome][:, component]
-                
-                precision_prior = self.priors[genome]['precision']
-                location_prior = self.priors[genome]['location']
-                
-                vars.append( [x, a, b, resp, location_prior, precision_prior, component] )
-
-        pool = multiprocessing.Pool( processes=self.ncomponents, maxtasksperchild=1 )
-        results = pool.map( get_mle_p, vars )
-        pool.close()
-        
-        i = 0
         for genome in constants.genomes:
-            for component in range( self.nclass[genome] ):                
-                self.parameters[genome]['alpha'][component] = results[i][0]
-                self.parameters[genome]['beta'][component] = results[i][1]
-                
-                i += 1
+            precision_prior = self.priors[genome]['precision']
+            location_prior = self.priors[genome]['location']
+            
+            alpha, beta = get_map_estimates( self.parameters[genome]['alpha'], self.parameters[genome]['beta'],
+                                             self.histograms[genome], marginals[genome], location_prior,
+                                             precision_prior )
+            
+            self.parameters[genome]['alpha'] = alpha
+            self.parameters[genome]['beta'] = beta
 
 class ConanBinomialPosterior( ConanPosterior ):
     def __init__( self, data, priors, responsibilities, nclass=3 ):
@@ -452,15 +425,9 @@ class ConanBinomialPosterior( ConanPosterior ):
     def _update_mu( self, a, b, alpha, beta, tau ):       
         d = a + b
         
-        n = self.data.nrows
-        shape = ( n, 1 )
-        
-        a = a.reshape( shape )
-        d = d.reshape( shape )
-        
-        ref_sum = np.sum( tau * a, axis=0 )
+        ref_sum = np.dot( tau.T, a )
         
-        depth_sum = np.sum( tau * d, axis=0 )
+        depth_sum = np.dot( tau.T, d )
         
         numerator = ref_sum + alpha - 1.
         
@@ -5,6 +5,8 @@ Created on 2010-11-19
 '''
 class JointData( object ):
     def __init__( self, X ):
+        self.X = X
+        
         self.a = {}
         self.b = {}
         
@@ -15,9 +17,18 @@ class JointData( object ):
         self.b['tumour'] = X[:, 3]
         
         self.nrows = X.shape[0]
+    
+    def get_rows( self, indices ):
+        '''
+        Return a data set holding only the given rows.
+        '''
+        return JointData( self.X[indices] )
 
 class IndependentData( object ):
     def __init__( self, X, type ):
+        self.X = X
+        self.type = type
+        
         if type == 'normal':
             self.a = X[:, 0]
             self.b = X[:, 1]
@@ -28,15 +39,23 @@ class IndependentData( object ):
             raise SampleTypeException
         
         self.nrows = X.shape[0]
+    
+    def get_rows( self, indices ):
+        return IndependentData( self.X[indices], self.type )
         
 class MultinomialData( object ):
     def __init__( self, X ):
+        self.X = X
+        
         self.counts = {}
 
         self.counts['normal'] = X[:, :4]
         self.counts['tumour'] = X[:, 4:]
 
         self.nrows = X.shape[0]
+    
+    def get_rows( self, indices ):
+        return MultinomialData( self.X[indices] )
         
 class JointQualityData( object ):
     def __init__( self, X, normal_base_qualities, tumour_base_qualities ):
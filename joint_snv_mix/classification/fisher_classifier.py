@@ -4,6 +4,7 @@ Created on 2011-02-09
 @author: Andrew Roth
 '''
 import csv
+import multiprocessing
 
 import numpy as np
 
@@ -11,7 +12,8 @@ from fisher import pvalue_npy
 
 from joint_snv_mix import constants
 from joint_snv_mix.classification.data import JointData
-from joint_snv_mix.file_formats.jcnt import JointCountsReader
+from joint_snv_mix.classification.utils.blocks import BlockProfiler, get_block_size
+from joint_snv_mix.file_formats.jcnt import JointCountsReader, get_counts_from_rows
 
 
 def run_fisher(args):            
@@ -36,35 +38,82 @@ class FisherRunner(object):
         self.reader = JointCountsReader(args.jcnt_file_name)
         self.writer = csv.writer(open(args.tsv_file_name, 'w'), delimiter='\t')
         
-        chr_list = self.reader.get_chr_list()
+        # Number of blocks in memory at once, which share the memory budget.
+        if args.num_processes == 1:
+            self.window = 1
+        else:
+            self.window = 2 * args.num_processes
         
-        for chr_name in sorted(chr_list):
-            self._classify_chromosome(chr_name)
-                            
-        self.reader.close()
+        # Number of rows classified at once.
+        self.block_size = get_block_size(args.memory_budget, len(self.classes), self.window)
         
-    def _classify_chromosome(self, chr_name):
-        counts = self.reader.get_counts(chr_name)
-        jcnt_rows = self.reader.get_rows(chr_name)
+        self.profiler = BlockProfiler(args.profile_blocks)
         
-        end = self.reader.get_chr_size(chr_name)
-
-        n = int(1e5)
-        start = 0
-        stop = min(n, end)
-        
-        while start < end:
-            sub_counts = counts[start:stop]
-            sub_rows = jcnt_rows[start:stop]
-                              
-            data = self.data_class(sub_counts)            
+        blocks = self._get_blocks()
+        
+        if args.num_processes == 1:
+            for chr_name, start, stop in blocks:
+                self.profiler.start()
+                
+                rows, labels = classify_block(self.reader, self.model, self.data_class, chr_name, start, stop)
+                
+                self._write_rows(chr_name, rows, labels)
                 
-            labels = self.model.classify(data)
+                self.profiler.stop(chr_name, stop - start)
+                            
+            self.reader.close()
+        else:
+            # HDF5 file handles can not be shared across a fork so the workers open their own readers.
+            self.reader.close()
             
-            self._write_rows(chr_name, sub_rows, labels)
+            self._run_parallel(args, blocks)
+        
+        self.profiler.print_summary()
+    
+    def _get_blocks(self):
+        '''
+        Split the chromosomes into blocks of at most block_size rows.
+        
+        Return:
+        blocks -- List of (chr_name, start, stop) tuples in genomic order.
+        '''
+        blocks = []
+        
+        for chr_name in sorted(self.reader.get_chr_list()):
+            end = self.reader.get_chr_size(chr_name)
+            
+            for start in xrange(0, end, self.block_size):
+                blocks.append((chr_name, start, min(start + self.block_size, end)))
+        
+        return blocks
+    
+    def _run_parallel(self, args, blocks):
+        '''
+        Classify blocks in a pool of worker processes. Each worker opens its own reader and reads only the rows of the
+        blocks it is given. At most two blocks per worker are in flight so memory use does not grow with the input.
+        '''
+        pool = multiprocessing.Pool(processes=args.num_processes,
+                                    initializer=init_worker,
+                                    initargs=(args.jcnt_file_name, self.model, self.data_class))
         
-            start = stop
-            stop = min(stop + n, end)
+        window = self.window
+        
+        for i in xrange(0, len(blocks), window):
+            # imap returns results in the order of the blocks so output stays in genomic order.
+            results = pool.imap(classify_worker_block, blocks[i:i + window])
+            
+            # Blocks are timed from the end of the previous one so the throughput is that of the whole pool.
+            for chr_name, start, stop in blocks[i:i + window]:
+                self.profiler.start()
+                
+                rows, labels = results.next()
+                
+                self._write_rows(chr_name, rows, labels)
+                
+                self.profiler.stop(chr_name, stop - start)
+        
+        pool.close()
+        pool.join()
 
     def _write_rows(self, chr_name, rows, labels):
         for i, row in enumerate(rows):
@@ -82,6 +131,35 @@ class FisherRunner(object):
             
             self.writer.writerow(out_row)
 
+def classify_block(reader, model, data_class, chr_name, start, stop):
+    rows = reader.get_rows(chr_name, start, stop)
+    
+    data = data_class(get_counts_from_rows(rows))
+    
+    labels = model.classify(data)
+    
+    return rows, labels
+
+#=======================================================================================================================
+# Worker process state for parallel classification.
+#=======================================================================================================================
+worker_state = {}
+
+def init_worker(jcnt_file_name, model, data_class):
+    worker_state['reader'] = JointCountsReader(jcnt_file_name)
+    worker_state['model'] = model
+    worker_state['data_class'] = data_class
+
+def classify_worker_block(block):
+    chr_name, start, stop = block
+    
+    return classify_block(worker_state['reader'],
+                          worker_state['model'],
+                          worker_state['data_class'],
+                          chr_name,
+                          start,
+                          stop)
+
 class IndependentFisherRunner(FisherRunner):
     def __init__(self, args):
         self.model = IndependentFisherModel(args)
@@ -145,7 +223,7 @@ class FisherModel(object):
         '''
         Return 0 = ref, 1 = germline, 2 = somatic, 3 = loh, 4 = unkown
         '''
-        raise NotImplemented
+        raise NotImplementedError
     
     def _call_genotypes(self, data):
         genotypes = {}
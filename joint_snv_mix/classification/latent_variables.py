@@ -5,18 +5,38 @@ Created on 2010-09-15
 '''
 import numpy as np
 
-from scipy.cluster.vq import kmeans2
-
+from joint_snv_mix import constants
+from joint_snv_mix.classification.utils.initialisation import cluster_frequencies, cluster_proportions, \
+    get_indicator_responsibilities, get_genotype_proportions, get_restart_centers, kmeans_iters
+from joint_snv_mix.classification.utils.factorised_responsibilities import get_indicator_factorised_responsibilities
 from joint_snv_mix.classification.utils.normalise import log_space_normalise_rows
 from joint_snv_mix.classification.likelihoods import independent_beta_binomial_log_likelihood, \
     independent_binomial_log_likelihood, joint_beta_binomial_log_likelihood, joint_binomial_log_likelihood, \
-    joint_multinomial_log_likelihood
+    joint_multinomial_factorised_responsibilities
 
 class EMLatentVariables( object ):
-    def __init__( self, data ):       
+    def __init__( self, data, responsibilities=None, seed=None ):       
+        '''
+        Arguments:
+        responsibilities -- Initial responsibilities, for example from an E-step with the parameters of an earlier
+                            model. If None they are initialised by k-means clustering.
+        seed -- Seed used to perturb the initial k-means centres so restarts begin from different points. If None the
+                default centres are used.
+        '''
         self.data = data
         
-        self._init_responsibilities( data )
+        # Restarts skip k-means refinement which would return them to the clustering of the default centres.
+        if seed is None:
+            self.random_state = None
+            self.kmeans_iters = kmeans_iters
+        else:
+            self.random_state = np.random.RandomState( seed )
+            self.kmeans_iters = 0
+        
+        if responsibilities is None:
+            self._init_responsibilities( data )
+        else:
+            self.responsibilities = responsibilities
         
         self.likelihood_func = None
 
@@ -33,24 +53,13 @@ class IndependentLatenVariables( EMLatentVariables ):
         a = np.asarray( data.a, dtype=np.float64 )
         b = np.asarray( data.b, dtype=np.float64 )
         
-        shape = ( data.nrows, 3 )
-        
-        responsibilities = np.zeros( shape )
-        
         p = a / ( a + b )
         
-        init_centers = np.array( [1., 0.5, 0.] )
-        
-        cluster_centers, labels = kmeans2( p, init_centers )
-        
-        sorted_centers = np.argsort( cluster_centers )
+        init_centers = get_restart_centers( np.array( [1., 0.5, 0.] ), self.random_state )
         
-        for id in sorted_centers:
-            index = labels == id
-            
-            responsibilities[index, id] = 1.0
+        cluster_centers, labels = cluster_frequencies( p, init_centers, self.kmeans_iters )
         
-        self.responsibilities = responsibilities
+        self.responsibilities = get_indicator_responsibilities( labels, 3 )
 
 class JointLatentVariables( EMLatentVariables ):
     def _init_responsibilities( self, data ):
@@ -64,26 +73,28 @@ class JointLatentVariables( EMLatentVariables ):
         a_2 = np.asarray( data.a['tumour'], dtype=np.float64 )
         b_2 = np.asarray( data.b['tumour'], dtype=np.float64 )
         p_2 = a_2 / ( a_2 + b_2 )
-
-        shape = ( data.nrows, 9 )
-        
-        responsibilities = np.zeros( shape )
         
         init_centers = np.array( ( 1., 0.5, 0. ) )
         
-        cluster_centers_1, labels_1 = kmeans2( p_1, init_centers, minit='matrix' )
-        cluster_centers_2, labels_2 = kmeans2( p_2, init_centers, minit='matrix' )
+        cluster_centers_1, labels_1 = cluster_frequencies( p_1, get_restart_centers( init_centers, self.random_state ),
+                                                          self.kmeans_iters )
+        cluster_centers_2, labels_2 = cluster_frequencies( p_2, get_restart_centers( init_centers, self.random_state ),
+                                                          self.kmeans_iters )
 
         labels = 3 * labels_1 + labels_2
-
-        for id in range( 9 ):
-            index = labels == id
-            
-            responsibilities[index, id] = 1.
         
-        self.responsibilities = responsibilities
+        self.responsibilities = get_indicator_responsibilities( labels, 9 )
 
 class MultinomialLatentVariables( EMLatentVariables ):
+    '''
+    Responsibilities are held as FactorisedResponsibilities objects rather than N x nclass^2 matrices.
+    '''
+    # Genotypes of each genome.
+    genotypes = constants.multinomial_genotypes
+    
+    def update( self, parameters ):
+        self.responsibilities = self.responsibilities_func( self.data, parameters )
+    
     def _init_responsibilities( self, data ):
         '''
         Intialise responsibilities via k-means clustering.
@@ -96,48 +107,29 @@ class MultinomialLatentVariables( EMLatentVariables ):
         p_1 = counts_1 / counts_1.sum( axis=1 ).reshape( shape )
         p_2 = counts_2 / counts_2.sum( axis=1 ).reshape( shape )
         
-        shape = ( data.nrows, 100 )
-        
-        responsibilities = np.zeros( shape )
-        
-        init_centers = np.array( [
-                                  ( 1., 0., 0., 0. ),
-                                  ( 0.5, 0.5, 0., 0. ),
-                                  ( 0.5, 0., 0.5, 0. ),
-                                  ( 0.5, 0., 0., 0.5 ),
-                                  ( 0., 1., 0., 0. ),
-                                  ( 0., 0.5, 0.5, 0. ),
-                                  ( 0., 0.5, 0., 0.5 ),
-                                  ( 0., 0., 1., 0. ),
-                                  ( 0., 0., 0.5, 0.5 ),
-                                  ( 0., 0., 0., 1. )
-                                  ] )
-        
-        cluster_centers_1, labels_1 = kmeans2( p_1, init_centers, minit='matrix' )
-        cluster_centers_2, labels_2 = kmeans2( p_2, init_centers, minit='matrix' )
-
-        labels = 10 * labels_1 + labels_2
+        init_centers = get_genotype_proportions( self.genotypes )
+        
+        cluster_centers_1, labels_1 = cluster_proportions( p_1, get_restart_centers( init_centers, self.random_state ),
+                                                          self.kmeans_iters )
+        cluster_centers_2, labels_2 = cluster_proportions( p_2, get_restart_centers( init_centers, self.random_state ),
+                                                          self.kmeans_iters )
 
-        for id in range( 100 ):
-            index = labels == id
-            
-            responsibilities[index, :] = 0.
-            responsibilities[index, id] = 1.
+        labels = {'normal' : labels_1, 'tumour' : labels_2}
         
-        self.responsibilities = responsibilities
+        self.responsibilities = get_indicator_factorised_responsibilities( labels, len( self.genotypes ) )
 
 #=======================================================================================================================
 # Independent Models
 #=======================================================================================================================
 class IndependentBetaBinomialLatentVariables( IndependentLatenVariables ):
-    def __init__( self, data ):
-        IndependentLatenVariables.__init__( self, data )
+    def __init__( self, data, responsibilities=None, seed=None ):
+        IndependentLatenVariables.__init__( self, data, responsibilities, seed )
         
         self.likelihood_func = independent_beta_binomial_log_likelihood
         
 class IndependentBinomialLatentVariables( IndependentLatenVariables ):
-    def __init__( self, data ):
-        IndependentLatenVariables.__init__( self, data )
+    def __init__( self, data, responsibilities=None, seed=None ):
+        IndependentLatenVariables.__init__( self, data, responsibilities, seed )
         
         self.likelihood_func = independent_binomial_log_likelihood
 
@@ -145,14 +137,14 @@ class IndependentBinomialLatentVariables( IndependentLatenVariables ):
 # Joint Models
 #=======================================================================================================================
 class JointBetaBinomialLatentVariables( JointLatentVariables ):
-    def __init__( self, data ):
-        JointLatentVariables.__init__( self, data )
+    def __init__( self, data, responsibilities=None, seed=None ):
+        JointLatentVariables.__init__( self, data, responsibilities, seed )
         
         self.likelihood_func = joint_beta_binomial_log_likelihood
         
 class JointBinomialLatentVariables( JointLatentVariables ):
-    def __init__( self, data ):
-        JointLatentVariables.__init__( self, data )
+    def __init__( self, data, responsibilities=None, seed=None ):
+        JointLatentVariables.__init__( self, data, responsibilities, seed )
         
         self.likelihood_func = joint_binomial_log_likelihood
         
@@ -160,7 +152,15 @@ class JointBinomialLatentVariables( JointLatentVariables ):
 # Multinomial
 #=======================================================================================================================
 class JointMultinomialLatentVariables( MultinomialLatentVariables ):
-    def __init__( self, data ):
-        MultinomialLatentVariables.__init__( self, data )
+    def __init__( self, data, responsibilities=None, seed=None ):
+        MultinomialLatentVariables.__init__( self, data, responsibilities, seed )
+        
+        self.responsibilities_func = joint_multinomial_factorised_responsibilities
+        
+class JointExtendedMultinomialLatentVariables( MultinomialLatentVariables ):
+    genotypes = constants.extended_multinomial_genotypes
+    
+    def __init__( self, data, responsibilities=None, seed=None ):
+        MultinomialLatentVariables.__init__( self, data, responsibilities, seed )
         
-        self.likelihood_func = joint_multinomial_log_likelihood
+        self.responsibilities_func = joint_multinomial_factorised_responsibilities
@@ -6,6 +6,7 @@ Created on 2011-01-18
 import numpy as np
 from joint_snv_mix.classification.utils.log_pdf import log_beta_binomial_likelihood, log_binomial_likelihood,\
     log_multinomial_likelihood
+from joint_snv_mix.classification.utils.factorised_responsibilities import get_factorised_responsibilities
 from joint_snv_mix import constants
 
 #=======================================================================================================================
@@ -101,7 +102,11 @@ def get_joint_log_likelihoods( log_likelihoods, pi ):
 #=======================================================================================================================
 # Multinomial
 #=======================================================================================================================
-def joint_multinomial_log_likelihood( data, parameters ):
+def joint_multinomial_factorised_responsibilities( data, parameters ):
+    '''
+    Responsibilities of the joint multinomial model in factorised form, which avoids building an N x 100 log
+    likelihood matrix.
+    '''
     log_likelihoods = {}
     
     for genome in constants.genomes:
@@ -109,9 +114,7 @@ def joint_multinomial_log_likelihood( data, parameters ):
         rho = parameters[genome]['rho']
     
         log_likelihoods[genome] = log_multinomial_likelihood( counts, rho )
-
-    pi = parameters['pi']
     
-    log_likelihoods = get_joint_log_likelihoods( log_likelihoods, pi )
+    pi = parameters['pi']
     
-    return log_likelihoods
+    return get_factorised_responsibilities( log_likelihoods, pi )
@@ -9,7 +9,7 @@ from joint_snv_mix.classification.utils.log_pdf import log_dirichlet_pdf, log_be
     log_translated_gamma_pdf
 from joint_snv_mix.classification.likelihoods import independent_binomial_log_likelihood, \
     independent_beta_binomial_log_likelihood, joint_beta_binomial_log_likelihood, joint_binomial_log_likelihood, \
-    joint_multinomial_log_likelihood
+    joint_multinomial_factorised_responsibilities
 from joint_snv_mix import constants
 
 #=======================================================================================================================
@@ -52,7 +52,7 @@ class EMLowerBound( object ):
         return log_prior
 
     def _get_log_density_parameters_prior( self ):
-        raise NotImplemented
+        raise NotImplementedError
     
 #=======================================================================================================================
 # Independent Models
@@ -161,7 +161,12 @@ class JointMultinomialLowerBound( EMLowerBound ):
     def __init__( self, data, priors ):  
         EMLowerBound.__init__( self, data, priors )
         
-        self.log_likelihood_func = joint_multinomial_log_likelihood
+        self.responsibilities_func = joint_multinomial_factorised_responsibilities
+    
+    def _get_log_likelihood( self ):
+        responsibilities = self.responsibilities_func( self.data, self.parameters )
+        
+        return responsibilities.log_norm_const.sum()
     
     def _get_log_density_parameters_prior( self ):
         log_prior = 0.
@@ -4,6 +4,7 @@ Created on 2011-02-03
 @author: Andrew Roth
 '''
 import math
+import multiprocessing
 import random
 
 import numpy as np
@@ -21,9 +22,11 @@ from joint_snv_mix.classification.parameter_parsers import IndependentBinomialPa
 from joint_snv_mix.classification.prior_parsers import IndependentBetaBinomialPriorParser, \
     IndependentBinomialPriorParser, JointBinomialPriorParser, JointBetaBinomialPriorParser
 
+from joint_snv_mix.classification.utils.blocks import BlockProfiler, get_block_size
+
 from joint_snv_mix.file_formats.jcnt import JointCountsReader
 
-from joint_snv_mix.file_formats.jsm import JointSnvMixWriter
+from joint_snv_mix.file_formats.jsm import JointSnvMixReader, JointSnvMixWriter
 
 def run_snvmix(args):
     if args.priors_file is None:
@@ -55,10 +58,19 @@ def run_snvmix(args):
 # Classes
 #=======================================================================================================================
 class ModelRunner(object):
+    # Reader for files written by the runner, used to load parameters for --init_from.
+    init_reader_class = JointSnvMixReader
+    
     def run(self, args):        
         # Load parameters by training or from file.
         if args.train:
+            self._load_init_parameters(args)
+            
+            self.em_iterations = 0
+            
             self._train(args)
+            
+            self._write_em_iterations()
         else:
             self._load_parameters(args)
         
@@ -70,11 +82,65 @@ class ModelRunner(object):
         self.writer.close()
     
     def _classify(self, args):
+        self.block_size = get_block_size(args.memory_budget, self._get_nclass())
+        self.profiler = BlockProfiler(args.profile_blocks)
+        
         chr_list = self.reader.get_chr_list()
         
         for chr_name in sorted(chr_list):
+            self.writer.set_expected_rows(chr_name, self.reader.get_chr_size(chr_name))
+            
             self._classify_chromosome(chr_name)
+        
+        self.profiler.print_summary()
+    
+    def _get_nclass(self):
+        '''
+        Number of classes each row is given a responsibility for, used to size blocks.
+        '''
+        return self.parameters['pi'].size
             
+    def _load_parameters(self, args):
+        self.parameter_parser.load_from_file(args.params_file)
+        
+        self.parameters = self.parameter_parser.to_dict()
+    
+    def _load_init_parameters(self, args):
+        '''
+        Load the parameters of an earlier run to start EM from when --init_from is set.
+        '''
+        self.init_parameters = None
+        self.init_em_iterations = None
+        
+        if args.init_from is None:
+            return
+        
+        reader = self.init_reader_class(args.init_from)
+        
+        self.init_parameters = reader.get_parameters()
+        self.init_em_iterations = reader.get_em_iterations()
+        
+        reader.close()
+    
+    def _train_model(self, model, data, priors, args, init_parameters=None):
+        '''
+        Train a model, counting the EM iterations used towards the total for the run.
+        '''
+        parameters = model.train(data, priors, args.max_iters, args.convergence_threshold, init_parameters,
+                                 args.restarts, args.restart_iters, args.num_processes)
+        
+        self.em_iterations += model.iters
+        
+        return parameters
+    
+    def _write_em_iterations(self):
+        self.writer.set_em_iterations(self.em_iterations)
+        
+        print "EM iterations : ", self.em_iterations
+        
+        if self.init_em_iterations is not None:
+            print "EM iterations saved compared to initial model : ", self.init_em_iterations - self.em_iterations
+    
     def _write_parameters(self):
         self.writer.write_parameters(self.parameters)
         
@@ -115,7 +181,7 @@ class ModelRunner(object):
 class IndependentModelRunner(ModelRunner):
     def run(self, args):
         self.reader = JointCountsReader(args.jcnt_file_name)
-        self.writer = JointSnvMixWriter(args.jsm_file_name)
+        self.writer = JointSnvMixWriter(args.jsm_file_name, args.sparse_epsilon, args.storage_profile, args.shard)
         
         ModelRunner.run(self, args)
                  
@@ -132,11 +198,41 @@ class IndependentModelRunner(ModelRunner):
         
         self.parameters = {}
         
-        for genome in constants.genomes:
-            data = IndependentData(counts, genome)
+        if args.num_processes == 1:
+            for genome in constants.genomes:
+                data = IndependentData(counts, genome)
+                
+                self.parameters[genome] = self._train_model(self.model, data, self.priors[genome], args,
+                                                            self._get_init_parameters(genome))
+        else:
+            self._train_parallel(args, counts)
+    
+    def _train_parallel(self, args, counts):
+        '''
+        Train the normal and tumour models at the same time in a pool of two worker processes.
+        '''
+        pool = multiprocessing.Pool(processes=min(args.num_processes, len(constants.genomes)),
+                                    initializer=init_genome_worker,
+                                    initargs=(counts, args, self.model, self.priors))
+        
+        tasks = [(genome, self._get_init_parameters(genome)) for genome in constants.genomes]
+        
+        for genome, (parameters, iters) in zip(constants.genomes, pool.imap(train_worker_genome, tasks)):
+            self.parameters[genome] = parameters
             
-            self.parameters[genome] = self.model.train(data, self.priors[genome],
-                                                        args.max_iters, args.convergence_threshold)
+            self.em_iterations += iters
+        
+        pool.close()
+        pool.join()
+    
+    def _get_nclass(self):
+        return self.parameters['normal']['pi'].size * self.parameters['tumour']['pi'].size
+    
+    def _get_init_parameters(self, genome):
+        if self.init_parameters is None:
+            return None
+        else:
+            return self.init_parameters[genome]
                                     
     def _classify_chromosome(self, chr_name):
         counts = self.reader.get_counts(chr_name)
@@ -144,12 +240,14 @@ class IndependentModelRunner(ModelRunner):
         
         end = self.reader.get_chr_size(chr_name)
 
-        n = int(1e5)
+        n = self.block_size
         start = 0
         stop = min(n, end)
         
 
         while start < end:
+            self.profiler.start()
+            
             sub_counts = counts[start:stop]
             sub_rows = jcnt_rows[start:stop]
             
@@ -164,29 +262,25 @@ class IndependentModelRunner(ModelRunner):
         
             self.writer.write_data(chr_name, sub_rows, joint_resp)
             
+            self.profiler.stop(chr_name, stop - start)
+            
             start = stop
             stop = min(stop + n, end)
             
     def _get_joint_responsibilities(self, resp):
-        normal_resp = np.log(resp['normal'])
-        tumour_resp = np.log(resp['tumour'])
-        
-        n = normal_resp.shape[0]
-        
-        nclass_normal = normal_resp.shape[1] 
-        
-        column_shape = (n, 1)
-        
-        log_resp = []
-        
-        for i in range(nclass_normal): 
-            log_resp.append(normal_resp[:, i].reshape(column_shape) + tumour_resp)
+        '''
+        Joint responsibilities are the outer product of the normal and tumour responsibilities of each row, with the
+        normal class varying slowest.
+        '''
+        normal_resp = resp['normal']
+        tumour_resp = resp['tumour']
         
-        log_resp = np.hstack(log_resp)
+        n, nclass_normal = normal_resp.shape
+        nclass_tumour = tumour_resp.shape[1]
         
-        resp = np.exp(log_resp)
+        joint_resp = normal_resp.reshape((n, nclass_normal, 1)) * tumour_resp.reshape((n, 1, nclass_tumour))
         
-        return resp
+        return joint_resp.reshape((n, nclass_normal * nclass_tumour))
 
 class IndependentBinomialRunner(IndependentModelRunner):
     def __init__(self):
@@ -206,7 +300,7 @@ class IndependentBetaBinomialRunner(IndependentModelRunner):
 class JointModelRunner(ModelRunner):
     def run(self, args):
         self.reader = JointCountsReader(args.jcnt_file_name)
-        self.writer = JointSnvMixWriter(args.jsm_file_name)
+        self.writer = JointSnvMixWriter(args.jsm_file_name, args.sparse_epsilon, args.storage_profile, args.shard)
         
         ModelRunner.run(self, args)
                     
@@ -223,8 +317,7 @@ class JointModelRunner(ModelRunner):
         
         data = JointData(counts)
         
-        self.parameters = self.model.train(data, self.priors,
-                                            args.max_iters, args.convergence_threshold)
+        self.parameters = self._train_model(self.model, data, self.priors, args, self.init_parameters)
 
     def _classify_chromosome(self, chr_name):
         counts = self.reader.get_counts(chr_name)
@@ -232,12 +325,14 @@ class JointModelRunner(ModelRunner):
         
         end = self.reader.get_chr_size(chr_name)
 
-        n = int(1e5)
+        n = self.block_size
         start = 0
         stop = min(n, end)
         
 
         while start < end:
+            self.profiler.start()
+            
             sub_counts = counts[start:stop]
             sub_rows = jcnt_rows[start:stop]
                               
@@ -247,6 +342,8 @@ class JointModelRunner(ModelRunner):
         
             self.writer.write_data(chr_name, sub_rows, resp)
             
+            self.profiler.stop(chr_name, stop - start)
+            
             start = stop
             stop = min(stop + n, end)
     
@@ -267,33 +364,73 @@ class JointBetaBinomialRunner(JointModelRunner):
 #=======================================================================================================================
 class ChromosomeModelRunner(ModelRunner):
     def run(self, args):
-        self.reader = JointCountsReader(args.jcnt_file_name)
-        self.writer = JointSnvMixWriter(args.jsm_file_name)
+        self.reader = self._open_reader(args)
+        self.writer = JointSnvMixWriter(args.jsm_file_name, args.sparse_epsilon, args.storage_profile, args.shard)
         
         ModelRunner.run(self, args)
     
+    def _open_reader(self, args):
+        return JointCountsReader(args.jcnt_file_name)
+    
+    def _load_parameters(self, args):
+        '''
+        A params file holds a single parameter set which is used for every chromosome.
+        '''
+        self.parameter_parser.load_from_file(args.params_file)
+        
+        parameters = self.parameter_parser.to_dict()
+        
+        self.parameters = {}
+        
+        for chr_name in self.reader.get_chr_list():
+            self.parameters[chr_name] = parameters
+    
     def _train(self, args):                   
         self.priors_parser.load_from_file(args.priors_file)
         self.priors = self.priors_parser.to_dict()
         
         self._write_priors()
         
-        chr_list = self.reader.get_chr_list()
+        chr_list = sorted(self.reader.get_chr_list())
         
         self.parameters = {}
         
-        for chr_name in sorted(chr_list):
-            print chr_name
-            
-            if args.subsample_size > 0:
-                counts = self._chrom_subsample(chr_name, args.subsample_size)
-            else:        
-                counts = self.reader.get_counts(chr_name)
-            
-            data = self.data_class(counts)
+        if args.num_processes == 1:
+            for chr_name in chr_list:
+                print chr_name
+                
+                counts = get_chromosome_counts(self.reader, chr_name, args.subsample_size)
+                
+                data = self.data_class(counts)
+                
+                self.parameters[chr_name] = self._train_model(self.model, data, self.priors, args,
+                                                              self._get_init_parameters(chr_name))
+        else:
+            self._train_parallel(args, chr_list)
+    
+    def _train_parallel(self, args, chr_list):
+        '''
+        Train the chromosome models in a pool of worker processes. Each worker opens its own reader and reads only the
+        counts of the chromosomes it is given.
+        '''
+        # HDF5 file handles can not be shared across a fork so the reader is reopened once the workers are done.
+        self.reader.close()
+        
+        pool = multiprocessing.Pool(processes=args.num_processes,
+                                    initializer=init_train_worker,
+                                    initargs=(self._open_reader, args, self.model, self.data_class, self.priors))
+        
+        tasks = [(chr_name, self._get_init_parameters(chr_name)) for chr_name in chr_list]
+        
+        for chr_name, (parameters, iters) in zip(chr_list, pool.imap(train_worker_chromosome, tasks)):
+            self.parameters[chr_name] = parameters
             
-            self.parameters[chr_name] = self.model.train(data, self.priors,
-                                                          args.max_iters, args.convergence_threshold)
+            self.em_iterations += iters
+        
+        pool.close()
+        pool.join()
+        
+        self.reader = self._open_reader(args)
                         
     def _classify_chromosome(self, chr_name):
         counts = self.reader.get_counts(chr_name)
@@ -301,12 +438,14 @@ class ChromosomeModelRunner(ModelRunner):
         
         end = self.reader.get_chr_size(chr_name)
 
-        n = int(1e5)
+        n = self.block_size
         start = 0
         stop = min(n, end)
         
 
         while start < end:
+            self.profiler.start()
+            
             sub_counts = counts[start:stop]
             sub_rows = jcnt_rows[start:stop]
                               
@@ -316,21 +455,28 @@ class ChromosomeModelRunner(ModelRunner):
         
             self.writer.write_data(chr_name, sub_rows, resp)
             
+            self.profiler.stop(chr_name, stop - start)
+            
             start = stop
             stop = min(stop + n, end)
 
-    def _chrom_subsample(self, chr_name, sample_size):
-        chr_size = self.reader.get_chr_size(chr_name=chr_name)
-        
-        sample_size = min(chr_size, sample_size)
-        
-        chr_sample_indices = random.sample(xrange(chr_size), sample_size)
-        
-        chr_counts = self.reader.get_counts(chr_name)
-        
-        chr_sample = chr_counts[chr_sample_indices]
-        
-        return chr_sample
+    def _get_nclass(self):
+        return max(parameters['pi'].size for parameters in self.parameters.values())
+
+    def _get_init_parameters(self, chr_name):
+        '''
+        Initial parameters for a chromosome. Files from the chromosome model have a set per chromosome, otherwise the
+        single set of the file is used for all chromosomes.
+        '''
+        if self.init_parameters is None:
+            return None
+        elif chr_name in self.init_parameters:
+            return self.init_parameters[chr_name]
+        elif 'pi' in self.init_parameters:
+            return self.init_parameters
+        else:
+            return None
+
 
 class ChromosomeBinomialRunner(ChromosomeModelRunner):
     def __init__(self):
@@ -348,3 +494,84 @@ class ChromosomeBetaBinomialRunner(ChromosomeModelRunner):
         self.priors_parser = JointBetaBinomialPriorParser()
         self.parameter_parser = JointBetaBinomialParameterParser()
         
+
+def get_chromosome_counts(reader, chr_name, subsample_size=0):
+    '''
+    Read the counts of a chromosome, or a random subsample of them if subsample_size is positive.
+    '''
+    chr_counts = reader.get_counts(chr_name)
+    
+    if subsample_size <= 0:
+        return chr_counts
+    
+    chr_size = reader.get_chr_size(chr_name=chr_name)
+    
+    sample_size = min(chr_size, subsample_size)
+    
+    chr_sample_indices = random.sample(xrange(chr_size), sample_size)
+    
+    return chr_counts[chr_sample_indices]
+
+#=======================================================================================================================
+# Worker process state for parallel training.
+#=======================================================================================================================
+worker_state = {}
+
+def init_train_worker(open_reader, args, model, data_class, priors):
+    worker_state['reader'] = open_reader(args)
+    worker_state['args'] = args
+    worker_state['model'] = model
+    worker_state['data_class'] = data_class
+    worker_state['priors'] = priors
+
+def init_genome_worker(counts, args, model, priors):
+    worker_state['counts'] = counts
+    worker_state['args'] = args
+    worker_state['model'] = model
+    worker_state['priors'] = priors
+
+def train_worker_chromosome(task):
+    '''
+    Train the model of one chromosome.
+    
+    Return:
+    parameters -- Trained parameters.
+    iters -- Number of EM iterations used.
+    '''
+    chr_name, init_parameters = task
+    
+    args = worker_state['args']
+    model = worker_state['model']
+    
+    print chr_name
+    
+    counts = get_chromosome_counts(worker_state['reader'], chr_name, args.subsample_size)
+    
+    data = worker_state['data_class'](counts)
+    
+    # Pool workers cannot start processes of their own so restarts are trained serially.
+    parameters = model.train(data, worker_state['priors'], args.max_iters, args.convergence_threshold, init_parameters,
+                             args.restarts, args.restart_iters)
+    
+    return parameters, model.iters
+
+def train_worker_genome(task):
+    '''
+    Train the independent model of one genome.
+    
+    Return:
+    parameters -- Trained parameters.
+    iters -- Number of EM iterations used.
+    '''
+    genome, init_parameters = task
+    
+    args = worker_state['args']
+    model = worker_state['model']
+    
+    data = IndependentData(worker_state['counts'], genome)
+    
+    # Pool workers cannot start processes of their own so restarts are trained serially.
+    parameters = model.train(data, worker_state['priors'][genome], args.max_iters, args.convergence_threshold,
+                             init_parameters, args.restarts, args.restart_iters)
+    
+    return parameters, model.iters
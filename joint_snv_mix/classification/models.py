@@ -3,48 +3,129 @@ Created on 2010-11-22
 
 @author: Andrew Roth
 '''
+import copy
+import multiprocessing
+import random
+
 import numpy as np
 #np.seterr( invalid='raise' )
 
 from joint_snv_mix.classification.latent_variables import IndependentBinomialLatentVariables, IndependentBetaBinomialLatentVariables, JointBetaBinomialLatentVariables, JointBinomialLatentVariables,\
-    JointMultinomialLatentVariables
+    JointMultinomialLatentVariables, JointExtendedMultinomialLatentVariables
 from joint_snv_mix.classification.likelihoods import independent_binomial_log_likelihood, independent_beta_binomial_log_likelihood, joint_beta_binomial_log_likelihood, joint_binomial_log_likelihood,\
-    joint_multinomial_log_likelihood
+    joint_multinomial_factorised_responsibilities
 from joint_snv_mix.classification.lower_bounds import IndependenBinomialLowerBound, IndependentBetaBinomialLowerBound, JointBetaBinomialLowerBound, JointBinomialLowerBound,\
     JointMultinomialLowerBound
 from joint_snv_mix.classification.posteriors import IndependentBinomialPosterior, IndependentBetaBinomialPosterior, JointBetaBinomialPosterior, JointBinomialPosterior,\
     JointMultinomialPosterior
 from joint_snv_mix.classification.utils.normalise import log_space_normalise_rows
 
+# Maximum number of rows used to compare restarts.
+restart_sample_size = 100000
+
 class EMModel( object ):
     def __init__( self ):
         self.trainer_class = None
         self.log_likelihood_func = None
         
     
-    def train( self, data, priors, max_iters, tolerance ):
+    def train( self, data, priors, max_iters, tolerance, init_parameters=None, restarts=1, restart_iters=10,
+               num_processes=1 ):
         '''
-        Train the model using EM.
+        Train the model using EM. The number of iterations used is stored in iters.
         
         Input: JointData object
-        '''   
-        trainer = self.trainer_class( data, max_iters, tolerance, priors )
+        
+        init_parameters -- Parameters of an earlier model. If set training starts from an E-step with these parameters
+                           instead of k-means clustering.
+        restarts -- Number of initialisations tried when init_parameters is not set. The default k-means start and
+                    restarts - 1 randomly perturbed ones are each trained for restart_iters iterations on a subsample
+                    of at most restart_sample_size rows. Training on the full data continues from the start with the
+                    largest lower bound.
+        num_processes -- Number of processes used to train the restarts.
+        '''
+        if init_parameters is None and restarts > 1:
+            init_parameters = self._get_best_restart( data, priors, tolerance, restarts, restart_iters, num_processes )
+        
+        if init_parameters is None:
+            responsibilities = None
+        else:
+            responsibilities = self._get_responsibilities( data, init_parameters )
+           
+        trainer = self._get_trainer( data, priors, max_iters, tolerance, responsibilities, init_parameters )
         
         parameters = trainer.run()
         
+        self.iters = trainer.iters
+        
         trainer.responsibilities = []
                 
         return parameters
 
     def classify( self, data, parameters ):
+        return self._get_responsibilities( data, parameters )
+    
+    def _get_responsibilities( self, data, parameters ):
+        '''
+        Responsibilities in the form used by the trainer.
+        '''
         log_responsibilities = self.log_likelihood_func( data, parameters )
         
         responsibilities = log_space_normalise_rows( log_responsibilities )
         
         return responsibilities
+    
+    def _get_trainer( self, data, priors, max_iters, tolerance, responsibilities=None, parameters=None, seed=None ):
+        return self.trainer_class( data, max_iters, tolerance, priors, responsibilities, parameters, seed )
+    
+    def _get_best_restart( self, data, priors, tolerance, restarts, restart_iters, num_processes ):
+        '''
+        Train each restart briefly on a common subsample and return the parameters of the one with the largest lower
+        bound. Restart 0 uses the default initialisation.
+        '''
+        if data.nrows > restart_sample_size:
+            indices = sorted( random.sample( xrange( data.nrows ), restart_sample_size ) )
+            
+            data = data.get_rows( indices )
+        
+        seeds = [None] + range( 1, restarts )
+        
+        if num_processes == 1:
+            results = [self._train_restart( data, priors, restart_iters, tolerance, seed ) for seed in seeds]
+        else:
+            pool = multiprocessing.Pool( processes=min( num_processes, restarts ),
+                                         initializer=init_restart_worker,
+                                         initargs=( self, data, priors, restart_iters, tolerance ) )
+            
+            results = pool.map( train_worker_restart, seeds )
+            
+            pool.close()
+            pool.join()
+        
+        lower_bounds = [lower_bound for parameters, lower_bound in results]
+        
+        best_restart = int( np.argmax( lower_bounds ) )
+        
+        print "Restart lower bounds : ", lower_bounds
+        print "Continuing from restart : ", best_restart
+        
+        return results[best_restart][0]
+    
+    def _train_restart( self, data, priors, max_iters, tolerance, seed ):
+        trainer = self._get_trainer( data, priors, max_iters, tolerance, seed=seed )
+        
+        parameters = trainer.run()
+        
+        return parameters, trainer.lower_bound.get_lower_bound( parameters )
 
 class EMModelTrainer( object ):
-    def __init__( self, data, max_iters, tolerance, priors ):
+    def __init__( self, data, max_iters, tolerance, priors, responsibilities=None, parameters=None, seed=None ):
+        '''
+        Arguments:
+        responsibilities -- Initial responsibilities. If None they are set by k-means clustering.
+        parameters -- Initial parameters. If None they are set from the priors and initial responsibilities.
+        seed -- Seed used to perturb the k-means initialisation, see EMLatentVariables.
+        '''
         self.max_iters = max_iters
         
         self.tolerance = tolerance
@@ -52,9 +133,17 @@ class EMModelTrainer( object ):
         self.data = data
 
         self.priors = priors
+        
+        self.init_responsibilities = responsibilities
+        
+        self.seed = seed
             
         self._init_components()
         
+        if parameters is not None:
+            # The posterior updates parameter arrays in place so the caller's copy is left alone.
+            self.posterior.parameters = copy.deepcopy( parameters )
+        
     def run( self ):
         iters = 0
         converged = False
@@ -88,6 +177,8 @@ class EMModelTrainer( object ):
                 converged = True
             
             iters += 1
+        
+        self.iters = iters
                      
         return self.parameters
                   
@@ -114,7 +205,7 @@ class EMModelTrainer( object ):
             print param_name, param_value     
     
     def _init_components( self ):
-        raise NotImplemented
+        raise NotImplementedError
 
 #=======================================================================================================================
 # Independent Models
@@ -127,7 +218,8 @@ class IndependenBetaBinomialModel( EMModel ):
 
 class IndependenBetaBinomialTrainer( EMModelTrainer ):
     def _init_components( self ):
-        self.latent_variables = IndependentBetaBinomialLatentVariables( self.data )
+        self.latent_variables = IndependentBetaBinomialLatentVariables( self.data, self.init_responsibilities,
+                                                                        self.seed )
         
         self.responsibilities = self.latent_variables.responsibilities
         
@@ -143,7 +235,7 @@ class IndependentBinomialModel( EMModel ):
 
 class IndependentBinomialModelTrainer( EMModelTrainer ):
     def _init_components( self ):
-        self.latent_variables = IndependentBinomialLatentVariables( self.data )
+        self.latent_variables = IndependentBinomialLatentVariables( self.data, self.init_responsibilities, self.seed )
         
         self.responsibilities = self.latent_variables.responsibilities
         
@@ -162,7 +254,7 @@ class JointBetaBinomialModel( EMModel ):
 
 class JointBetaBinomialModelTrainer( EMModelTrainer ):
     def _init_components( self ):
-        self.latent_variables = JointBetaBinomialLatentVariables( self.data )
+        self.latent_variables = JointBetaBinomialLatentVariables( self.data, self.init_responsibilities, self.seed )
         
         self.responsibilities = self.latent_variables.responsibilities
         
@@ -178,7 +270,7 @@ class JointBinomialModel( EMModel ):
 
 class JointBinomialModelTrainer( EMModelTrainer ):
     def _init_components( self ):
-        self.latent_variables = JointBinomialLatentVariables( self.data )
+        self.latent_variables = JointBinomialLatentVariables( self.data, self.init_responsibilities, self.seed )
         
         self.responsibilities = self.latent_variables.responsibilities
         
@@ -190,17 +282,69 @@ class JointBinomialModelTrainer( EMModelTrainer ):
 # Multinomial
 #=======================================================================================================================
 class JointMultinomialModel( EMModel ):
+    '''
+    Training works with factorised responsibilities, the full responsibility matrix is only built by classify.
+    '''
     def __init__( self ):
         self.trainer_class = JointMultinomialModelTrainer
         
-        self.log_likelihood_func = joint_multinomial_log_likelihood
+        self.responsibilities_func = joint_multinomial_factorised_responsibilities
+    
+    def classify( self, data, parameters ):
+        return self.get_factorised_responsibilities( data, parameters ).to_array()
+    
+    def get_factorised_responsibilities( self, data, parameters ):
+        return self.responsibilities_func( data, parameters )
+    
+    def _get_responsibilities( self, data, parameters ):
+        return self.get_factorised_responsibilities( data, parameters )
 
 class JointMultinomialModelTrainer( EMModelTrainer ):
     def _init_components( self ):
-        self.latent_variables = JointMultinomialLatentVariables( self.data )
+        self.latent_variables = JointMultinomialLatentVariables( self.data, self.init_responsibilities, self.seed )
         
         self.responsibilities = self.latent_variables.responsibilities
         
         self.posterior = JointMultinomialPosterior( self.data, self.priors, self.responsibilities )
         
-        self.lower_bound = JointMultinomialLowerBound( self.data, self.priors )
\ No newline at end of file
+        self.lower_bound = JointMultinomialLowerBound( self.data, self.priors )
+        
+class JointExtendedMultinomialModel( JointMultinomialModel ):
+    '''
+    Joint multinomial model with the tri and tetra-allelic genotypes of constants.extended_multinomial_genotypes.
+    '''
+    def __init__( self ):
+        self.trainer_class = JointExtendedMultinomialModelTrainer
+        
+        self.responsibilities_func = joint_multinomial_factorised_responsibilities
+
+class JointExtendedMultinomialModelTrainer( EMModelTrainer ):
+    def _init_components( self ):
+        self.latent_variables = JointExtendedMultinomialLatentVariables( self.data, self.init_responsibilities,
+                                                                         self.seed )
+        
+        self.responsibilities = self.latent_variables.responsibilities
+        
+        nclass = len( self.latent_variables.genotypes )
+        
+        self.posterior = JointMultinomialPosterior( self.data, self.priors, self.responsibilities, nclass )
+        
+        self.lower_bound = JointMultinomialLowerBound( self.data, self.priors )
+
+#=======================================================================================================================
+# Worker process state for parallel restarts.
+#=======================================================================================================================
+worker_state = {}
+
+def init_restart_worker( model, data, priors, max_iters, tolerance ):
+    worker_state['model'] = model
+    worker_state['data'] = data
+    worker_state['priors'] = priors
+    worker_state['max_iters'] = max_iters
+    worker_state['tolerance'] = tolerance
+
+def train_worker_restart( seed ):
+    model = worker_state['model']
+    
+    return model._train_restart( worker_state['data'], worker_state['priors'], worker_state['max_iters'],
+                                 worker_state['tolerance'], seed )
@@ -3,12 +3,19 @@ Created on 2011-02-22
 
 @author: Andrew Roth
 '''
+import numpy as np
+
+from joint_snv_mix import constants
 from joint_snv_mix.classification.data import MultinomialData
 from joint_snv_mix.classification.model_runners import ModelRunner, ChromosomeModelRunner
-from joint_snv_mix.classification.models import JointMultinomialModel
-from joint_snv_mix.classification.parameter_parsers import JointMultinomialParameterParser
-from joint_snv_mix.classification.prior_parsers import JointMultinomialPriorParser
-from joint_snv_mix.file_formats.jmm import JointMultiMixWriter
+from joint_snv_mix.classification.models import JointMultinomialModel, JointExtendedMultinomialModel
+from joint_snv_mix.classification.parameter_parsers import JointMultinomialParameterParser, \
+    JointExtendedMultinomialParameterParser
+from joint_snv_mix.classification.prior_parsers import JointMultinomialPriorParser, \
+    JointExtendedMultinomialPriorParser
+from joint_snv_mix.file_formats.jemm import JointExtendedMultiMixReader, JointExtendedMultiMixWriter, \
+    default_sparse_epsilon
+from joint_snv_mix.file_formats.jmm import JointMultiMixReader, JointMultiMixWriter
 from joint_snv_mix.file_formats.mcnt import MultinomialCountsReader
 
 def run_multimix(args):
@@ -21,6 +28,8 @@ def run_multimix(args):
         runner = JointMultinomialRunner()    
     elif args.model == "chromosome":
         runner = ChromosomeMultinomialRunner()
+    elif args.model == "extended":
+        runner = JointExtendedMultinomialRunner()
             
     runner.run(args)
 
@@ -28,9 +37,11 @@ def run_multimix(args):
 # Runner
 #=======================================================================================================================
 class MultinomialModelRunner(ModelRunner):
+    init_reader_class = JointMultiMixReader
+    
     def run(self, args):
         self.reader = MultinomialCountsReader(args.mcnt_file_name)
-        self.writer = JointMultiMixWriter(args.jmm_file_name)
+        self.writer = JointMultiMixWriter(args.jmm_file_name, args.sparse_epsilon, args.storage_profile)
         
         ModelRunner.run(self, args)
                
@@ -47,8 +58,7 @@ class MultinomialModelRunner(ModelRunner):
         
         data = MultinomialData(counts)
         
-        self.parameters = self.model.train(data, self.priors,
-                                            args.max_iters, args.convergence_threshold)
+        self.parameters = self._train_model(self.model, data, self.priors, args, self.init_parameters)
 
     def _classify_chromosome(self, chr_name):
         counts = self.reader.get_counts(chr_name)
@@ -56,31 +66,98 @@ class MultinomialModelRunner(ModelRunner):
         
         end = self.reader.get_chr_size(chr_name)
 
-        n = int(1e5)
+        n = self.block_size
         start = 0
         stop = min(n, end)
         
 
         while start < end:
+            self.profiler.start()
+            
             sub_counts = counts[start:stop]
             sub_rows = jcnt_rows[start:stop]
                               
             data = MultinomialData(sub_counts)            
                 
-            resp = self.model.classify(data, self.parameters)
-        
-            self.writer.write_data(chr_name, sub_rows, resp)
+            self._write_block(chr_name, sub_rows, data)
+            
+            self.profiler.stop(chr_name, stop - start)
             
             start = stop
             stop = min(stop + n, end)
     
+    def _write_block(self, chr_name, rows, data):
+        resp = self.model.classify(data, self.parameters)
+        
+        self.writer.write_data(chr_name, rows, resp)
+    
 class JointMultinomialRunner(MultinomialModelRunner):
     def __init__(self):
         self.model = JointMultinomialModel()
         self.priors_parser = JointMultinomialPriorParser()
         self.parameter_parser = JointMultinomialParameterParser()
         
+class JointExtendedMultinomialRunner(MultinomialModelRunner):
+    '''
+    Runner for the extended multinomial model. Output is always sparse, only positions whose mass off the homozygous
+    reference genotype is above the sparse threshold have their 225 genotype probabilities computed and stored.
+    '''
+    init_reader_class = JointExtendedMultiMixReader
+    
+    def __init__(self):
+        self.model = JointExtendedMultinomialModel()
+        self.priors_parser = JointExtendedMultinomialPriorParser()
+        self.parameter_parser = JointExtendedMultinomialParameterParser()
+    
+    def run(self, args):
+        if args.sparse_epsilon is None:
+            self.sparse_epsilon = default_sparse_epsilon
+        else:
+            self.sparse_epsilon = args.sparse_epsilon
+        
+        self.reader = MultinomialCountsReader(args.mcnt_file_name)
+        self.writer = JointExtendedMultiMixWriter(args.jmm_file_name, self.sparse_epsilon, args.storage_profile)
+        
+        ModelRunner.run(self, args)
+    
+    def _write_block(self, chr_name, rows, data):
+        resp = self.model.get_factorised_responsibilities(data, self.parameters)
+        
+        non_ref_indices = self._get_non_reference_indices(rows, resp)
+        
+        self.writer.write_reference_rows(chr_name, rows[~non_ref_indices])
+        
+        self.writer.write_data(chr_name, rows[non_ref_indices], resp.to_array(non_ref_indices))
+    
+    def _get_non_reference_indices(self, mcnt_rows, responsibilities):
+        '''
+        Find rows whose mass off the homozygous reference genotype exceeds the sparse threshold, computed from the
+        factorised responsibilities. Rows with an ambiguous reference base are always kept.
+        '''
+        ref_bases = mcnt_rows['ref_base']
+        
+        nrows = responsibilities.nrows
+        
+        ref_classes = np.zeros((nrows,), dtype=np.int)
+        
+        known_ref_base = np.zeros((nrows,), dtype=np.bool)
+        
+        for nucleotide, genotype_index in constants.extended_multinomial_reference_genotype_indices.items():
+            nucleotide_rows = (ref_bases == nucleotide)
+            
+            ref_classes[nucleotide_rows] = genotype_index
+            
+            known_ref_base[nucleotide_rows] = True
+        
+        ref_mass = responsibilities.get_joint_class_responsibilities(ref_classes)
+        
+        ref_mass[~known_ref_base] = 0
+        
+        return (1 - ref_mass) > self.sparse_epsilon
+        
 class ChromosomeMultinomialRunner(ChromosomeModelRunner):
+    init_reader_class = JointMultiMixReader
+    
     def __init__(self):
         self.data_class = MultinomialData
         
@@ -89,7 +166,10 @@ class ChromosomeMultinomialRunner(ChromosomeModelRunner):
         self.parameter_parser = JointMultinomialParameterParser()
         
     def run(self, args):
-        self.reader = MultinomialCountsReader(args.jcnt_file_name)
-        self.writer = JointMultiMixWriter(args.jsm_file_name)
+        self.reader = self._open_reader(args)
+        self.writer = JointMultiMixWriter(args.jmm_file_name, args.sparse_epsilon, args.storage_profile)
         
         ModelRunner.run(self, args)
+    
+    def _open_reader(self, args):
+        return MultinomialCountsReader(args.mcnt_file_name)
@@ -29,11 +29,32 @@ class ParameterParser( object ):
         self._load_mix_weights()
         self._load_density_parameters()
         
+    def save_to_file( self, file_name, parameters ):
+        '''
+        Write a parameters dictionary, as produced by training a model, in the format read by load_from_file. Values
+        are written at full precision so the loaded parameters match the trained ones.
+        '''
+        self.parameters = parameters
+        
+        self.parser = ConfigParser()
+        
+        self._save_density_parameters()
+        self._save_mix_weights()
+        
+        fh = open( file_name, 'w' )
+        
+        self.parser.write( fh )
+        
+        fh.close()
+        
     def to_dict( self ):
         return self.parameters
         
     def _load_mix_weights( self ):       
-        raise NotImplemented
+        raise NotImplementedError
+    
+    def _save_mix_weights( self ):
+        raise NotImplementedError
     
     def _load_density_parameters( self ):        
         for genome in constants.genomes:
@@ -47,6 +68,23 @@ class ParameterParser( object ):
             genome_genotype = "_".join( ( genome, genotype ) )
             
             self.parameters[genome][param_name][i] = self.parser.getfloat( param_name, genome_genotype )
+    
+    def _save_density_parameters( self ):
+        for param_name in self.parameter_names:
+            self.parser.add_section( param_name )
+            
+            for genome in constants.genomes:
+                self._save_parameter( genome, param_name )
+    
+    def _save_parameter( self, genome, param_name ):
+        for i, genotype in enumerate( constants.genotypes ):
+            genome_genotype = "_".join( ( genome, genotype ) )
+            
+            self.parser.set( param_name, genome_genotype, format_value( self.parameters[genome][param_name][i] ) )
+
+def format_value( value ):
+    # repr gives the shortest string which reads back as the same float.
+    return repr( float( value ) )
             
 #=======================================================================================================================
 # Independent Models
@@ -62,6 +100,15 @@ class IndepedendentParameterParser( ParameterParser ):
                 pi[i] = self.parser.getfloat( 'pi', genome_genotype )
                 
             self.parameters[genome]['pi'] = pi / pi.sum()
+    
+    def _save_mix_weights( self ):
+        self.parser.add_section( 'pi' )
+        
+        for genome in constants.genomes:
+            for i, genotype in enumerate( constants.genotypes ):
+                genome_genotype = "_".join( ( genome, genotype ) )
+                
+                self.parser.set( 'pi', genome_genotype, format_value( self.parameters[genome]['pi'][i] ) )
                 
 class IndependentBinomialParameterParser( IndepedendentParameterParser ):
     def __init__( self ):
@@ -93,6 +140,14 @@ class JointParameterParser( ParameterParser ):
             pi[i] = self.parser.getfloat( 'pi', genotype )
             
         self.parameters['pi'] = pi / pi.sum()
+    
+    def _save_mix_weights( self ):
+        self.parser.add_section( 'pi' )
+        
+        for i, genotype_tuple in enumerate( constants.joint_genotypes ):
+            genotype = "_".join( genotype_tuple )
+            
+            self.parser.set( 'pi', genotype, format_value( self.parameters['pi'][i] ) )
             
 class JointBinomialParameterParser( JointParameterParser ):
     def __init__( self ):
@@ -110,26 +165,75 @@ class JointBetaBinomialParameterParser( JointParameterParser ):
 # Multinomial
 #=======================================================================================================================
 class MultinomialParameterParser( ParameterParser ):
-    def __init__( self ):
+    '''
+    Parameters of each genotype are base probabilities, stored with keys of the form normal_AC_G.
+    '''
+    def __init__( self, genotypes=constants.multinomial_genotypes,
+                  joint_genotypes=constants.joint_multinomial_genotypes ):
         ParameterParser.__init__( self )
         
+        self.genotypes = genotypes
+        self.joint_genotypes = joint_genotypes
+        
+        self.nclass['normal'] = len( genotypes )
+        self.nclass['tumour'] = len( genotypes )
+        
         self.ncomponent = self.nclass['normal'] * self.nclass['tumour']
 
     def _load_mix_weights( self ):       
         pi = np.zeros( ( self.ncomponent, ) )
             
-        for i, genotype_tuple in enumerate( constants.multinomial_genotypes ):
+        for i, genotype_tuple in enumerate( self.joint_genotypes ):
             genotype = "_".join( genotype_tuple )
         
             pi[i] = self.parser.getfloat( 'pi', genotype )
             
         self.parameters['pi'] = pi / pi.sum()
+    
+    def _save_mix_weights( self ):
+        self.parser.add_section( 'pi' )
+        
+        for i, genotype_tuple in enumerate( self.joint_genotypes ):
+            genotype = "_".join( genotype_tuple )
+            
+            self.parser.set( 'pi', genotype, format_value( self.parameters['pi'][i] ) )
+    
+    def _load_density_parameters( self ):
+        for genome in constants.genomes:
+            for param_name in self.parameter_names:
+                self.parameters[genome][param_name] = np.zeros( ( self.nclass[genome], len( constants.nucleotides ) ) )
+                
+                self._load_parameter( genome, param_name )
+    
+    def _load_parameter( self, genome, param_name ):
+        for i, genotype in enumerate( self.genotypes ):
+            for j, nuc in enumerate( constants.nucleotides ):
+                genome_genotype_nuc = "_".join( ( genome, genotype, nuc ) )
+                
+                self.parameters[genome][param_name][i, j] = self.parser.getfloat( param_name, genome_genotype_nuc )
+    
+    def _save_parameter( self, genome, param_name ):
+        for i, genotype in enumerate( self.genotypes ):
+            for j, nuc in enumerate( constants.nucleotides ):
+                genome_genotype_nuc = "_".join( ( genome, genotype, nuc ) )
+                
+                value = format_value( self.parameters[genome][param_name][i, j] )
+                
+                self.parser.set( param_name, genome_genotype_nuc, value )
             
 class JointMultinomialParameterParser( MultinomialParameterParser ):
     def __init__( self ):
         MultinomialParameterParser.__init__( self )
         
-        self.parameter_names = ( 'mu', )
+        self.parameter_names = ( 'rho', )
+
+class JointExtendedMultinomialParameterParser( MultinomialParameterParser ):
+    def __init__( self ):
+        MultinomialParameterParser.__init__( self,
+                                             constants.extended_multinomial_genotypes,
+                                             constants.joint_extended_multinomial_genotypes )
+        
+        self.parameter_names = ( 'rho', )
 
         
 if __name__ == "__main__":
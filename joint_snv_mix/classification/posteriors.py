@@ -4,8 +4,7 @@ Created on 2011-01-18
 @author: Andrew Roth
 '''
 import numpy as np
-import multiprocessing
-from joint_snv_mix.classification.utils.beta_binomial_map_estimators import get_mle_p
+from joint_snv_mix.classification.utils.beta_binomial_map_estimators import get_map_estimates, CountHistogram
 from joint_snv_mix import constants
 
 def get_marginals( responsibilities, nclass ):
@@ -34,7 +33,7 @@ class EMPosterior( object ):
         self._init_parameters()
     
     def _init_parameters( self ):
-        raise NotImplemented
+        raise NotImplementedError
 
     def update( self, responsibilities ):
         self.responsibilities = responsibilities     
@@ -44,25 +43,28 @@ class EMPosterior( object ):
         self._update_density_parameters()
 
     def _update_mix_weights( self ):
-        N_g = self.responsibilities.sum( axis=0 )
+        N_g = self._get_class_counts()
 
         mix_weights = N_g + self.priors['kappa'] - 1
 
         mix_weights = np.exp( np.log( mix_weights ) - np.log( mix_weights.sum() ) )
 
         self.parameters['pi'] = mix_weights
+    
+    def _get_class_counts( self ):
+        return self.responsibilities.sum( axis=0 )
         
     def _update_density_parameters( self ):
-        raise NotImplemented
+        raise NotImplementedError
     
 #=======================================================================================================================
 # Independent Models
 #=======================================================================================================================
 class IndependentBetaBinomialPosterior( EMPosterior ):
     def __init__( self, data, priors, responsibilities ):
-        EMPosterior.__init__( self, data, priors, responsibilities )
+        self.histogram = CountHistogram( data.a, data.b )
         
-        self.pool = multiprocessing.Pool( maxtasksperchild=1 )
+        EMPosterior.__init__( self, data, priors, responsibilities )
     
     def _init_parameters( self ):
         '''
@@ -79,33 +81,14 @@ class IndependentBetaBinomialPosterior( EMPosterior ):
         print "Initial parameter values : ", self.parameters
     
     def _update_density_parameters( self ):        
-        a = self.data.a
-        b = self.data.b
+        precision_prior = self.priors['precision']
+        location_prior = self.priors['location']
         
-        vars = []
-              
-        for component in range( 3 ):
-            x = np.zeros( ( 2, ) )
-            
-            x[0] = self.parameters['alpha'][component]
-            x[1] = self.parameters['beta'][component]
-            
-            resp = self.responsibilities[:, component]
-            
-            precision_prior = self.priors['precision']
-            location_prior = self.priors['location']
-            
-            vars.append( [x, a, b, resp, location_prior, precision_prior, component] )
-                
-#        results = self.pool.map( get_mle_p, vars )
-        
-        results = []        
-        for var in vars:
-            results.append( get_mle_p( var ) )
+        alpha, beta = get_map_estimates( self.parameters['alpha'], self.parameters['beta'], self.histogram,
+                                         self.responsibilities, location_prior, precision_prior )
         
-        for component in range( 3 ):
-            self.parameters['alpha'][component] = results[component][0]
-            self.parameters['beta'][component] = results[component][1]
+        self.parameters['alpha'] = alpha
+        self.parameters['beta'] = beta
 
 class IndependentBinomialPosterior( EMPosterior ):
     def _init_parameters( self ):
@@ -125,18 +108,15 @@ class IndependentBinomialPosterior( EMPosterior ):
         b = self.data.b
         d = a + b
         
-        shape = ( self.data.nrows, 1 )
-        a = a.reshape( shape )
-        d = d.reshape( shape )
-        
         alpha = self.priors['mu']['alpha']
         beta = self.priors['mu']['beta']
         
         resp = self.responsibilities
         
-        a_bar = np.sum( resp * a, axis=0 )
+        # Weighted sums as matrix products so no N x K temporaries are created.
+        a_bar = np.dot( resp.T, a )
         
-        d_bar = np.sum( resp * d, axis=0 )
+        d_bar = np.dot( resp.T, d )
         
         numerator = a_bar + alpha - 1
         denominator = d_bar + alpha + beta - 2
@@ -149,6 +129,11 @@ class IndependentBinomialPosterior( EMPosterior ):
 class JointBetaBinomialPosterior( EMPosterior ):
     def __init__( self, data, priors, responsibilities, nclass=3 ):
         self.nclass = nclass
+        
+        self.histograms = {}
+        
+        for genome in constants.genomes:
+            self.histograms[genome] = CountHistogram( data.a[genome], data.b[genome] )
                
         EMPosterior.__init__( self, data, priors, responsibilities )
     
@@ -192,41 +177,16 @@ class JointBetaBinomialPosterior( EMPosterior ):
         
         print "Begining numerical optimisation of alpha and beta."
         
-        vars = []
-        
         for genome in constants.genomes:
-            for component in range( self.nclass ):
-                a = self.data.a[genome]
-                b = self.data.b[genome]
-                
-                x = np.zeros( ( 2, ) )
-                
-                x[0] = self.parameters[genome]['alpha'][component]
-                x[1] = self.parameters[genome]['beta'][component]
-                
-                resp = marginals[genome][:, component]
-                
-                precision_prior = self.priors[genome]['precision']
-                location_prior = self.priors[genome]['location']
-                
-                vars.append( [x, a, b, resp, location_prior, precision_prior, component] )
-        
-#        results = []
-#        for var in vars:
-#            results.append( get_mle_p( var ) )
-
-        ncpus = self.nclass * 2
-        
-        pool = multiprocessing.Pool( processes=ncpus, maxtasksperchild=1 )
-        results = pool.map( get_mle_p, vars )
-        pool.close()
-        
-        for i, genome in enumerate( constants.genomes ):
-            for component in range( self.nclass ):
-                index = i * self.nclass + component
-                
-                self.parameters[genome]['alpha'][component] = results[index][0]
-                self.parameters[genome]['beta'][component] = results[index][1]
+            precision_prior = self.priors[genome]['precision']
+            location_prior = self.priors[genome]['location']
+            
+            alpha, beta = get_map_estimates( self.parameters[genome]['alpha'], self.parameters[genome]['beta'],
+                                             self.histograms[genome], marginals[genome], location_prior,
+                                             precision_prior )
+            
+            self.parameters[genome]['alpha'] = alpha
+            self.parameters[genome]['beta'] = beta
                 
 class JointBinomialPosterior( EMPosterior ):
     def __init__( self, data, priors, responsibilities, nclass=3 ):
@@ -260,15 +220,9 @@ class JointBinomialPosterior( EMPosterior ):
     def _update_mu( self, a, b, alpha, beta, tau ):       
         d = a + b
         
-        n = self.data.nrows
-        shape = ( n, 1 )
-        
-        a = a.reshape( shape )
-        d = d.reshape( shape )
-        
-        ref_sum = np.sum( tau * a, axis=0 )
+        ref_sum = np.dot( tau.T, a )
         
-        depth_sum = np.sum( tau * d, axis=0 )
+        depth_sum = np.dot( tau.T, d )
         
         numerator = ref_sum + alpha - 1.
         
@@ -280,6 +234,9 @@ class JointBinomialPosterior( EMPosterior ):
 # Multinomial
 #=======================================================================================================================
 class JointMultinomialPosterior( EMPosterior ):
+    '''
+    Responsibilities are passed as FactorisedResponsibilities objects.
+    '''
     def __init__( self, data, priors, responsibilities, nclass=10 ):
         self.nclass = nclass
         
@@ -294,8 +251,11 @@ class JointMultinomialPosterior( EMPosterior ):
         
         self._update_density_parameters()
            
+    def _get_class_counts( self ):
+        return self.responsibilities.get_class_counts()
+    
     def _update_density_parameters( self ):
-        marginals = get_marginals( self.responsibilities, self.nclass )
+        marginals = self.responsibilities.get_marginals()
         
         for genome in constants.genomes:
             counts = self.data.counts[genome]
@@ -307,13 +267,8 @@ class JointMultinomialPosterior( EMPosterior ):
             self.parameters[genome]['rho'] = self._update_rho( counts, tau, delta )
     
     def _update_rho( self, counts, tau, delta ):       
-        counts = counts.reshape( ( 1, counts.shape[0], counts.shape[1] ) )
-        
-        tau = np.swapaxes( tau, 0, 1 )        
-        tau = tau.reshape( ( tau.shape[0], tau.shape[1], 1 ) )        
-        
-        marginal_counts = tau * counts        
-        marginal_counts = marginal_counts.sum( axis=1 )
+        # K x 4 matrix of expected counts of each base in each class.
+        marginal_counts = np.dot( tau.T, counts.astype( np.float64 ) )
         
         numerator = marginal_counts + delta - 1
         
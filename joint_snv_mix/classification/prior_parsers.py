@@ -30,7 +30,7 @@ class PriorParser( object ):
         return self.priors
         
     def _load_mix_weight_priors( self ):       
-        raise NotImplemented
+        raise NotImplementedError
     
     def _load_density_priors( self ):        
         for genome in constants.genomes:
@@ -122,11 +122,15 @@ class JointBetaBinomialPriorParser( JointModelPriorParser ):
 # Multinomial
 #=======================================================================================================================
 class MultinomialModelPriorParser( PriorParser ):
-    def __init__( self ):
+    def __init__( self, genotypes=constants.multinomial_genotypes,
+                  joint_genotypes=constants.joint_multinomial_genotypes ):
         PriorParser.__init__( self )
         
-        self.nclass['normal'] = 10
-        self.nclass['tumour'] = 10    
+        self.genotypes = genotypes
+        self.joint_genotypes = joint_genotypes
+        
+        self.nclass['normal'] = len( genotypes )
+        self.nclass['tumour'] = len( genotypes )
         
         self.ncomponent = self.nclass['normal'] * self.nclass['tumour']
         
@@ -141,7 +145,7 @@ class MultinomialModelPriorParser( PriorParser ):
                     self._load_hyperparameter( genome, param_name, hyper_param_name )
         
     def _load_hyperparameter( self, genome, param_name, hyper_param_name ):                           
-        for i, genotype in enumerate( constants.multinomial_genotypes ):
+        for i, genotype in enumerate( self.genotypes ):
             for j, nuc in enumerate( constants.nucleotides ):         
                 genome_genotype_nuc = "_".join( ( genome, genotype, nuc ) )
                 
@@ -153,7 +157,7 @@ class MultinomialModelPriorParser( PriorParser ):
     def _load_mix_weight_priors( self ):       
         self.priors['kappa'] = np.zeros( ( self.ncomponent, ) )
             
-        for i, genotype_tuple in enumerate( constants.joint_multinomial_genotypes ):
+        for i, genotype_tuple in enumerate( self.joint_genotypes ):
             genotype = "_".join( genotype_tuple )
         
             self.priors['kappa'][i] = self.parser.getfloat( 'kappa', genotype )
@@ -167,6 +171,20 @@ class JointMultinomialPriorParser( MultinomialModelPriorParser ):
         self.hyper_parameter_names = {}
         self.hyper_parameter_names['rho'] = ( 'delta', )
         
+class JointExtendedMultinomialPriorParser( MultinomialModelPriorParser ):
+    '''
+    Priors of the extended multinomial model, which adds the tri and tetra-allelic genotypes.
+    '''
+    def __init__( self ):
+        MultinomialModelPriorParser.__init__( self,
+                                              constants.extended_multinomial_genotypes,
+                                              constants.joint_extended_multinomial_genotypes )
+        
+        self.parameter_names = ( 'rho', )
+        
+        self.hyper_parameter_names = {}
+        self.hyper_parameter_names['rho'] = ( 'delta', )
+        
 
 if __name__ == "__main__":
     def print_params( file_name, parser ):
@@ -8,6 +8,7 @@ import numpy as np
 
 from joint_snv_mix import constants
 from joint_snv_mix.classification.data import JointData
+from joint_snv_mix.classification.utils.blocks import BlockProfiler, get_block_size
 from joint_snv_mix.file_formats.jcnt import JointCountsReader
 
 def run_threshold(args):
@@ -32,6 +33,10 @@ class ThresholdRunner(object):
         self.reader = JointCountsReader(args.jcnt_file_name)
         self.writer = csv.writer(open(args.tsv_file_name, 'w'), delimiter='\t')
         
+        self.block_size = get_block_size(args.memory_budget, len(self.classes))
+        
+        self.profiler = BlockProfiler(args.profile_blocks)
+        
         chr_list = self.reader.get_chr_list()
         
         for chr_name in sorted(chr_list):
@@ -39,17 +44,21 @@ class ThresholdRunner(object):
                             
         self.reader.close()
         
+        self.profiler.print_summary()
+        
     def _classify_chromosome(self, chr_name):
         counts = self.reader.get_counts(chr_name)
         jcnt_rows = self.reader.get_rows(chr_name)
         
         end = self.reader.get_chr_size(chr_name)
 
-        n = int(1e5)
+        n = self.block_size
         start = 0
         stop = min(n, end)
         
         while start < end:
+            self.profiler.start()
+            
             sub_counts = counts[start:stop]
             sub_rows = jcnt_rows[start:stop]
                               
@@ -58,6 +67,8 @@ class ThresholdRunner(object):
             labels = self.model.classify(data)
             
             self._write_rows(chr_name, sub_rows, labels)
+            
+            self.profiler.stop(chr_name, stop - start)
         
             start = stop
             stop = min(stop + n, end)
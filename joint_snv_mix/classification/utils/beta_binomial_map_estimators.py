@@ -4,41 +4,237 @@ Created on 2010-11-14
 @author: Andrew
 '''
 import numpy as np
-from scipy.special import psi
+from scipy.special import psi, polygamma
 from scipy.optimize import fmin_l_bfgs_b
 from .log_pdf import log_beta_binomial_likelihood
 
-def get_mle_p( vars ):
-    x = vars[0]
-    a = vars[1]
-    b = vars[2]
-    resp = vars[3]
-    location_prior = vars[4]
-    precision_prior = vars[5]
-    component = vars[6]
+# Smallest value alpha and beta may take.
+min_value = 1e-6
+
+# Newton's method stops once the change in the log of each parameter is below this value. Convergence is quadratic
+# so the final step leaves the parameters much closer to the optimum than this.
+newton_tolerance = 1e-6
+
+# Largest change in the log of a parameter in one Newton step.
+max_log_step = 1.
+
+max_newton_iters = 100
+
+class CountHistogram( object ):
+    '''
+    The unique ( a, b ) count pairs of a data set. Sequencing depths are bounded so there are far fewer unique pairs
+    than rows, and sums over rows can be taken over the pairs weighted by how often each occurs. Counts are kept as
+    integers so the objective and its derivatives are computed from tables indexed by count.
+    '''
+    def __init__( self, a, b ):
+        a = np.asarray( a, dtype=np.int64 )
+        b = np.asarray( b, dtype=np.int64 )
+        
+        keys = a * ( b.max() + 1 ) + b
+        
+        unique_keys, self.index = np.unique( keys, return_inverse=True )
+        
+        first_rows = np.zeros( unique_keys.shape, dtype=np.int64 )
+        first_rows[self.index] = np.arange( keys.size )
+        
+        self.a = a[first_rows]
+        self.b = b[first_rows]
+        
+        self.size = unique_keys.size
     
-    return get_ml_estimates( x, a, b, resp, location_prior, precision_prior, component )
+    def get_weights( self, resp ):
+        '''
+        Sum the responsibilities of the rows with each count pair.
+        
+        Arguments:
+        resp -- Vector of responsibilities or matrix with one column per component.
+        
+        Return:
+        weights -- Array with one row per count pair and the shape of resp otherwise.
+        '''
+        if resp.ndim == 1:
+            return np.bincount( self.index, weights=resp, minlength=self.size )
+        
+        weights = np.zeros( ( self.size, resp.shape[1] ) )
+        
+        for component in range( resp.shape[1] ):
+            weights[:, component] = np.bincount( self.index, weights=resp[:, component], minlength=self.size )
+        
+        return weights
 
-def get_ml_estimates( x, a, b, resp, location_prior, precision_prior, component ):
-    if np.all( resp == 0 ):
+def get_map_estimates( alpha, beta, histogram, resp, location_prior, precision_prior ):
+    '''
+    MAP estimates of the beta-binomial parameters of every component of a genome. The components are independent
+    problems which are solved together by Newton's method, so each evaluation of the objective, gradient and Hessian
+    is one vectorised pass over the count histogram for all components. Components for which Newton's method fails,
+    for example when started outside the region where the objective is concave, are refit by L-BFGS.
+    
+    Arguments:
+    alpha, beta -- Arrays of current parameters, used as starting values.
+    histogram -- CountHistogram of the genome's counts.
+    resp -- Matrix of responsibilities with one column per component.
+    location_prior, precision_prior -- Priors of the genome.
+    
+    Return:
+    alpha, beta -- Arrays of estimates.
+    '''
+    x = np.array( [alpha, beta], dtype=np.float64 )
+    
+    priors = (
+              np.asarray( location_prior['alpha'], dtype=np.float64 ),
+              np.asarray( location_prior['beta'], dtype=np.float64 ),
+              np.asarray( precision_prior['shape'], dtype=np.float64 ),
+              np.asarray( precision_prior['scale'], dtype=np.float64 ),
+              np.asarray( precision_prior['min'], dtype=np.float64 )
+              )
+    
+    weights = histogram.get_weights( resp )
+    
+    # Empty components keep their current parameters.
+    active = np.any( weights > 0, axis=0 )
+    
+    if not np.all( active ):
         print "Empty class."
-        return x
     
-    prec_shape = precision_prior['shape'][component]
-    prec_scale = precision_prior['scale'][component]
-    prec_min = precision_prior['min'][component]
+    # Count pairs with no weight in any component do not change the objective.
+    rows = np.any( weights > 0, axis=1 )
+    
+    a = histogram.a[rows]
+    b = histogram.b[rows]
+    weights = weights[rows][:, active]
+    
+    priors = [prior[active] for prior in priors]
+    
+    x_active, failed = get_newton_estimates( x[:, active], a, b, weights, *priors )
+    
+    for component in np.flatnonzero( failed ):
+        component_priors = [prior[component] for prior in priors]
+        
+        x_active[:, component] = get_lbfgs_estimates( x[:, active][:, component], a, b, weights[:, component],
+                                                      *component_priors )
+    
+    x[:, active] = x_active
     
-    loc_alpha = location_prior['alpha'][component]
-    loc_beta = location_prior['beta'][component]
+    return x[0], x[1]
+
+def get_newton_estimates( x, a, b, resp, loc_alpha, loc_beta, prec_shape, prec_scale, prec_min ):
+    '''
+    Maximise the objective of several components at once by Newton's method on the logs of alpha and beta, which
+    keeps them positive and is much better conditioned than alpha and beta themselves. Away from the optimum the
+    Hessian of a component is damped, as in Levenberg-Marquardt, until its step is uphill. The log transform drops
+    the lower bound of min_value on alpha and beta, so components whose estimates fall below it are marked failed and
+    left to L-BFGS which enforces the bound.
+    
+    Arguments:
+    x -- Array of starting values with alpha in the first row and beta in the second, one column per component.
+    resp -- Matrix of weights with one column per component.
+    loc_alpha, loc_beta, prec_shape, prec_scale, prec_min -- Arrays of prior parameters, one entry per component.
+    
+    Return:
+    x -- Array of estimates.
+    failed -- Boolean array set for components where Newton's method did not converge or left the bounds.
+    '''
+    f = lambda z:get_f( z, a, b, resp ) + get_penalty( z, loc_alpha, loc_beta, prec_shape, prec_scale, prec_min )
+    
+    ncomponents = x.shape[1]
+    
+    y = np.log( x )
+    
+    f_old = f( x )
+    
+    failed = ~np.isfinite( f_old )
+    converged = np.zeros( ( ncomponents, ), dtype=np.bool )
+    
+    for i in range( max_newton_iters ):
+        if np.all( converged | failed ):
+            break
+        
+        x = np.exp( y )
+        
+        grad = get_gradient( x, a, b, resp ) + \
+               get_penalty_gradient( x, loc_alpha, loc_beta, prec_shape, prec_scale, prec_min )
+        
+        hess = get_hessian( x, a, b, resp ) + \
+               get_penalty_hessian( x, loc_alpha, loc_beta, prec_shape, prec_scale, prec_min )
+        
+        # Chain rule for y = log( x ).
+        hess = x[:, np.newaxis] * x[np.newaxis, :] * hess
+        hess[0, 0] += x[0] * grad[0]
+        hess[1, 1] += x[1] * grad[1]
+        grad = x * grad
+        
+        hess_size = np.abs( hess ).max( axis=0 ).max( axis=0 )
+        
+        damping = np.zeros( ( ncomponents, ) )
+        
+        step = np.zeros( x.shape )
+        f_new = f_old.copy()
+        
+        done = converged | failed
+        
+        while not np.all( done ):
+            h_aa = hess[0, 0] - damping
+            h_bb = hess[1, 1] - damping
+            h_ab = hess[0, 1]
+            
+            det = h_aa * h_bb - h_ab ** 2
+            
+            # Steps are only uphill where the damped Hessian is negative definite.
+            concave = ( h_aa < 0 ) & ( det > 0 ) & ~done
+            
+            with np.errstate( divide='ignore', invalid='ignore' ):
+                trial_step = -np.array( [h_bb * grad[0] - h_ab * grad[1], h_aa * grad[1] - h_ab * grad[0]] ) / det
+            
+            trial_step[:, ~concave] = 0
+            
+            step_size = np.abs( trial_step ).max( axis=0 )
+            
+            finished = concave & ( damping == 0 ) & ( step_size <= newton_tolerance )
+            
+            step[:, finished] = trial_step[:, finished]
+            converged |= finished
+            done |= finished
+            
+            scale = np.minimum( 1, max_log_step / np.maximum( step_size, max_log_step ) )
+            trial_step = scale * trial_step
+            
+            f_trial = f( np.exp( y + trial_step ) )
+            
+            # Allow for rounding error in the objective, close to the optimum steps change it by less.
+            accepted = concave & ~done & ( f_trial >= f_old - 1e-12 * np.abs( f_old ) )
+            
+            step[:, accepted] = trial_step[:, accepted]
+            f_new[accepted] = f_trial[accepted]
+            done |= accepted
+            
+            damping[~done] = np.maximum( 10 * damping[~done], 1e-3 * hess_size[~done] )
+            
+            gave_up = ~done & ( damping > 1e10 * hess_size )
+            
+            failed |= gave_up
+            done |= gave_up
+        
+        y = y + step
+        f_old = f_new
+        
+        failed |= np.any( y < np.log( min_value ), axis=0 )
     
-    f = lambda y:-1 * ( get_f( y, a, b, resp ) + \
-                        get_penalty( y, loc_alpha, loc_beta, prec_shape, prec_scale, prec_min ) )
+    failed |= ~converged
+    
+    return np.exp( y ), failed
+
+def get_lbfgs_estimates( x, a, b, resp, loc_alpha, loc_beta, prec_shape, prec_scale, prec_min ):
+    '''
+    MAP estimates of the parameters of a single component by L-BFGS.
+    '''
+    f = lambda y:-1 * float( get_f( y, a, b, resp ) + \
+                             get_penalty( y, loc_alpha, loc_beta, prec_shape, prec_scale, prec_min ) )
     
     g = lambda y:-1 * ( get_gradient( y, a, b, resp ) + \
                         get_penalty_gradient( y, loc_alpha, loc_beta, prec_shape, prec_scale, prec_min ) )
     
     # Bounds to keep the alpha, beta search away from 0.
-    bounds = [( 1e-6, None ), ( 1e-6, None )]
+    bounds = [( min_value, None ), ( min_value, None )]
     
     x = fmin_l_bfgs_b( f, x, fprime=g, bounds=bounds )
     
@@ -53,10 +249,9 @@ def get_penalty( x, loc_alpha, loc_beta, prec_shape, prec_scale, prec_min ):
     
     s = s - prec_min
     
-    if s <= 0:
-        return float( '-inf' )
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        scale_penalty = np.where( s > 0, ( prec_shape - 1 ) * np.log( s ) - s / prec_scale, float( '-inf' ) )
     
-    scale_penalty = ( prec_shape - 1 ) * np.log( s ) - s / prec_scale
     location_penalty = ( loc_alpha - 1 ) * np.log( mu ) + ( loc_beta - 1 ) * np.log( 1 - mu )
     
     return scale_penalty + location_penalty
@@ -69,7 +264,7 @@ def get_penalty_gradient( x, loc_alpha, loc_beta, prec_shape, prec_scale, prec_m
     s = alpha + beta
     
     s = s - prec_min
-
+    
     d_pen_s = ( prec_shape - 1 ) / s - 1 / prec_scale
     d_pen_mu = ( loc_alpha - 1 ) / mu - ( loc_beta - 1 ) / ( 1 - mu )
     
@@ -83,24 +278,44 @@ def get_penalty_gradient( x, loc_alpha, loc_beta, prec_shape, prec_scale, prec_m
     
     return grad_penalty
 
-def get_f( x, a, b, resp ):  
+def get_penalty_hessian( x, loc_alpha, loc_beta, prec_shape, prec_scale, prec_min ):
     alpha = x[0]
     beta = x[1]
-      
-    nrows = a.shape[0]
+    
+    s = alpha + beta
+    
+    # The location penalty is ( loc_alpha - 1 ) * log( alpha ) + ( loc_beta - 1 ) * log( beta ) -
+    # ( loc_alpha + loc_beta - 2 ) * log( s ).
+    d2_loc_s = ( loc_alpha + loc_beta - 2 ) / s ** 2
+    
+    d2_scale_s = -( prec_shape - 1 ) / ( s - prec_min ) ** 2
+    
+    d2_pen_alpha = -( loc_alpha - 1 ) / alpha ** 2 + d2_loc_s + d2_scale_s
+    d2_pen_beta = -( loc_beta - 1 ) / beta ** 2 + d2_loc_s + d2_scale_s
+    d2_pen_alpha_beta = d2_loc_s + d2_scale_s
+    
+    hess_penalty = np.array( [[d2_pen_alpha, d2_pen_alpha_beta], [d2_pen_alpha_beta, d2_pen_beta]] )
+    
+    return hess_penalty
+
+#=======================================================================================================================
+# Objective and derivatives. The parameters x may hold scalars for one component or arrays with an entry per
+# component, in which case resp has a column per component.
+#=======================================================================================================================
+def get_f( x, a, b, resp ):
+    alpha = np.asarray( x[0] )
+    beta = np.asarray( x[1] )
     
     d = a + b
     
     f_val = log_beta_binomial_likelihood( a, d, alpha, beta )
-    f_val = f_val.reshape( ( nrows, ) )
-    f_val = resp * f_val
-    f_val = f_val.sum( axis=0 ) 
+    f_val = resp.reshape( f_val.shape ) * f_val
+    f_val = f_val.sum( axis=0 )
     
-    return f_val
+    return f_val.reshape( alpha.shape )
 
 def get_gradient( x, a, b, resp ):
-    alpha = x[0]
-    beta = x[1]
+    alpha, beta, a, b, resp = get_broadcast_args( x, a, b, resp )
     
     d = a + b
     
@@ -114,9 +329,79 @@ def get_gradient( x, a, b, resp ):
     deriv_wrt_beta = resp * deriv_wrt_beta
     deriv_wrt_beta = deriv_wrt_beta.sum( axis=0 )
     
-    grad = np.array( [deriv_wrt_alpha, deriv_wrt_beta] )
+    shape = np.shape( x[0] )
+    
+    grad = np.array( [deriv_wrt_alpha.reshape( shape ), deriv_wrt_beta.reshape( shape )] )
     
     return grad
+
+def get_hessian( x, a, b, resp ):
+    alpha, beta, a, b, resp = get_broadcast_args( x, a, b, resp )
+    
+    d = a + b
+    
+    common_term = np.sum( resp * trigamma_difference( d, alpha + beta ), axis=0 )
+    
+    d2_alpha = np.sum( resp * trigamma_difference( a, alpha ), axis=0 ) - common_term
+    d2_beta = np.sum( resp * trigamma_difference( b, beta ), axis=0 ) - common_term
+    
+    shape = np.shape( x[0] )
+    
+    d2_alpha = d2_alpha.reshape( shape )
+    d2_beta = d2_beta.reshape( shape )
+    common_term = common_term.reshape( shape )
     
+    hess = np.array( [[d2_alpha, -common_term], [-common_term, d2_beta]] )
+    
+    return hess
+
+def get_broadcast_args( x, a, b, resp ):
+    '''
+    Reshape counts to columns and parameters to rows so terms broadcast to one column per component.
+    '''
+    alpha = np.reshape( x[0], ( 1, -1 ) )
+    beta = np.reshape( x[1], ( 1, -1 ) )
+    
+    a = a.reshape( ( -1, 1 ) )
+    b = b.reshape( ( -1, 1 ) )
+    
+    resp = resp.reshape( ( a.shape[0], alpha.shape[1] ) )
+    
+    return alpha, beta, a, b, resp
+
 def digamma_difference( counts, parameter ):
+    '''
+    psi( counts + parameter ) - psi( parameter ), which for integer counts c is sum_{i < c} 1 / ( parameter + i ).
+    '''
+    if np.issubdtype( counts.dtype, np.integer ):
+        return get_reciprocal_table( parameter, counts.max(), 1 )[counts.ravel()]
+    
     return psi( counts + parameter ) - psi( parameter )
+
+def trigamma_difference( counts, parameter ):
+    '''
+    polygamma( 1, counts + parameter ) - polygamma( 1, parameter ), which for integer counts c is
+    -sum_{i < c} 1 / ( parameter + i ) ** 2.
+    '''
+    if np.issubdtype( counts.dtype, np.integer ):
+        return -get_reciprocal_table( parameter, counts.max(), 2 )[counts.ravel()]
+    
+    return polygamma( 1, counts + parameter ) - polygamma( 1, parameter )
+
+def get_reciprocal_table( parameter, max_count, power ):
+    '''
+    Cumulative sums of 1 / ( parameter + i ) ** power, with a row for each count c = 0, ..., max_count holding the sum
+    over i < c and a column per component. Building the table costs O( max_count ) per component after which each
+    count is a single lookup.
+    '''
+    parameter = np.reshape( parameter, ( 1, -1 ) )
+    
+    max_count = int( max_count )
+    
+    counts = np.arange( max_count, dtype=np.float64 ).reshape( ( max_count, 1 ) )
+    
+    table = np.zeros( ( max_count + 1, parameter.shape[1] ) )
+    
+    np.cumsum( 1 / ( parameter + counts ) ** power, axis=0, out=table[1:] )
+    
+    return table
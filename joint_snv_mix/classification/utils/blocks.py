@@ -0,0 +1,119 @@
+'''
+Sizing and profiling of the blocks of rows classified at once.
+
+Rows are classified in blocks so memory use does not grow with the input. Without a memory budget every block is
+default_block_size rows. Given a budget the number of rows is chosen so the arrays built for a block fit in it, which
+gives large blocks to models with few classes and small blocks to models with many.
+
+Created on 2011-03-22
+
+@author: Andrew Roth
+'''
+import os
+import time
+
+import numpy as np
+
+# Number of rows per block used when no memory budget is given.
+default_block_size = 100000
+
+# Smallest block used with a memory budget, below this the cost of each block outweighs the work in it.
+min_block_size = 1000
+
+# Number of row by class arrays alive at once while a block is classified, i.e. the log likelihoods, the temporaries of
+# normalising them and the responsibilities passed to the writer.
+working_copies = 4
+
+def get_block_size( memory_budget, nclass, nblocks=1, dtype=np.float64 ):
+    '''
+    Number of rows to classify at once.
+
+    Arguments:
+    memory_budget -- Megabytes allowed for the arrays of all blocks in memory at once, capped at the memory available.
+                     If None default_block_size is returned.
+    nclass -- Number of classes of the model i.e. columns of the responsibility matrix.
+    nblocks -- Number of blocks in memory at once, e.g. across the workers of a pool, which share the budget.
+    dtype -- Type of the responsibility matrix.
+    '''
+    if memory_budget is None:
+        return default_block_size
+
+    budget = memory_budget * 2 ** 20
+
+    available_memory = get_available_memory()
+
+    if available_memory is not None:
+        budget = min( budget, available_memory )
+
+    row_size = nblocks * working_copies * nclass * np.dtype( dtype ).itemsize
+
+    return max( int( budget // row_size ), min_block_size )
+
+def get_available_memory():
+    '''
+    Bytes of memory available to new processes or None if it can not be found on this platform. MemAvailable from
+    /proc/meminfo is used where present since it counts reclaimable page cache, otherwise the number of free pages.
+    '''
+    try:
+        for line in open( '/proc/meminfo' ):
+            if line.startswith( 'MemAvailable:' ):
+                return int( line.split()[1] ) * 1024
+    except IOError:
+        pass
+
+    try:
+        return os.sysconf( 'SC_AVPHYS_PAGES' ) * os.sysconf( 'SC_PAGE_SIZE' )
+    except ( AttributeError, ValueError, OSError ):
+        return None
+
+class BlockProfiler( object ):
+    '''
+    Time the blocks of a classification run. If enabled the rows, time and throughput of each block are printed as
+    it finishes and print_summary gives the totals for the run.
+    '''
+    def __init__( self, enabled=False ):
+        self.enabled = enabled
+
+        self.nblocks = 0
+        self.nrows = 0
+        self.seconds = 0.
+
+        self.max_block_rows = 0
+
+        self._start_time = None
+
+    def start( self ):
+        self._start_time = time.time()
+
+    def stop( self, name, nrows ):
+        '''
+        Arguments:
+        name -- Label printed with the block, e.g. the chromosome.
+        nrows -- Number of rows in the block.
+        '''
+        seconds = time.time() - self._start_time
+
+        self.nblocks += 1
+        self.nrows += nrows
+        self.seconds += seconds
+
+        self.max_block_rows = max( self.max_block_rows, nrows )
+
+        if self.enabled:
+            print "Block : ", name, nrows, "rows", seconds, "s", get_throughput( nrows, seconds ), "rows/s"
+
+    def print_summary( self ):
+        if not self.enabled:
+            return
+
+        print "Blocks classified : ", self.nblocks
+        print "Largest block : ", self.max_block_rows
+        print "Rows classified : ", self.nrows
+        print "Classification time : ", self.seconds
+        print "Rows per second : ", get_throughput( self.nrows, self.seconds )
+
+def get_throughput( nrows, seconds ):
+    if seconds > 0:
+        return nrows / seconds
+    else:
+        return float( 'inf' )
@@ -0,0 +1,158 @@
+'''
+Responsibilities of joint models held in factorised form.
+
+A joint model has one class for each pair of a normal and a tumour class, so its responsibility matrix has nclass^2
+columns. The likelihood of a pair is the product of a normal and a tumour term, so it is enough to keep the two
+N x nclass likelihood matrices. The normalising constant of each row, the marginal responsibilities of each genome and
+the expected number of rows in each joint class are all computed through the nclass x nclass matrix of mixing weights.
+The full N x nclass^2 matrix is only built when it is needed for output.
+
+Joint classes are ordered with the normal class varying slowest, as in get_joint_log_likelihoods.
+
+Created on 2011-03-21
+
+@author: Andrew Roth
+'''
+import numpy as np
+
+from joint_snv_mix import constants
+from joint_snv_mix.classification.utils.initialisation import get_indicator_responsibilities
+
+def get_factorised_responsibilities( log_likelihoods, pi ):
+    '''
+    Arguments:
+    log_likelihoods -- Dictionary of N x nclass log likelihood matrices keyed by genome.
+    pi -- Mixing weights of the nclass^2 joint classes.
+    '''
+    likelihoods = {}
+
+    log_scale = 0.
+
+    for genome in constants.genomes:
+        log_likelihood = log_likelihoods[genome]
+
+        # Each row is scaled so its largest entry is one to avoid underflow when leaving log space.
+        log_max = log_likelihood.max( axis=1 )
+
+        likelihoods[genome] = np.exp( log_likelihood - log_max.reshape( ( log_max.size, 1 ) ) )
+
+        log_scale = log_scale + log_max
+
+    return FactorisedResponsibilities( likelihoods, pi, log_scale )
+
+def get_indicator_factorised_responsibilities( labels, nclass ):
+    '''
+    Build responsibilities with all the mass of each row in the joint class given by its normal and tumour labels.
+
+    Arguments:
+    labels -- Dictionary of label arrays keyed by genome.
+    nclass -- Number of classes of each genome.
+    '''
+    likelihoods = {}
+
+    for genome in constants.genomes:
+        likelihoods[genome] = get_indicator_responsibilities( labels[genome], nclass )
+
+    pi = np.ones( ( nclass ** 2, ) )
+
+    return FactorisedResponsibilities( likelihoods, pi )
+
+class FactorisedResponsibilities( object ):
+    def __init__( self, likelihoods, pi, log_scale=0. ):
+        '''
+        Arguments:
+        likelihoods -- Dictionary of N x nclass likelihood matrices keyed by genome. Rows may be scaled by a constant.
+        pi -- Mixing weights of the nclass^2 joint classes.
+        log_scale -- Log of the factor each row of the likelihoods was scaled by.
+        '''
+        self.normal_likelihoods = likelihoods['normal']
+        self.tumour_likelihoods = likelihoods['tumour']
+
+        self.nrows, self.nclass = self.normal_likelihoods.shape
+
+        self.pi = np.reshape( pi, ( self.nclass, self.nclass ) )
+
+        self._norm_const = ( self.normal_likelihoods * self._get_normal_weights() ).sum( axis=1 )
+
+        # Log likelihood of each row under the joint model.
+        self.log_norm_const = np.log( self._norm_const ) + log_scale
+
+    def get_marginals( self ):
+        '''
+        Return dictionary of N x nclass responsibilities of each genome, summed over the classes of the other genome.
+        '''
+        shape = ( self.nrows, 1 )
+
+        norm_const = self._norm_const.reshape( shape )
+
+        marginals = {}
+
+        marginals['normal'] = self.normal_likelihoods * self._get_normal_weights() / norm_const
+        marginals['tumour'] = self.tumour_likelihoods * self._get_tumour_weights() / norm_const
+
+        return marginals
+
+    def get_class_counts( self ):
+        '''
+        Return the sum over rows of the responsibility of each joint class.
+        '''
+        shape = ( self.nrows, 1 )
+
+        normal_likelihoods = self.normal_likelihoods / self._norm_const.reshape( shape )
+
+        class_counts = self.pi * np.dot( normal_likelihoods.T, self.tumour_likelihoods )
+
+        return class_counts.ravel()
+
+    def get_joint_class_responsibilities( self, joint_classes ):
+        '''
+        Return the responsibility of one joint class for each row.
+
+        Arguments:
+        joint_classes -- Array giving the index of the joint class of each row.
+        '''
+        normal_classes = joint_classes // self.nclass
+        tumour_classes = joint_classes % self.nclass
+
+        rows = np.arange( self.nrows )
+
+        responsibilities = self.normal_likelihoods[rows, normal_classes] * self.pi[normal_classes, tumour_classes]
+        responsibilities *= self.tumour_likelihoods[rows, tumour_classes]
+
+        return responsibilities / self._norm_const
+
+    def to_array( self, row_indices=None ):
+        '''
+        Return the N x nclass^2 responsibility matrix, or only the given rows of it. Entries below machine precision
+        are set to zero as in log_space_normalise_rows.
+        '''
+        if row_indices is None:
+            row_indices = slice( None )
+
+        normal_likelihoods = self.normal_likelihoods[row_indices]
+        tumour_likelihoods = self.tumour_likelihoods[row_indices]
+        norm_const = self._norm_const[row_indices]
+
+        nrows = normal_likelihoods.shape[0]
+        nclass = self.nclass
+
+        responsibilities = normal_likelihoods.reshape( ( nrows, nclass, 1 ) ) * self.pi
+        responsibilities *= tumour_likelihoods.reshape( ( nrows, 1, nclass ) )
+        responsibilities /= norm_const.reshape( ( nrows, 1, 1 ) )
+
+        responsibilities = responsibilities.reshape( ( nrows, nclass ** 2 ) )
+
+        eps = np.finfo( responsibilities.dtype ).eps
+
+        responsibilities[responsibilities <= eps] = 0.
+
+        return responsibilities
+
+    def _get_normal_weights( self ):
+        '''
+        Tumour likelihood of each row for each normal class, summed over tumour classes and weighted by pi.
+        '''
+        return np.dot( self.tumour_likelihoods, self.pi.T )
+
+    def _get_tumour_weights( self ):
+        return np.dot( self.normal_likelihoods, self.pi )
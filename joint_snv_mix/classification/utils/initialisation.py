@@ -0,0 +1,189 @@
+'''
+Fast k-means initialisation of responsibilities.
+
+Data sets of at most max_sample_size rows are clustered by kmeans2 directly. For larger ones allele frequencies, which
+are one dimensional, are clustered on a fine histogram of their values rather than on every row, which makes the cost
+of each iteration independent of the number of rows. Multinomial proportions are clustered on a bounded, evenly spaced
+subsample of the rows. In both cases every row is then labelled with its nearest centre in one vectorised pass.
+
+Created on 2011-03-18
+
+@author: Andrew Roth
+'''
+import numpy as np
+
+from scipy.cluster.vq import kmeans2
+
+from joint_snv_mix import constants
+
+# Number of histogram bins used to cluster frequencies.
+num_bins = 2 ** 16
+
+# Number of k-means iterations.
+kmeans_iters = 10
+
+# Largest data set clustered by kmeans2 on every row, and the number of rows sampled from larger sets of multinomial
+# proportions.
+max_sample_size = 100000
+
+# Number of rows labelled at once when assigning rows to multinomial centres.
+block_size = 100000
+
+# Fraction of the way each initial centre is moved towards a random point to seed a restart.
+restart_jitter = 0.25
+
+def cluster_frequencies( p, init_centers, iters=kmeans_iters ):
+    '''
+    Cluster frequencies in [0, 1] by k-means. Data sets larger than max_sample_size rows are clustered on a histogram
+    of their values, where as for kmeans2 centres of empty clusters are left where they are.
+
+    Arguments:
+    p -- Array of frequencies.
+    init_centers -- Array of initial cluster centres.
+    iters -- Number of k-means iterations. If 0 frequencies are labelled with their nearest initial centre.
+
+    Return:
+    centers -- Array of cluster centres.
+    labels -- Index of the nearest centre to each frequency.
+    '''
+    p = np.asarray( p, dtype=np.float64 )
+
+    centers = np.array( init_centers, dtype=np.float64 )
+
+    if iters == 0:
+        return centers, get_nearest_centers( p, centers )
+
+    if p.size <= max_sample_size:
+        return kmeans2( p, centers, iter=iters, minit='matrix' )
+
+    nclass = centers.shape[0]
+
+    bins = np.minimum( ( p * num_bins ).astype( np.int32 ), num_bins - 1 )
+
+    bin_counts = np.bincount( bins, minlength=num_bins )
+    bin_sums = np.bincount( bins, weights=p, minlength=num_bins )
+
+    # Each non-empty bin is represented by the mean of the frequencies in it, weighted by the number of them.
+    index = bin_counts > 0
+
+    bin_counts = bin_counts[index]
+    bin_means = bin_sums[index] / bin_counts
+
+    for i in range( iters ):
+        bin_labels = get_nearest_centers( bin_means, centers )
+
+        cluster_counts = np.bincount( bin_labels, weights=bin_counts, minlength=nclass )
+        cluster_sums = np.bincount( bin_labels, weights=bin_counts * bin_means, minlength=nclass )
+
+        index = cluster_counts > 0
+
+        centers[index] = cluster_sums[index] / cluster_counts[index]
+
+    labels = get_nearest_centers( p, centers )
+
+    return centers, labels
+
+def cluster_proportions( p, init_centers, iters=kmeans_iters ):
+    '''
+    Cluster the rows of a matrix of proportions by k-means. Data sets larger than max_sample_size rows are clustered
+    on an evenly spaced subsample and all rows are then labelled with their nearest centre.
+
+    Arguments:
+    p -- Matrix of proportions, one row per data point.
+    init_centers -- Matrix of initial cluster centres, one per row.
+    iters -- Number of k-means iterations. If 0 rows are labelled with their nearest initial centre.
+
+    Return:
+    centers -- Array of cluster centres, one per row.
+    labels -- Index of the nearest centre to each row of p.
+    '''
+    if iters == 0:
+        return init_centers, get_nearest_proportion_centers( p, init_centers )
+
+    nrows = p.shape[0]
+
+    if nrows <= max_sample_size:
+        return kmeans2( p, init_centers, iter=iters, minit='matrix' )
+
+    step = int( np.ceil( float( nrows ) / max_sample_size ) )
+
+    centers, sample_labels = kmeans2( p[::step], init_centers, iter=iters, minit='matrix' )
+
+    return centers, get_nearest_proportion_centers( p, centers )
+
+def get_genotype_proportions( genotypes ):
+    '''
+    Proportion of each nucleotide expected for each genotype if its alleles are equally represented, used as initial
+    centres for clustering multinomial proportions.
+    '''
+    proportions = np.zeros( ( len( genotypes ), len( constants.nucleotides ) ) )
+
+    for i, genotype in enumerate( genotypes ):
+        for allele in genotype:
+            proportions[i, constants.nucleotides.index( allele )] += 1. / len( genotype )
+
+    return proportions
+
+def get_restart_centers( init_centers, random_state=None ):
+    '''
+    Perturb initial cluster centres to give a different starting point for EM. Each centre is moved restart_jitter of
+    the way towards a random point, drawn uniformly from [0, 1] for frequencies or from the simplex for proportions.
+    The moves are kept small so each class stays close to its default centre and keeps its meaning.
+
+    Arguments:
+    init_centers -- Array of initial cluster centres, one per entry for frequencies or one per row for proportions.
+    random_state -- numpy RandomState used to draw the points. If None the centres are returned unchanged.
+    '''
+    if random_state is None:
+        return init_centers
+
+    if init_centers.ndim == 1:
+        points = random_state.uniform( size=init_centers.shape )
+    else:
+        points = random_state.dirichlet( np.ones( init_centers.shape[1] ), init_centers.shape[0] )
+
+    return ( 1 - restart_jitter ) * init_centers + restart_jitter * points
+
+def get_nearest_centers( x, centers ):
+    '''
+    Index of the nearest centre to each value of a one dimensional array.
+    '''
+    order = np.argsort( centers )
+
+    sorted_centers = centers[order]
+
+    boundaries = ( sorted_centers[1:] + sorted_centers[:-1] ) / 2
+
+    return order[np.searchsorted( boundaries, x )]
+
+def get_nearest_proportion_centers( p, centers ):
+    '''
+    Index of the nearest centre to each row of a matrix of proportions, computed in blocks of block_size rows.
+    '''
+    nrows = p.shape[0]
+
+    labels = np.zeros( ( nrows, ), dtype=np.int )
+
+    for start in xrange( 0, nrows, block_size ):
+        stop = min( start + block_size, nrows )
+
+        block = p[start:stop]
+
+        # Squared distance to each centre, dropping the |x|^2 term which is the same for every centre.
+        distances = ( centers ** 2 ).sum( axis=1 ) - 2 * np.dot( block, centers.T )
+
+        labels[start:stop] = distances.argmin( axis=1 )
+
+    return labels
+
+def get_indicator_responsibilities( labels, ncomponents ):
+    '''
+    Build a responsibility matrix with a one in the column given by each row's label.
+    '''
+    nrows = labels.shape[0]
+
+    responsibilities = np.zeros( ( nrows, ncomponents ) )
+
+    responsibilities[np.arange( nrows ), labels] = 1.
+
+    return responsibilities
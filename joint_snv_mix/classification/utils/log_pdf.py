@@ -39,6 +39,16 @@ def log_translated_gamma_pdf( x, shape, scale, min ):
     return log_gamma_pdf( x, shape, scale )
 
 def log_beta_binomial_likelihood( k, n, alpha, beta ):
+    '''
+    Log likelihood of k successes in n trials under each beta-binomial component, without the binomial coefficient.
+    Integer counts are looked up in tables, see log_beta_binomial_likelihood_from_tables.
+    
+    Return:
+    Array with one row per count and one column per component.
+    '''
+    if np.issubdtype( k.dtype, np.integer ) and np.issubdtype( n.dtype, np.integer ):
+        return log_beta_binomial_likelihood_from_tables( k, n, alpha, beta )
+    
     column_shape = ( k.size, 1 )
     k = k.reshape( column_shape )
     n = n.reshape( column_shape )
@@ -49,34 +59,75 @@ def log_beta_binomial_likelihood( k, n, alpha, beta ):
 
     return betaln( k + alpha, n - k + beta ) - betaln( alpha, beta )
 
+def log_beta_binomial_likelihood_from_tables( k, n, alpha, beta ):
+    '''
+    For integer counts betaln( k + alpha, n - k + beta ) - betaln( alpha, beta ) splits into
+    
+    log_rising_factorial( alpha, k ) + log_rising_factorial( beta, n - k ) - log_rising_factorial( alpha + beta, n )
+    
+    where log_rising_factorial( x, c ) = gammaln( x + c ) - gammaln( x ) = sum_{i < c} log( x + i ). These are
+    tabulated for c up to the largest depth once per call, so each row costs three lookups instead of betaln calls.
+    '''
+    k = k.ravel()
+    n = n.ravel()
+    
+    alpha = alpha.ravel()
+    beta = beta.ravel()
+    
+    if n.size == 0:
+        return np.zeros( ( 0, alpha.size ) )
+    
+    max_count = int( n.max() )
+    
+    alpha_table = get_log_rising_factorial_table( alpha, max_count )
+    beta_table = get_log_rising_factorial_table( beta, max_count )
+    precision_table = get_log_rising_factorial_table( alpha + beta, max_count )
+    
+    return alpha_table[k] + beta_table[n - k] - precision_table[n]
+
+def get_log_rising_factorial_table( x, max_count ):
+    '''
+    Table of gammaln( x + c ) - gammaln( x ) with a row for each c = 0, ..., max_count and a column per entry of x.
+    '''
+    counts = np.arange( max_count + 1 ).reshape( ( max_count + 1, 1 ) )
+    
+    x = x.reshape( ( 1, x.size ) )
+    
+    return gammaln( x + counts ) - gammaln( x )
+
 def log_dirichlet_constant( kappa ):
     return gammaln( kappa.sum() ) - gammaln( kappa ).sum()
 
 def log_binomial_likelihood( k, n, mu ):
-    column_shape = ( k.size, 1 )
-    k = k.reshape( column_shape )
-    n = n.reshape( column_shape )
+    '''
+    Log likelihood, without the binomial coefficient, of k successes in n trials for each entry of mu. Computed as
+    the matrix product [k, n - k] * [log( mu ); log( 1 - mu )] so no N x K temporaries are created.
+    
+    Return:
+    Array with one row per count and one column per entry of mu.
+    '''
+    counts = np.empty( ( k.size, 2 ) )
+    
+    counts[:, 0] = k.ravel()
+    counts[:, 1] = n.ravel() - k.ravel()
     
-    row_shape = ( 1, mu.size )
-    mu = mu.reshape( row_shape )
+    mu = mu.ravel()
     
-    return k * np.log( mu ) + ( n - k ) * np.log( 1 - mu )
+    log_mu = np.vstack( ( np.log( mu ), np.log1p( -mu ) ) )
+    
+    return np.dot( counts, log_mu )
 
 def log_multinomial_likelihood( counts, rho ):
     '''
     counts is Nxk and rho is cxk
     
     p is Nxc
-    '''
     
-    counts = counts.reshape( ( counts.shape[0], counts.shape[1], 1 ) )
-    
-    rho = np.swapaxes( rho, 0, 1 )
-    rho = rho.reshape( ( 1, rho.shape[0], rho.shape[1] ) )
-    
-    p = counts * np.log( rho )
+    Computed as the matrix product counts * log( rho ).T so no N x k x c temporary is created.
+    '''
+    counts = np.asarray( counts, dtype=np.float64 )
     
-    p = p.sum( axis=1 )
+    p = np.dot( counts, np.log( rho ).T )
     
     return p
 
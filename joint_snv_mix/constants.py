@@ -39,6 +39,15 @@ for normal_genotype in multinomial_genotypes:
     for tumour_genotype in multinomial_genotypes:
         joint_multinomial_genotypes.append((normal_genotype, tumour_genotype))
 
+# Index of the joint genotype homozygous for the reference base in both genomes, keyed by reference base.
+multinomial_reference_genotype_indices = {}
+
+for nucleotide in nucleotides:
+    reference_genotype = nucleotide + nucleotide
+    
+    multinomial_reference_genotype_indices[nucleotide] = joint_multinomial_genotypes.index((reference_genotype,
+                                                                                            reference_genotype))
+
 somatic_multinomial_genotypes_indices = []
 
 for i, g in enumerate(joint_multinomial_genotypes):
@@ -53,7 +62,7 @@ loh_multinomial_genotypes_indices = []
 
 for i, g in enumerate(joint_multinomial_genotypes):
     # Check normal is not homozygous.
-    if g[0][0] == g[0][0]:
+    if g[0][0] == g[0][1]:
         continue
     
     # Check that tumour is homzygous
@@ -106,14 +115,14 @@ for i, g in enumerate(joint_extended_multinomial_genotypes):
         continue
     
     # Check normal is not homozygous.
-    if g[0][0] == g[0][0]:
+    if g[0][0] == g[0][1]:
         continue
     
     # Check that tumour is homzygous
     if g[1][0] != g[1][1]:
         continue
     
-    loh_multinomial_genotypes_indices.append(i)
+    loh_extended_multinomial_genotypes_indices.append(i)
     
 matched_extended_multinomial_genotypes_indices = []
 
@@ -122,7 +131,16 @@ for i, g in enumerate(joint_extended_multinomial_genotypes):
     if g[0] != g[1]:
         continue
     
-    matched_multinomial_genotypes_indices.append(i)
+    matched_extended_multinomial_genotypes_indices.append(i)
+
+# Index of the joint genotype homozygous for the reference base in both genomes, keyed by reference base.
+extended_multinomial_reference_genotype_indices = {}
+
+for nucleotide in nucleotides:
+    reference_genotype = nucleotide + nucleotide
+    
+    extended_multinomial_reference_genotype_indices[nucleotide] = \
+        joint_extended_multinomial_genotypes.index((reference_genotype, reference_genotype))
     
 #=======================================================================================================================
 # Conan
@@ -3,65 +3,44 @@ Created on 2010-08-06
 
 @author: Andrew Roth
 '''
-import time
-
 import numpy as np
 
-from tables import openFile, Filters, UInt32Col, StringCol
+from tables import UInt32Col, StringCol
 from tables.description import IsDescription
 
-class ConanCountsFile:
+from joint_snv_mix.file_formats.hdf5_file import HDF5File, join_path
+
+class ConanCountsFile( HDF5File ):
     '''
     Class representing a joint counts formated file.
     
     Any acess to the underlying HDF5 file hierachy should be placed here.
     '''
-    def __init__( self, file_name, file_mode, compression_level=1, compression_lib='zlib' ):
-        '''
-        For compatibility it is recommended the compression values are left at defaults.
-        
-        Arguments:
-        file_name -- Path to file
-        file_mode -- How file should be opened i.e. r, w, a, r+
-        compression_level -- Level of compression to use from 1 to 9
-        compression_lib -- Compression library to use see PyTables docs for option.
-        '''
-        compression_filters = Filters( complevel=compression_level, complib=compression_lib )
-
-        if file_mode == "w":
-            self._file_handle = openFile( file_name, file_mode, filters=compression_filters )
-            
-            self._file_handle.setNodeAttr( '/', 'creation_date', time.ctime() )
-        else:
-            self._file_handle = openFile( file_name, file_mode )
-
-        self.entries = self._init_entries()
-
-        self._cn_groups = self._init_cn_groups()
-    
     def add_rows( self, cn_status, chr_name, rows ):
-        table = self._get_chr_table( cn_status, chr_name )
+        self._get_chr_table( cn_status, chr_name )
         
-        table.append( rows )
-        table.flush()
+        self._append( join_path( '/' + cn_status, chr_name ), rows )
         
     def get_rows( self, cn_status, chr_name ):
-        table = self._get_chr_table( cn_status, chr_name )
+        table = self._get_node( join_path( '/' + cn_status, chr_name ) )
         
         rows = table.read()
         
         return rows
     
     def get_table_size( self, cn_status, chr_name ):
-        table = self._get_chr_table( cn_status, chr_name )
+        table = self._get_node( join_path( '/' + cn_status, chr_name ) )
         
         return table.nrows
     
     def get_chr_list( self, cn_status ):
         return self.entries[cn_status]
     
-    def close( self ):
-        self._file_handle.close()
+    def set_expected_rows( self, cn_state, chr_name, nrows ):
+        '''
+        Hint how many rows will be written for a chromosome so the chunk shape can be tuned when its table is created.
+        '''
+        self._expected_rows[( cn_state, chr_name )] = nrows
 
     def _get_chr_table( self, cn_status, chr_name ):
         '''
@@ -70,24 +49,17 @@ class ConanCountsFile:
         Fetch the table if it exists otherwise create it.
         
         Arguments:
+        cn_status -- Copy number state the table is stored under.
         chr_name -- Name of table to fetch.
         
         Return:
-        chr_table -- A counts table object. See BinomialCountsTable for columns.
+        chr_table -- A counts table object. See JointCountsIndexTable for columns.
         '''
-        if cn_status in self._cn_groups:
-            cn_group = self._cn_groups[cn_status]
-        else:
-            cn_group = self._file_handle.createGroup( self._file_handle.root, cn_status )
-
-            self._cn_groups[cn_status] = cn_group
+        self._get_group( '/', cn_status )
         
-        if chr_name in cn_group:
-            chr_table = self._file_handle.getNode( cn_group, chr_name )
-        else:
-            chr_table = self._file_handle.createTable( cn_group, chr_name, JointCountsIndexTable )
-
-        return chr_table
+        self.entries.setdefault( cn_status, set() ).add( chr_name )
+        
+        return self._get_table( '/' + cn_status, chr_name, JointCountsIndexTable, ( cn_status, chr_name ) )
 
     def _init_entries( self ):
         '''
@@ -95,22 +67,11 @@ class ConanCountsFile:
         '''
         entries = {}
 
-        for cn_group in self._file_handle.iterNodes( where=self._file_handle.root ):
-            group_name = cn_group._v_name
-            
-            cn_tables = self._file_handle.listNodes( where=cn_group )
-            entries[group_name] = set( [x._v_name for x in cn_tables] )
+        for cn_state in self._list_nodes( '/' ):
+            entries[cn_state] = set( self._list_nodes( '/' + cn_state ) )
 
         return entries
 
-    def _init_cn_groups( self ):
-        cn_groups = {}
-
-        for cn_state in self.entries:
-            cn_groups[cn_state] = self._file_handle.getNode( self._file_handle.root, cn_state )
-
-        return cn_groups
-
 class ConanCountsReader:
     '''
     Helper class to simpilfy reading jcnt files.
@@ -200,6 +161,13 @@ class ConanCountsReader:
         
     def get_rows( self, cn_state, chr_name ):
         return self._file_handle.get_rows( cn_state, chr_name )
+    
+    def get_filtered_sites( self ):
+        '''
+        Return a dictionary of the number of sites removed by the candidate site filter keyed by copy number state and
+        chromosome tuples.
+        '''
+        return self._file_handle.get_filtered_sites()
 
 class JointCountsIndexTable( IsDescription ):
     position = UInt32Col( pos=0 )
@@ -3,161 +3,158 @@ Created on 2010-08-25
 
 @author: Andrew Roth
 '''
-import time
-
-from joint_snv_mix.file_formats.jsm import JointSnvMixTable
-from tables import Float64Atom, StringCol, UInt32Col, Float64Col, Filters, openFile
-import numpy as np
+from tables import Float64Atom
 from joint_snv_mix.file_formats.cncnt import JointCountsIndexTable
 from joint_snv_mix import constants
+from joint_snv_mix.file_formats.hdf5_file import HDF5File, join_path
 
    
-class ConanSnvMixFile:
-    def __init__( self, file_name, file_mode, compression_level=1, compression_lib='zlib' ):
-        '''Constructor
-                    
-        For compatibility it is reccomeded the compression values are left at defaults.
-        
-        Arguments:
-        file_name -- Path to file
-        file_mode -- How file should be opened i.e. r, w, a, r+
-        compression_level -- Level of compression to use from 1 to 9
-        compression_lib -- Compression library to use see PyTables docs for option.
-        '''
-        compression_filters = Filters( complevel=compression_level, complib=compression_lib )
-
-        if file_mode == "w":
-            self._file_handle = openFile( file_name, file_mode, filters=compression_filters )
-            self._data_group = self._file_handle.createGroup( "/", "data" )
-            self._parameters_group = self._file_handle.createGroup( "/", "parameters" )
-            self._priors_group = self._file_handle.createGroup( "/", "priors" )
-            
-            self._file_handle.setNodeAttr( '/', 'creation_date', time.ctime() )
-        else:
-            self._file_handle = openFile( file_name, file_mode )
-            self._data_group = self._file_handle.root.data
-            self._parameters_group = self._file_handle.root.parameters
-            self._priors_group = self._file_handle.root.priors
-
-        self._init_entries()
-
-        self._init_cn_groups()
+class ConanSnvMixFile( HDF5File ):
+    groups = ['data', 'parameters', 'priors']
     
     def get_chr_list( self, cn_status ):
         return self.entries[cn_status]
+        
+    def set_sparse_epsilon( self, epsilon ):
+        self._set_attr( 'sparse_epsilon', epsilon )
     
-    def write_priors( self, priors ):
-        priors_group = self._priors_group
+    def get_sparse_epsilon( self ):
+        '''
+        Return the non-reference mass threshold used to write the file or None if the file is dense.
+        '''
+        return self._get_attr( 'sparse_epsilon' )
         
-        self._write_tree( priors, priors_group )
+    def set_expected_rows( self, cn_state, chr_name, nrows ):
+        '''
+        Hint how many rows will be written for a chromosome so the chunk shape can be tuned when its table is created.
+        '''
+        self._expected_rows[( cn_state, chr_name )] = nrows
         
-    def write_parameters( self, parameters ):    
-        params_group = self._parameters_group
+    def write_chr_table( self, cn_state, chr_name, index_rows, soft_labels ):
+        # The group is always created so sparse files list chromosomes with no non-reference rows.
+        chr_path = self._get_chr_group( cn_state, chr_name )
         
-        self._write_tree( parameters, params_group )
+        self._append( join_path( chr_path, 'index' ), index_rows )
+        self._append( join_path( chr_path, 'soft_labels' ), soft_labels )
     
-    def _write_tree( self, params, group ):
-        for name, value in params.items():
-            if isinstance( value, dict ):
-                new_group = self._file_handle.createGroup( group, name )
-                self._write_tree( value, new_group )
-            else:
-                atom = Float64Atom( () )
+    def write_reference_table( self, cn_state, chr_name, index_rows ):
+        '''
+        Write the index rows of positions stored with the compact reference marker.
+        '''
+        if len( index_rows ) == 0:
+            return
         
-                shape = np.array( value ).shape
+        chr_path = self._get_chr_group( cn_state, chr_name )
         
-                parameter_array = self._file_handle.createCArray( group, name, atom, shape )
-                
-                parameter_array[:] = value[:]
-                
-    def get_priors( self ):
-        priors = {}
+        self._get_table( chr_path, 'reference', JointCountsIndexTable, ( cn_state, chr_name ) )
+        
+        self._append( join_path( chr_path, 'reference' ), index_rows )
+    
+    def get_reference_rows( self, cn_state, chr_name ):
+        path = join_path( get_chr_path( cn_state, chr_name ), 'reference' )
         
-        self._read_tree( priors, self._priors_group )
+        if not self._has_node( path ):
+            return []
         
-        return priors
+        return self._get_node( path )[:]
     
-    def get_parameters( self ):
-        parameters = {}
+    def _get_chr_path( self, cn_state, chr_name ):
+        '''
+        Path of the group of a chromosome. Raises KeyError if the file has no group for it.
+        '''
+        if chr_name not in self.entries.get( cn_state, () ):
+            raise KeyError( chr_name )
         
-        self._read_tree( parameters, self._parameters_group )
+        return get_chr_path( cn_state, chr_name )
+    
+    def _get_chr_group( self, cn_state, chr_name ):
+        '''
+        Create the group holding the index table and soft labels of a chromosome if it does not exist.
         
-        return parameters
+        Return:
+        chr_path -- Path of the chromosome group.
+        '''
+        chr_path = get_chr_path( cn_state, chr_name )
         
-    def write_chr_table( self, cn_state, chr_name, index_rows, soft_labels ):
-        if cn_state in self._cn_groups:
-            cn_group = self._cn_groups[cn_state]
-        else:
-            cn_group = self._file_handle.createGroup( '/data', cn_state )
-
-            self._cn_groups[cn_state] = cn_group
+        if self._has_node( chr_path ):
+            return chr_path
         
-        if chr_name in cn_group:
-            chr_group = self._file_handle.getNode( cn_group, chr_name )
-        else:
-            chr_group = self._file_handle.createGroup( cn_group, chr_name )
-            
-            self._file_handle.createTable( chr_group, 'index' , JointCountsIndexTable )
-            
-            atom = Float64Atom( () )
-            nclass = 3 * constants.cn_state_map[cn_state]
-            shape = ( 0, nclass )
-            
-            self._file_handle.createEArray( chr_group, 'soft_labels', atom, shape )
-
+        self.entries.setdefault( cn_state, set() ).add( chr_name )
+        
+        self._get_group( '/data', cn_state )
+        self._get_group( '/data/' + cn_state, chr_name )
+        
+        expected_rows_key = ( cn_state, chr_name )
+        
+        self._get_table( chr_path, 'index', JointCountsIndexTable, expected_rows_key )
         
-        chr_group.index.append( index_rows )
-        chr_group.soft_labels.append( soft_labels )
+        atom = Float64Atom( () )
+        nclass = 3 * constants.cn_state_map[cn_state]
+        shape = ( 0, nclass )
+        
+        self._get_earray( chr_path, 'soft_labels', atom, shape, expected_rows_key )
+        
+        return chr_path
         
     def get_responsibilities( self, cn_state, chr_name ):
-        cn_group = self._cn_groups[cn_state]
-        table = self._file_handle.getnode( cn_group, chr_name )
-        
-        responsibilities = np.column_stack( ( 
-                                            table.col( 'p_aa_aa' ),
-                                            table.col( 'p_aa_ab' ),
-                                            table.col( 'p_aa_bb' ),
-                                            table.col( 'p_ab_aa' ),
-                                            table.col( 'p_ab_ab' ),
-                                            table.col( 'p_ab_bb' ),
-                                            table.col( 'p_bb_aa' ),
-                                            table.col( 'p_bb_ab' ),
-                                            table.col( 'p_bb_bb' )
-                                            ) )
-        
-        return responsibilities
+        chr_path = self._get_chr_path( cn_state, chr_name )
+        
+        return self._get_node( join_path( chr_path, 'soft_labels' ) )[:]
     
     def get_rows( self, cn_state, chr_name, row_indices=None ):
-        cn_group = self._cn_groups[cn_state]
-        chr_group = self._file_handle.getNode( cn_group, chr_name )
+        chr_path = self._get_chr_path( cn_state, chr_name )
+        
+        index = self._get_node( join_path( chr_path, 'index' ) )
+        soft_labels = self._get_node( join_path( chr_path, 'soft_labels' ) )
         
         if row_indices is None:
-            return chr_group.index, chr_group.soft_labels
+            return index[:], soft_labels[:]
         else:
-            return chr_group.index[row_indices], chr_group.soft_labels[row_indices]
+            return index[row_indices], soft_labels[row_indices]
     
     def get_position( self, chr_name, coord ):
         '''
-        Search file for a given position.
+        Search file for a given position. The row is returned with its soft labels and copy number state appended.
         '''
-        for cn_state in self._cn_groups:            
-            cn_group = self._cn_groups[cn_state]
-            table = self._file_handle.getnode( cn_group, chr_name )
+        if not any( chr_name in chr_names for chr_names in self.entries.values() ):
+            raise KeyError( chr_name )
+        
+        search_string = "position == {0}".format( coord )
+        
+        for cn_state in sorted( self.entries ):
+            if chr_name not in self.entries[cn_state]:
+                continue
+            
+            chr_path = get_chr_path( cn_state, chr_name )
+            
+            index = self._get_node( join_path( chr_path, 'index' ) )
             
-            search_string = "position == {0}".format( coord )
-            row = table.readWhere( search_string )
+            row_indices = index.getWhereList( search_string )
             
-            if len( row ) == 0:
-                row = []
-            else:
-                row = row[0].tolist()
+            if len( row_indices ) > 0:
+                row = list( index[row_indices[0]].tolist() )
+                row.extend( self._get_node( join_path( chr_path, 'soft_labels' ) )[row_indices[0]].tolist() )
                 row.append( cn_state )
+                
                 return row
             
-            return row
+            reference_path = join_path( chr_path, 'reference' )
+            
+            if not self._has_node( reference_path ):
+                continue
+            
+            reference_row = self._get_node( reference_path ).readWhere( search_string )
+            
+            if len( reference_row ) > 0:
+                nclass = 3 * constants.cn_state_map[cn_state]
                 
-    def close( self ):
-        self._file_handle.close()
+                row = list( reference_row[0].tolist() )
+                row.extend( [1.] + [0.] * ( nclass - 1 ) )
+                row.append( cn_state )
+                
+                return row
+        
+        return []
 
     def _init_entries( self ):
         '''
@@ -165,22 +162,13 @@ class ConanSnvMixFile:
         '''
         entries = {}
 
-        for cn_group in self._file_handle.iterNodes( where='/data' ):
-            group_name = cn_group._v_name
-            
-            cn_tables = self._file_handle.listNodes( where=cn_group )
-            entries[group_name] = set( [x._v_name for x in cn_tables] )
-
-        self.entries = entries
+        for cn_state in self._list_nodes( '/data' ):
+            entries[cn_state] = set( self._list_nodes( '/data/' + cn_state ) )
 
-    def _init_cn_groups( self ):
-        cn_groups = {}
-
-        for cn_state in self.entries:
-            cn_groups[cn_state] = self._file_handle.getNode( '/data', cn_state )
-
-        self._cn_groups = cn_groups
+        return entries
 
+def get_chr_path( cn_state, chr_name ):
+    return '/data/{0}/{1}'.format( cn_state, chr_name )
 
 class ConanSnvMixReader:
     def __init__( self, file_name ):
@@ -198,15 +186,39 @@ class ConanSnvMixReader:
     def get_parameters( self ):
         return self._file_handle.get_parameters()     
 
+    def get_em_iterations( self ):
+        return self._file_handle.get_em_iterations()
+
     def get_rows( self, cn_state, chr_name ):
         return self._file_handle.get_rows( cn_state, chr_name )
+    
+    def get_reference_rows( self, cn_state, chr_name ):
+        '''
+        Get the index rows of positions stored with the compact reference marker in a sparse file.
+        '''
+        return self._file_handle.get_reference_rows( cn_state, chr_name )
+    
+    def get_sparse_epsilon( self ):
+        return self._file_handle.get_sparse_epsilon()
 
     def close( self ):
         self._file_handle.close()
                
 class ConanSnvMixWriter:
-    def __init__( self, file_name, ):
-        self._file_handle = ConanSnvMixFile( file_name, 'w' )
+    def __init__( self, file_name, sparse_epsilon=None, profile='default' ):
+        '''
+        Arguments:
+        file_name -- Path to file
+        sparse_epsilon -- If set only positions with non-reference mass above this value have their soft labels
+                          stored. All other positions are stored as reference without probabilities.
+        profile -- Name of storage profile used to compress the file. See storage_profiles for options.
+        '''
+        self._file_handle = ConanSnvMixFile( file_name, 'w', profile )
+        
+        self._sparse_epsilon = sparse_epsilon
+        
+        if sparse_epsilon is not None:
+            self._file_handle.set_sparse_epsilon( sparse_epsilon )
         
     def write_priors( self, priors ):
         self._file_handle.write_priors( priors )
@@ -214,7 +226,24 @@ class ConanSnvMixWriter:
     def write_parameters( self, parameters ):
         self._file_handle.write_parameters( parameters )
         
-    def write_data( self, cn_state, chr_name, jcnt_rows, responsibilities ):        
+    def set_em_iterations( self, iters ):
+        self._file_handle.set_em_iterations( iters )
+        
+    def set_expected_rows( self, cn_state, chr_name, nrows ):
+        self._file_handle.set_expected_rows( cn_state, chr_name, nrows )
+        
+    def write_data( self, cn_state, chr_name, jcnt_rows, responsibilities ):
+        if self._sparse_epsilon is not None:
+            # The first joint genotype is homozygous reference in both genomes for every copy number state.
+            non_ref_mass = 1 - responsibilities[:, 0]
+            
+            non_ref_indices = non_ref_mass > self._sparse_epsilon
+            
+            self._file_handle.write_reference_table( cn_state, chr_name, jcnt_rows[~non_ref_indices] )
+            
+            jcnt_rows = jcnt_rows[non_ref_indices]
+            responsibilities = responsibilities[non_ref_indices]
+        
         self._file_handle.write_chr_table( cn_state, chr_name, jcnt_rows, responsibilities )
 
     def close( self ):
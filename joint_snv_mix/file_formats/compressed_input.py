@@ -0,0 +1,255 @@
+'''
+Line oriented reading of plain, bzip2, gzip and bgzf compressed text files.
+
+Compressed files are decompressed in a background thread which hands batches of lines to the reader through a bounded
+queue, so decompression overlaps with parsing. Concatenated bzip2 and gzip streams, as written by pbzip2 and pigz, are
+read in full. The blocks of bgzf files are independent so they are decompressed by a pool of threads.
+
+Created on 2011-03-14
+
+@author: Andrew Roth
+'''
+import bz2
+import struct
+import threading
+import zlib
+
+from multiprocessing.pool import ThreadPool
+from Queue import Queue, Full, Empty
+
+# Size of reads from the compressed file.
+chunk_size = 2 ** 20
+
+# Number of line batches the decompression thread may get ahead of the reader.
+queue_size = 16
+
+# Number of bgzf blocks (at most 64kb each) handed to the thread pool at once.
+bgzf_blocks_per_batch = 64
+
+def open_input_file( file_name, compression=None, num_threads=1 ):
+    '''
+    Open a text file for line by line reading.
+
+    Arguments:
+    file_name -- Path to file.
+    compression -- One of bz2, gzip, bgzf or None. If None the compression is detected from the start of the file.
+    num_threads -- Number of threads used to decompress bgzf files.
+
+    Return:
+    An object which can be iterated over to get lines and has a close method.
+    '''
+    if compression is None:
+        compression = detect_compression( file_name )
+
+    if compression is None:
+        return open( file_name )
+    elif compression == 'bz2':
+        decompressor = MultiStreamDecompressor( bz2.BZ2Decompressor )
+    elif compression == 'gzip':
+        decompressor = MultiStreamDecompressor( lambda : zlib.decompressobj( 16 + zlib.MAX_WBITS ) )
+    elif compression == 'bgzf':
+        decompressor = BgzfDecompressor( num_threads )
+    else:
+        raise Exception( 'Compression type {0} not recognised.'.format( compression ) )
+
+    return ThreadedLineReader( open( file_name, 'rb' ), decompressor )
+
+def detect_compression( file_name ):
+    '''
+    Identify the compression of a file from its magic bytes.
+
+    Return:
+    One of bz2, gzip, bgzf or None for files which are not compressed.
+    '''
+    fh = open( file_name, 'rb' )
+
+    header = fh.read( 18 )
+
+    fh.close()
+
+    if header[:3] == 'BZh':
+        return 'bz2'
+    elif header[:2] == '\x1f\x8b':
+        if get_bgzf_block_size( header ) is not None:
+            return 'bgzf'
+        else:
+            return 'gzip'
+    else:
+        return None
+
+def get_bgzf_block_size( header ):
+    '''
+    Read the total block size from the header of a bgzf block. Returns None if the header is not a bgzf header.
+    '''
+    if len( header ) < 18:
+        return None
+
+    # FLG.FEXTRA must be set and the extra field must hold the BC subfield.
+    if not ( ord( header[3] ) & 4 ) or header[12:14] != 'BC':
+        return None
+
+    return struct.unpack( '<H', header[16:18] )[0] + 1
+
+class ThreadedLineReader:
+    '''
+    Iterate over the lines of a compressed file while a background thread decompresses it.
+    '''
+    def __init__( self, fh, decompressor ):
+        self._fh = fh
+
+        self._decompressor = decompressor
+
+        self._queue = Queue( maxsize=queue_size )
+
+        self._closed = threading.Event()
+
+        self._lines = iter( [] )
+
+        self._thread = threading.Thread( target=self._decompress )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __iter__( self ):
+        return self
+
+    def next( self ):
+        while True:
+            try:
+                return self._lines.next()
+            except StopIteration:
+                batch = self._queue.get()
+
+                if batch is None:
+                    raise StopIteration
+                elif isinstance( batch, Exception ):
+                    raise batch
+
+                self._lines = iter( batch )
+
+    def close( self ):
+        self._closed.set()
+
+        # Drain the queue so the decompression thread is not left blocked on a full queue.
+        try:
+            while True:
+                self._queue.get_nowait()
+        except Empty:
+            pass
+
+        self._thread.join()
+
+        self._fh.close()
+
+    def _decompress( self ):
+        try:
+            remainder = ''
+
+            for data in self._decompressor.decompress( self._fh ):
+                lines = ( remainder + data ).splitlines( True )
+
+                # Hold back the last line if it is incomplete.
+                if len( lines ) > 0 and not lines[-1].endswith( '\n' ):
+                    remainder = lines.pop()
+                else:
+                    remainder = ''
+
+                if not self._put( lines ):
+                    return
+
+            if remainder:
+                self._put( [remainder] )
+
+            self._put( None )
+        except Exception as e:
+            self._put( e )
+
+    def _put( self, batch ):
+        '''
+        Put a batch on the queue, giving up if the reader is closed. Returns False if the reader has been closed.
+        '''
+        while not self._closed.is_set():
+            try:
+                self._queue.put( batch, timeout=0.1 )
+
+                return True
+            except Full:
+                pass
+
+        return False
+
+class MultiStreamDecompressor:
+    '''
+    Decompress files made of one or more concatenated bzip2 or gzip streams.
+    '''
+    def __init__( self, decompressor_factory ):
+        self._decompressor_factory = decompressor_factory
+
+    def decompress( self, fh ):
+        decompressor = self._decompressor_factory()
+
+        while True:
+            compressed_data = fh.read( chunk_size )
+
+            if not compressed_data:
+                break
+
+            while compressed_data:
+                try:
+                    data = decompressor.decompress( compressed_data )
+                except EOFError:
+                    # A bz2 stream ended exactly at the end of the previous read so this is the start of a new one.
+                    decompressor = self._decompressor_factory()
+
+                    continue
+
+                yield data
+
+                # Data after the end of a stream is the start of the next one.
+                compressed_data = decompressor.unused_data
+
+                if compressed_data:
+                    decompressor = self._decompressor_factory()
+
+class BgzfDecompressor:
+    '''
+    Decompress bgzf files with a pool of threads. zlib releases the GIL while inflating so blocks are decompressed in
+    parallel.
+    '''
+    def __init__( self, num_threads ):
+        self._num_threads = num_threads
+
+    def decompress( self, fh ):
+        pool = ThreadPool( processes=self._num_threads )
+
+        try:
+            while True:
+                blocks = read_bgzf_blocks( fh, bgzf_blocks_per_batch )
+
+                if len( blocks ) == 0:
+                    break
+
+                yield ''.join( pool.map( decompress_bgzf_block, blocks ) )
+        finally:
+            pool.close()
+            pool.join()
+
+def read_bgzf_blocks( fh, max_blocks ):
+    blocks = []
+
+    while len( blocks ) < max_blocks:
+        header = fh.read( 18 )
+
+        if len( header ) == 0:
+            break
+
+        block_size = get_bgzf_block_size( header )
+
+        if block_size is None:
+            raise Exception( 'File is not in bgzf format.' )
+
+        blocks.append( header + fh.read( block_size - 18 ) )
+
+    return blocks
+
+def decompress_bgzf_block( block ):
+    return zlib.decompress( block, 16 + zlib.MAX_WBITS )
@@ -0,0 +1,298 @@
+'''
+Base class shared by the HDF5 file formats.
+
+Created on 2011-03-02
+
+@author: Andrew Roth
+'''
+import time
+
+import numpy as np
+
+from tables import openFile, Leaf
+
+from joint_snv_mix.file_formats.storage_profiles import get_filters, default_expected_rows
+
+class HDF5File( object ):
+    '''
+    Any access to the underlying HDF5 file should go through the methods of this class so that node caching, buffered
+    writes and compression settings are handled in one place.
+
+    Nodes are opened the first time they are accessed and the handle cached. Appends are held in memory per node and
+    written once buffer_rows rows are pending, the file is flushed once on close.
+
+    The chromosome index of the file, entries, is stored as a root attribute when the file is closed so it can be
+    loaded on open without walking the node tree. Subclasses implement _init_entries to rebuild it from the nodes of
+    files written before the attribute existed.
+    '''
+    # Groups created under the root node when a file is opened for writing.
+    groups = []
+
+    # Maximum number of rows held in memory for a node before they are appended to the file.
+    buffer_rows = 100000
+
+    def __init__( self, file_name, file_mode, profile='default' ):
+        '''
+        Profiles other than default need a PyTables build with Blosc support to read the file.
+
+        Arguments:
+        file_name -- Path to file
+        file_mode -- How file should be opened i.e. r, w, a, r+
+        profile -- Name of storage profile used to compress new tables. See storage_profiles for options.
+        '''
+        compression_filters = get_filters( profile )
+
+        if file_mode == "w":
+            self._file_handle = openFile( file_name, file_mode, filters=compression_filters )
+
+            for group_name in self.groups:
+                self._file_handle.createGroup( "/", group_name )
+
+            self._file_handle.setNodeAttr( '/', 'creation_date', time.ctime() )
+        else:
+            self._file_handle = openFile( file_name, file_mode )
+
+        self._writable = ( file_mode != "r" )
+
+        self._nodes = {}
+
+        self._buffers = {}
+        self._buffer_sizes = {}
+
+        self._expected_rows = {}
+
+        self.entries = self._get_attr( 'entries' )
+
+        if self.entries is None:
+            self.entries = self._init_entries()
+
+    def close( self ):
+        for path in self._buffers.keys():
+            self._write_buffer( path )
+
+        if self._writable:
+            self._set_attr( 'entries', self.entries )
+
+        self._file_handle.flush()
+
+        self._file_handle.close()
+
+    def get_creation_date( self ):
+        return self._get_attr( 'creation_date' )
+
+    def set_expected_rows( self, chr_name, nrows ):
+        '''
+        Hint how many rows will be written for a chromosome so the chunk shape can be tuned when its table is created.
+        '''
+        self._expected_rows[chr_name] = nrows
+
+    def write_priors( self, priors ):
+        write_tree( self._file_handle, self._get_node( '/priors' ), priors )
+
+    def write_parameters( self, parameters ):
+        write_tree( self._file_handle, self._get_node( '/parameters' ), parameters )
+
+    def write_filter_summary( self, min_var_count, min_var_freq, filtered_sites ):
+        '''
+        Record the candidate site filter used to build the file and the number of sites it removed.
+
+        Arguments:
+        min_var_count -- Minimum non-reference count of the filter.
+        min_var_freq -- Minimum non-reference frequency of the filter.
+        filtered_sites -- Dictionary of number of removed sites, keyed as the rows of the file are.
+        '''
+        self._set_attr( 'min_var_count', min_var_count )
+        self._set_attr( 'min_var_freq', min_var_freq )
+        self._set_attr( 'filtered_sites', filtered_sites )
+
+    def get_filtered_sites( self ):
+        '''
+        Return the number of sites removed by the candidate site filter. Files written without a filter return an
+        empty dictionary.
+        '''
+        return self._get_attr( 'filtered_sites', {} )
+
+    def set_em_iterations( self, iters ):
+        '''
+        Record the number of EM iterations used to train the parameters stored in the file.
+        '''
+        self._set_attr( 'em_iterations', iters )
+
+    def get_em_iterations( self ):
+        '''
+        Return the number of EM iterations used to train the file's parameters or None if they were not trained.
+        '''
+        return self._get_attr( 'em_iterations' )
+
+    def get_priors( self ):
+        return read_tree( self._get_node( '/priors' ) )
+
+    def get_parameters( self ):
+        return read_tree( self._get_node( '/parameters' ) )
+
+    def _init_entries( self ):
+        '''
+        Build the chromosome index by listing the nodes of the file.
+        '''
+        raise NotImplementedError
+
+    def _set_attr( self, name, value ):
+        self._file_handle.setNodeAttr( '/', name, value )
+
+    def _get_attr( self, name, default=None ):
+        '''
+        Get an attribute of the root node or default if it has not been set.
+        '''
+        if name in self._file_handle.root._v_attrs:
+            return self._file_handle.getNodeAttr( '/', name )
+        else:
+            return default
+
+    def _has_node( self, path ):
+        return path in self._nodes or path in self._file_handle
+
+    def _get_node( self, path ):
+        '''
+        Fetch a node by path, writing any rows buffered for it first.
+        '''
+        if path in self._buffers:
+            self._write_buffer( path )
+
+        return self._get_cached_node( path )
+
+    def _list_nodes( self, path ):
+        '''
+        Return the names of the children of a group without opening them.
+        '''
+        if not self._has_node( path ):
+            return []
+
+        group = self._get_cached_node( path )
+
+        return group._v_children.keys()
+
+    def _get_group( self, where, name ):
+        '''
+        Fetch a group if it exists otherwise create it.
+        '''
+        path = join_path( where, name )
+
+        if self._has_node( path ):
+            return self._get_cached_node( path )
+
+        group = self._file_handle.createGroup( where, name )
+
+        self._nodes[path] = group
+
+        return group
+
+    def _get_table( self, where, name, description, expected_rows_key=None ):
+        '''
+        Fetch a table if it exists otherwise create it. Rows buffered for the table are not written, use _get_node to
+        read from it.
+
+        Arguments:
+        where -- Path of group holding the table.
+        name -- Name of table.
+        description -- IsDescription subclass used if the table is created.
+        expected_rows_key -- Key passed to set_expected_rows used to size chunks of a new table.
+        '''
+        path = join_path( where, name )
+
+        if self._has_node( path ):
+            return self._get_cached_node( path )
+
+        expected_rows = self._expected_rows.get( expected_rows_key, default_expected_rows )
+
+        table = self._file_handle.createTable( where, name, description, expectedrows=expected_rows )
+
+        self._nodes[path] = table
+
+        return table
+
+    def _get_earray( self, where, name, atom, shape, expected_rows_key=None ):
+        '''
+        Fetch an extendable array if it exists otherwise create it. Arguments are as for _get_table with atom and shape
+        passed to createEArray.
+        '''
+        path = join_path( where, name )
+
+        if self._has_node( path ):
+            return self._get_cached_node( path )
+
+        expected_rows = self._expected_rows.get( expected_rows_key, default_expected_rows )
+
+        earray = self._file_handle.createEArray( where, name, atom, shape, expectedrows=expected_rows )
+
+        self._nodes[path] = earray
+
+        return earray
+
+    def _append( self, path, rows ):
+        '''
+        Buffer rows for the table or extendable array at path. The node must already exist.
+        '''
+        if len( rows ) == 0:
+            return
+
+        if path not in self._buffers:
+            self._buffers[path] = []
+            self._buffer_sizes[path] = 0
+
+        self._buffers[path].append( rows )
+        self._buffer_sizes[path] += len( rows )
+
+        if self._buffer_sizes[path] >= self.buffer_rows:
+            self._write_buffer( path )
+
+    def _write_buffer( self, path ):
+        chunks = self._buffers.pop( path )
+        del self._buffer_sizes[path]
+
+        if len( chunks ) == 1:
+            rows = chunks[0]
+        elif isinstance( chunks[0], np.ndarray ):
+            rows = np.concatenate( chunks )
+        else:
+            rows = []
+
+            for chunk in chunks:
+                rows.extend( chunk )
+
+        self._get_cached_node( path ).append( rows )
+
+    def _get_cached_node( self, path ):
+        if path not in self._nodes:
+            self._nodes[path] = self._file_handle.getNode( path )
+
+        return self._nodes[path]
+
+def join_path( where, name ):
+    return where.rstrip( '/' ) + '/' + name
+
+def write_tree( file_handle, group, tree ):
+    '''
+    Write a nested dictionary of arrays below group. Dictionaries become groups and values are stored as contiguous
+    float64 arrays, which are much cheaper to create than chunked arrays for small parameter vectors.
+    '''
+    for name, value in tree.items():
+        if isinstance( value, dict ):
+            new_group = file_handle.createGroup( group, name )
+
+            write_tree( file_handle, new_group, value )
+        else:
+            file_handle.createArray( group, name, np.asarray( value, dtype=np.float64 ) )
+
+def read_tree( group ):
+    '''
+    Read a tree written by write_tree back into a nested dictionary of arrays.
+    '''
+    tree = {}
+
+    for name, node in group._v_children.items():
+        if isinstance( node, Leaf ):
+            tree[name] = node.read()
+        else:
+            tree[name] = read_tree( node )
+
+    return tree
@@ -3,62 +3,39 @@ Created on 2010-08-06
 
 @author: Andrew Roth
 '''
-import time
-
 import numpy as np
 
-from tables import openFile, Filters, UInt32Col, StringCol
+from tables import UInt32Col, StringCol
 from tables.description import IsDescription
 
-class JointCountsFile:
+from joint_snv_mix.file_formats.hdf5_file import HDF5File, join_path
+from joint_snv_mix.file_formats.shards import open_file
+
+class JointCountsFile( HDF5File ):
     '''
     Class representing a joint counts formated file.
     
     Any acess to the underlying HDF5 file hierachy should be placed here.
     '''
-    def __init__( self, file_name, file_mode, compression_level=1, compression_lib='zlib' ):
-        '''
-        For compatibility it is recommended the compression values are left at defaults.
-        
-        Arguments:
-        file_name -- Path to file
-        file_mode -- How file should be opened i.e. r, w, a, r+
-        compression_level -- Level of compression to use from 1 to 9
-        compression_lib -- Compression library to use see PyTables docs for option.
-        '''
-        compression_filters = Filters( complevel=compression_level, complib=compression_lib )
-
-        if file_mode == "w":
-            self._file_handle = openFile( file_name, file_mode, filters=compression_filters )
-            
-            self._file_handle.setNodeAttr( '/', 'creation_date', time.ctime() )
-        else:
-            self._file_handle = openFile( file_name, file_mode )
-
-        self.entries = self._init_entries()
-
-        self._chr_tables = self._init_chr_tables()
-    
     def add_rows( self, chr_name, rows ):
-        table = self._get_chr_table( chr_name )
+        self._get_chr_table( chr_name )
         
-        table.append( rows )
-        table.flush()
+        self._append( join_path( '/', chr_name ), rows )
         
-    def get_rows( self, chr_name ):
-        table = self._get_chr_table( chr_name )
+    def get_rows( self, chr_name, start=None, stop=None ):
+        '''
+        Read the rows of a chromosome. If start and stop are given only rows in that range are read.
+        '''
+        table = self._get_node( join_path( '/', chr_name ) )
         
-        rows = table.read()
+        rows = table.read( start, stop )
         
         return rows
     
     def get_table_size( self, chr_name ):
-        table = self._get_chr_table( chr_name )
+        table = self._get_node( join_path( '/', chr_name ) )
         
         return table.nrows
-    
-    def close( self ):
-        self._file_handle.close()
 
     def _get_chr_table( self, chr_name ):
         '''
@@ -70,35 +47,14 @@ class JointCountsFile:
         chr_name -- Name of table to fetch.
         
         Return:
-        chr_table -- A counts table object. See BinomialCountsTable for columns.
+        chr_table -- A counts table object. See JointCountsIndexTable for columns.
         '''
-        if chr_name in self._chr_tables:
-            chr_table = self._chr_tables[chr_name]
-        else:
-            chr_table = self._file_handle.createTable( self._file_handle.root, chr_name, JointCountsIndexTable )
-
-            self._chr_tables[chr_name] = chr_table
-
-        return chr_table
+        self.entries.add( chr_name )
+        
+        return self._get_table( '/', chr_name, JointCountsIndexTable, chr_name )
 
     def _init_entries( self ):
-        '''
-        Build the initial list of chromosomes in table.
-        '''
-        entries = set()
-
-        for table in self._file_handle.iterNodes( where=self._file_handle.root ):
-            entries.add( table._v_name )
-
-        return entries
-
-    def _init_chr_tables( self ):
-        chr_tables = {}
-
-        for chr_name in self.entries:
-            chr_tables[chr_name] = self._file_handle.getNode( self._file_handle.root, chr_name )
-
-        return chr_tables
+        return set( self._list_nodes( '/' ) )
 
 class JointCountsReader:
     '''
@@ -107,9 +63,9 @@ class JointCountsReader:
     def __init__( self, file_name ):
         '''
         Arguments:
-        file_name -- Path to joint counts file to be read.
+        file_name -- Path to joint counts file or manifest of a sharded data set to be read.
         '''
-        self._file_handle = JointCountsFile( file_name, 'r' )
+        self._file_handle = open_file( file_name, 'r', JointCountsFile )
         
     def close( self ):
         '''
@@ -127,19 +83,13 @@ class JointCountsReader:
             for chr_name in sorted( self.get_chr_list() ):
                 rows = self._file_handle.get_rows( chr_name )
                 
-                counts_cols = np.column_stack( [
-                                         rows['normal_counts_a'], rows['normal_counts_b'], rows['tumour_counts_a'], rows['tumour_counts_b']
-                                         ] )
-                
-                counts.append( counts_cols )
+                counts.append( get_counts_from_rows( rows ) )
                 
             counts = np.vstack( counts )
         else:
             rows = self._file_handle.get_rows( chr_name )
                 
-            counts = np.column_stack( [
-                                        rows['normal_counts_a'], rows['normal_counts_b'], rows['tumour_counts_a'], rows['tumour_counts_b']
-                                        ] )
+            counts = get_counts_from_rows( rows )
         
         return counts
     
@@ -154,8 +104,25 @@ class JointCountsReader:
             
         return data_set_size
     
-    def get_rows( self, chr_name ):
-        return self._file_handle.get_rows( chr_name )
+    def get_rows( self, chr_name, start=None, stop=None ):
+        return self._file_handle.get_rows( chr_name, start, stop )
+    
+    def get_filtered_sites( self ):
+        '''
+        Return a dictionary of the number of sites removed by the candidate site filter for each chromosome.
+        '''
+        return self._file_handle.get_filtered_sites()
+
+def get_counts_from_rows( rows ):
+    '''
+    Stack the count columns of jcnt rows into an array with columns normal a, normal b, tumour a, tumour b.
+    '''
+    counts = np.column_stack( [
+                               rows['normal_counts_a'], rows['normal_counts_b'],
+                               rows['tumour_counts_a'], rows['tumour_counts_b']
+                               ] )
+    
+    return counts
 
 class JointCountsIndexTable( IsDescription ):
     position = UInt32Col( pos=0 )
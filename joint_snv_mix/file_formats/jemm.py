@@ -3,105 +3,63 @@ Created on 2010-08-25
 
 @author: Andrew Roth
 '''
-import time
-
 import numpy as np
 
-from tables import openFile, Filters, Float64Atom, StringCol, IsDescription, UInt32Col, Float64Col
+from tables import StringCol, IsDescription, UInt32Col, Float64Col
 from joint_snv_mix.constants import joint_extended_multinomial_genotypes
 import joint_snv_mix.constants as constants
-   
-class JointExtendedMultiMixFile:
-    def __init__( self, file_name, file_mode, compression_level=1, compression_lib='zlib' ):
-        '''Constructor
-                    
-        For compatibility it is reccomeded the compression values are left at defaults.
-        
-        Arguments:
-        file_name -- Path to file
-        file_mode -- How file should be opened i.e. r, w, a, r+
-        compression_level -- Level of compression to use from 1 to 9
-        compression_lib -- Compression library to use see PyTables docs for option.
-        '''
-        compression_filters = Filters( complevel=compression_level, complib=compression_lib )
+from joint_snv_mix.file_formats.hdf5_file import HDF5File, join_path
+from joint_snv_mix.file_formats.mcnt import MultinomialCountsIndexTable
 
-        if file_mode == "w":
-            self._file_handle = openFile( file_name, file_mode, filters=compression_filters )
-            self._data_group = self._file_handle.createGroup( "/", "data" )
-            self._parameters_group = self._file_handle.createGroup( "/", "parameters" )
-            self._priors_group = self._file_handle.createGroup( "/", "priors" )
-            
-            self._file_handle.setNodeAttr( '/', 'creation_date', time.ctime() )
-        else:
-            self._file_handle = openFile( file_name, file_mode )
-            self._data_group = self._file_handle.root.data
-            self._parameters_group = self._file_handle.root.parameters
-            self._priors_group = self._file_handle.root.priors
-
-        self._init_entries()
+# Non-reference mass below which positions are stored without probabilities if no threshold is given.
+default_sparse_epsilon = 1e-4
 
-        self._init_chr_tables()
-        
-    def write_priors( self, priors ):
-        priors_group = self._priors_group
-        
-        self._write_tree( priors, priors_group )
-        
-    def write_parameters( self, parameters ):    
-        params_group = self._parameters_group
-        
-        self._write_tree( parameters, params_group )
+# Indices of the joint genotypes in each genotype class.
+genotype_class_indices = {
+                          'Somatic' : np.array( constants.somatic_extended_multinomial_genotypes_indices ),
+                          'Germline' : np.array( constants.matched_extended_multinomial_genotypes_indices ),
+                          'LOH' : np.array( constants.loh_extended_multinomial_genotypes_indices )
+                          }
+   
+class JointExtendedMultiMixFile( HDF5File ):
+    '''
+    Positions are stored sparsely as in jmm files. Only positions with non-reference mass above the sparse threshold
+    have their 225 genotype probabilities stored, the mcnt rows of all others are stored in the reference group.
+    '''
+    groups = ['data', 'parameters', 'priors', 'reference']
     
-    def _write_tree( self, params, group ):
-        for name, value in params.items():
-            if isinstance( value, dict ):
-                new_group = self._file_handle.createGroup( group, name )
-                self._write_tree( value, new_group )
-            else:
-                atom = Float64Atom( () )
-        
-                shape = np.array( value ).shape
-        
-                parameter_array = self._file_handle.createCArray( group, name, atom, shape )
-                
-                parameter_array[:] = value[:]
-                
-    def get_priors( self ):
-        priors = {}
+    def set_sparse_epsilon( self, epsilon ):
+        self._set_attr( 'sparse_epsilon', epsilon )
+    
+    def get_sparse_epsilon( self ):
+        return self._get_attr( 'sparse_epsilon' )
+    
+    def write_chr_table( self, chr_name, data ):
+        # The table is always created so chromosomes with no non-reference rows are listed.
+        self.entries.add( chr_name )
         
-        self._read_tree( priors, self._priors_group )
+        self._get_table( '/data', chr_name, JointExtendedMultiMixTable, chr_name )
         
-        return priors
+        self._append( join_path( '/data', chr_name ), data )
     
-    def get_parameters( self ):
-        parameters = {}
+    def write_reference_table( self, chr_name, index_rows ):
+        if len( index_rows ) == 0:
+            return
         
-        self._read_tree( parameters, self._parameters_group )
+        self._get_table( '/reference', chr_name, MultinomialCountsIndexTable, chr_name )
         
-        return parameters
+        self._append( join_path( '/reference', chr_name ), index_rows )
     
-    def _read_tree( self, params, group ):
-        for entry in self._file_handle.iterNodes( where=group ):
-            name = entry._v_name 
-            
-            if isinstance( entry, Leaf ):
-                params[name] = entry[:]
-            else:
-                params[name] = {}
-                self._read_tree( params[name], entry )
-            
-    def write_chr_table( self, chr_name, data ):
-        if chr_name not in self._chr_tables:
-            chr_table = self._file_handle.createTable( '/data', chr_name, JointSnvMixTable )
-            
-            self._chr_tables[chr_name] = chr_table
-        else:
-            chr_table = self._chr_tables[chr_name]
+    def get_reference_rows( self, chr_name ):
+        path = join_path( '/reference', chr_name )
         
-        chr_table.append( data )
+        if not self._has_node( path ):
+            return []
+        
+        return self._get_node( path )[:]
         
     def get_responsibilities( self, chr_name ):
-        table = self._chr_tables[chr_name]
+        table = self._get_chr_table( chr_name )
         
         probs = []
         
@@ -116,27 +74,24 @@ class JointExtendedMultiMixFile:
         return responsibilities
     
     def get_row_above_prob( self, chr_name, class_labels, prob_threshold ):
-        table = self._chr_tables[chr_name]
+        '''
+        The class probability is summed with numpy rather than in a table query since numexpr limits the number of
+        columns a query can use to fewer than some genotype classes have.
+        '''
+        rows = self._get_chr_table( chr_name ).read()
         
-        probs = []
+        class_prob = np.zeros( ( len( rows ), ) )
         
         for i in class_labels:
             prob = "_".join( joint_extended_multinomial_genotypes[i] )
             prob = "p" + "_" + prob
             
-            probs.append( prob )
-            
+            class_prob += rows[prob]
         
-        query_string = " + ".join( probs )
-        
-        query_string = "{0} >= {1}".format( query_string, prob_threshold )
-        
-        rows = table.readWhere( query_string )
-        
-        return rows
+        return rows[class_prob >= prob_threshold]
     
     def get_rows( self, chr_name, row_indices=None ):
-        table = self._chr_tables[chr_name]
+        table = self._get_chr_table( chr_name )
         
         if row_indices is None:
             return table[:]
@@ -144,40 +99,53 @@ class JointExtendedMultiMixFile:
             return table[row_indices]
     
     def get_position( self, chr_name, coord ):
-        table = self._chr_tables[chr_name]
+        table = self._get_chr_table( chr_name )
         
         search_string = "position == {0}".format( coord )
         row = table.readWhere( search_string )
         
         if len( row ) == 0:
-            row = []
+            row = self._get_reference_position( chr_name, search_string )
         else:
             row = row[0].tolist()
         
         return row
+    
+    def _get_reference_position( self, chr_name, search_string ):
+        '''
+        Search the reference rows. Matching rows are reported with all mass on the genotype homozygous for the
+        reference base in both genomes.
+        '''
+        path = join_path( '/reference', chr_name )
         
+        if not self._has_node( path ):
+            return []
         
-    def close( self ):
-        self._file_handle.close()
-
-    def _init_entries( self ):
+        row = self._get_node( path ).readWhere( search_string )
+        
+        if len( row ) == 0:
+            return []
+        
+        row = list( row[0].tolist() )
+        
+        responsibilities = [0.] * len( joint_extended_multinomial_genotypes )
+        responsibilities[constants.extended_multinomial_reference_genotype_indices[row[1]]] = 1.
+        
+        row.extend( responsibilities )
+        
+        return row
+    
+    def _get_chr_table( self, chr_name ):
         '''
-        Build the initial list of chromosomes in table.
+        Raises KeyError if the file has no table for the chromosome.
         '''
-        entries = set()
-
-        for table in self._file_handle.iterNodes( where=self._data_group ):
-            entries.add( table._v_name )
-
-        self.entries = entries
-
-    def _init_chr_tables( self ):
-        chr_tables = {}
-
-        for chr_name in self.entries:
-            chr_tables[chr_name] = self._file_handle.getNode( self._data_group, chr_name )
-
-        self._chr_tables = chr_tables
+        if chr_name not in self.entries:
+            raise KeyError( chr_name )
+        
+        return self._get_node( join_path( '/data', chr_name ) )
+    
+    def _init_entries( self ):
+        return set( self._list_nodes( '/data' ) )
 
 class JointExtendedMultiMixReader:
     def __init__( self, file_name ):
@@ -187,28 +155,14 @@ class JointExtendedMultiMixReader:
         return self._file_handle.entries
     
     def get_genotype_rows_by_argmax( self, chr_name, genotype_class ):
-        if genotype_class == 'Somatic':
-            class_labels = constants.somatic_extended_multinomial_genotypes_indices
-        elif genotype_class == 'Germline':
-            class_labels = constants.matched_extended_multinomial_genotypes_indices
-        elif genotype_class == 'LOH':
-            class_labels = constants.loh_extended_multinomial_genotypes_indices
-        else:
-            raise Exception( 'Class {0} not accepted.'.format( genotype_class ) )
+        class_labels = get_genotype_class_indices( genotype_class )
         
         rows = self._get_rows_by_argmax( chr_name, class_labels )
         
         return rows
     
     def get_genotype_rows_by_prob( self, chr_name, genotype_class, prob_threshold ):
-        if genotype_class == 'Somatic':
-            class_labels = constants.somatic_extended_multinomial_genotypes_indices
-        elif genotype_class == 'Germline':
-            class_labels = constants.matched_extended_multinomial_genotypes_indices
-        elif genotype_class == 'LOH':
-            class_labels = constants.loh_extended_multinomial_genotypes_indices
-        else:
-            raise Exception( 'Class {0} not accepted.'.format( genotype_class ) )
+        class_labels = get_genotype_class_indices( genotype_class )
         
         rows = self._file_handle.get_row_above_prob( chr_name, class_labels, prob_threshold )
 
@@ -223,16 +177,24 @@ class JointExtendedMultiMixReader:
     def get_rows( self, chr_name ):
         return self._file_handle.get_rows( chr_name )
     
+    def get_reference_rows( self, chr_name ):
+        return self._file_handle.get_reference_rows( chr_name )
+    
+    def get_sparse_epsilon( self ):
+        return self._file_handle.get_sparse_epsilon()
+    
+    def get_parameters( self ):
+        return self._file_handle.get_parameters()
+    
+    def get_em_iterations( self ):
+        return self._file_handle.get_em_iterations()
+    
     def _get_rows_by_argmax( self, chr_name, class_labels ):
         responsibilities = self._file_handle.get_responsibilities( chr_name )
         
         labels = np.argmax( responsibilities, axis=1 )
         
-        row_indices = []
-        for class_label in class_labels:
-            row_indices.extend( np.where( labels == class_label )[0] )
-        
-        row_indices = sorted( row_indices )
+        row_indices = np.where( np.in1d( labels, class_labels ) )[0]
         
         rows = self._file_handle.get_rows( chr_name, row_indices )
         
@@ -241,11 +203,7 @@ class JointExtendedMultiMixReader:
     def _get_rows_by_prob( self, chr_name, class_labels, prob_threshold ):
         responsibilities = self._file_handle.get_responsibilities( chr_name )
         
-        shape = ( responsibilities.shape[0], )
-        class_prob = np.zeros( shape )
-        
-        for class_label in class_labels:
-            class_prob += responsibilities[:, class_label]
+        class_prob = responsibilities[:, class_labels].sum( axis=1 )
         
         row_indices = np.where( class_prob >= prob_threshold )
         
@@ -258,8 +216,17 @@ class JointExtendedMultiMixReader:
             return []
                
 class JointExtendedMultiMixWriter:
-    def __init__( self, file_name, ):
-        self._file_handle = JointExtendedMultiMixFile( file_name, 'w' )
+    def __init__( self, file_name, sparse_epsilon=default_sparse_epsilon, profile='default' ):
+        '''
+        Arguments:
+        file_name -- Path to file
+        sparse_epsilon -- Non-reference mass threshold used to choose the positions passed to write_data, recorded in
+                          the file.
+        profile -- Name of storage profile used to compress the file. See storage_profiles for options.
+        '''
+        self._file_handle = JointExtendedMultiMixFile( file_name, 'w', profile )
+        
+        self._file_handle.set_sparse_epsilon( sparse_epsilon )
         
     def write_priors( self, priors ):
         self._file_handle.write_priors( priors )
@@ -267,6 +234,18 @@ class JointExtendedMultiMixWriter:
     def write_parameters( self, parameters ):
         self._file_handle.write_parameters( parameters )
         
+    def set_em_iterations( self, iters ):
+        self._file_handle.set_em_iterations( iters )
+        
+    def set_expected_rows( self, chr_name, nrows ):
+        self._file_handle.set_expected_rows( chr_name, nrows )
+    
+    def write_reference_rows( self, chr_name, mcnt_rows ):
+        '''
+        Write the mcnt rows of positions stored without probabilities.
+        '''
+        self._file_handle.write_reference_table( chr_name, mcnt_rows )
+        
     def write_data( self, chr_name, jcnt_rows, responsibilities ):
         data = []
         
@@ -281,6 +260,12 @@ class JointExtendedMultiMixWriter:
     def close( self ):
         self._file_handle.close()
     
+def get_genotype_class_indices( genotype_class ):
+    if genotype_class not in genotype_class_indices:
+        raise Exception( 'Class {0} not accepted.'.format( genotype_class ) )
+    
+    return genotype_class_indices[genotype_class]
+    
 class JointExtendedMultiMixTable( IsDescription ):
     position = UInt32Col( pos=0 )
 
@@ -3,105 +3,56 @@ Created on 2010-08-25
 
 @author: Andrew Roth
 '''
-import time
-
 import numpy as np
 
-from tables import openFile, Filters, Float64Atom, StringCol, IsDescription, UInt32Col, Float64Col, Leaf
+from tables import StringCol, IsDescription, UInt32Col, Float64Col
 from joint_snv_mix.constants import joint_multinomial_genotypes
 from joint_snv_mix import constants
+from joint_snv_mix.file_formats.hdf5_file import HDF5File, join_path
+from joint_snv_mix.file_formats.mcnt import MultinomialCountsIndexTable
    
-class JointMultiMixFile:
-    def __init__( self, file_name, file_mode, compression_level=1, compression_lib='zlib' ):
-        '''Constructor
-                    
-        For compatibility it is reccomeded the compression values are left at defaults.
-        
-        Arguments:
-        file_name -- Path to file
-        file_mode -- How file should be opened i.e. r, w, a, r+
-        compression_level -- Level of compression to use from 1 to 9
-        compression_lib -- Compression library to use see PyTables docs for option.
+class JointMultiMixFile( HDF5File ):
+    groups = ['data', 'parameters', 'priors', 'reference']
+    
+    def set_sparse_epsilon( self, epsilon ):
+        self._set_attr( 'sparse_epsilon', epsilon )
+    
+    def get_sparse_epsilon( self ):
         '''
-        compression_filters = Filters( complevel=compression_level, complib=compression_lib )
-
-        if file_mode == "w":
-            self._file_handle = openFile( file_name, file_mode, filters=compression_filters )
-            self._data_group = self._file_handle.createGroup( "/", "data" )
-            self._parameters_group = self._file_handle.createGroup( "/", "parameters" )
-            self._priors_group = self._file_handle.createGroup( "/", "priors" )
-            
-            self._file_handle.setNodeAttr( '/', 'creation_date', time.ctime() )
-        else:
-            self._file_handle = openFile( file_name, file_mode )
-            self._data_group = self._file_handle.root.data
-            self._parameters_group = self._file_handle.root.parameters
-            self._priors_group = self._file_handle.root.priors
-
-        self._init_entries()
-
-        self._init_chr_tables()
-        
-    def write_priors( self, priors ):
-        priors_group = self._priors_group
+        Return the non-reference mass threshold used to write the file or None if the file is dense.
+        '''
+        return self._get_attr( 'sparse_epsilon' )
         
-        self._write_tree( priors, priors_group )
+    def write_chr_table( self, chr_name, data ):
+        # The table is always created so sparse files list chromosomes with no non-reference rows.
+        self.entries.add( chr_name )
         
-    def write_parameters( self, parameters ):    
-        params_group = self._parameters_group
+        self._get_table( '/data', chr_name, JointSnvMixTable, chr_name )
         
-        self._write_tree( parameters, params_group )
+        self._append( join_path( '/data', chr_name ), data )
     
-    def _write_tree( self, params, group ):
-        for name, value in params.items():
-            if isinstance( value, dict ):
-                new_group = self._file_handle.createGroup( group, name )
-                self._write_tree( value, new_group )
-            else:
-                atom = Float64Atom( () )
-        
-                shape = np.array( value ).shape
-        
-                parameter_array = self._file_handle.createCArray( group, name, atom, shape )
-                
-                parameter_array[:] = value[:]
-                
-    def get_priors( self ):
-        priors = {}
-        
-        self._read_tree( priors, self._priors_group )
-        
-        return priors
-    
-    def get_parameters( self ):
-        parameters = {}
+    def write_reference_table( self, chr_name, index_rows ):
+        '''
+        Write the mcnt rows of positions stored with the compact reference marker.
+        '''
+        if len( index_rows ) == 0:
+            return
         
-        self._read_tree( parameters, self._parameters_group )
+        self._get_table( '/reference', chr_name, MultinomialCountsIndexTable, chr_name )
         
-        return parameters
+        self._append( join_path( '/reference', chr_name ), index_rows )
     
-    def _read_tree( self, params, group ):
-        for entry in self._file_handle.iterNodes( where=group ):
-            name = entry._v_name 
-            
-            if isinstance( entry, Leaf ):
-                params[name] = entry[:]
-            else:
-                params[name] = {}
-                self._read_tree( params[name], entry )
-            
-    def write_chr_table( self, chr_name, data ):
-        if chr_name not in self._chr_tables:
-            chr_table = self._file_handle.createTable( '/data', chr_name, JointSnvMixTable )
-            
-            self._chr_tables[chr_name] = chr_table
-        else:
-            chr_table = self._chr_tables[chr_name]
+    def get_reference_rows( self, chr_name ):
+        # Files written before sparse storage was added have no reference group.
+        path = join_path( '/reference', chr_name )
+        
+        if not self._has_node( path ):
+            return []
         
-        chr_table.append( data )
+        return self._get_node( path )[:]
         
     def get_responsibilities( self, chr_name ):
-        table = self._chr_tables[chr_name]
+        table = self._get_chr_table( chr_name )
         
         probs = []
         
@@ -116,7 +67,7 @@ class JointMultiMixFile:
         return responsibilities
     
     def get_row_above_prob( self, chr_name, class_labels, prob_threshold ):
-        table = self._chr_tables[chr_name]
+        table = self._get_chr_table( chr_name )
         
         probs = []
         
@@ -136,7 +87,7 @@ class JointMultiMixFile:
         return rows
     
     def get_rows( self, chr_name, row_indices=None ):
-        table = self._chr_tables[chr_name]
+        table = self._get_chr_table( chr_name )
         
         if row_indices is None:
             return table
@@ -144,40 +95,53 @@ class JointMultiMixFile:
             return table[row_indices]
     
     def get_position( self, chr_name, coord ):
-        table = self._chr_tables[chr_name]
+        table = self._get_chr_table( chr_name )
         
         search_string = "position == {0}".format( coord )
         row = table.readWhere( search_string )
         
         if len( row ) == 0:
-            row = []
+            row = self._get_reference_position( chr_name, search_string )
         else:
             row = row[0].tolist()
         
         return row
+    
+    def _get_reference_position( self, chr_name, search_string ):
+        '''
+        Search the reference rows of a sparse file. Matching rows are reported with all mass on the genotype
+        homozygous for the reference base in both genomes.
+        '''
+        path = join_path( '/reference', chr_name )
         
+        if not self._has_node( path ):
+            return []
         
-    def close( self ):
-        self._file_handle.close()
-
-    def _init_entries( self ):
+        row = self._get_node( path ).readWhere( search_string )
+        
+        if len( row ) == 0:
+            return []
+        
+        row = list( row[0].tolist() )
+        
+        responsibilities = [0.] * len( joint_multinomial_genotypes )
+        responsibilities[constants.multinomial_reference_genotype_indices[row[1]]] = 1.
+        
+        row.extend( responsibilities )
+        
+        return row
+    
+    def _get_chr_table( self, chr_name ):
         '''
-        Build the initial list of chromosomes in table.
+        Raises KeyError if the file has no table for the chromosome.
         '''
-        entries = set()
-
-        for table in self._file_handle.iterNodes( where=self._data_group ):
-            entries.add( table._v_name )
-
-        self.entries = entries
-
-    def _init_chr_tables( self ):
-        chr_tables = {}
-
-        for chr_name in self.entries:
-            chr_tables[chr_name] = self._file_handle.getNode( self._data_group, chr_name )
-
-        self._chr_tables = chr_tables
+        if chr_name not in self.entries:
+            raise KeyError( chr_name )
+        
+        return self._get_node( join_path( '/data', chr_name ) )
+    
+    def _init_entries( self ):
+        return set( self._list_nodes( '/data' ) )
 
 class JointMultiMixReader:
     def __init__( self, file_name ):
@@ -223,6 +187,21 @@ class JointMultiMixReader:
     def get_rows( self, chr_name ):
         return self._file_handle.get_rows( chr_name )
     
+    def get_reference_rows( self, chr_name ):
+        '''
+        Get the mcnt rows of positions stored with the compact reference marker in a sparse file.
+        '''
+        return self._file_handle.get_reference_rows( chr_name )
+    
+    def get_sparse_epsilon( self ):
+        return self._file_handle.get_sparse_epsilon()
+    
+    def get_parameters( self ):
+        return self._file_handle.get_parameters()
+    
+    def get_em_iterations( self ):
+        return self._file_handle.get_em_iterations()
+    
     def _get_rows_by_argmax( self, chr_name, class_labels ):
         responsibilities = self._file_handle.get_responsibilities( chr_name )
         
@@ -258,8 +237,21 @@ class JointMultiMixReader:
             return []
                
 class JointMultiMixWriter:
-    def __init__( self, file_name, ):
-        self._file_handle = JointMultiMixFile( file_name, 'w' )
+    def __init__( self, file_name, sparse_epsilon=None, profile='default' ):
+        '''
+        Arguments:
+        file_name -- Path to file
+        sparse_epsilon -- If set only positions whose mass off the homozygous reference genotype is above this value
+                          have their responsibilities stored. All other positions are stored as reference without
+                          probabilities.
+        profile -- Name of storage profile used to compress the file. See storage_profiles for options.
+        '''
+        self._file_handle = JointMultiMixFile( file_name, 'w', profile )
+        
+        self._sparse_epsilon = sparse_epsilon
+        
+        if sparse_epsilon is not None:
+            self._file_handle.set_sparse_epsilon( sparse_epsilon )
         
     def write_priors( self, priors ):
         self._file_handle.write_priors( priors )
@@ -267,7 +259,21 @@ class JointMultiMixWriter:
     def write_parameters( self, parameters ):
         self._file_handle.write_parameters( parameters )
         
+    def set_em_iterations( self, iters ):
+        self._file_handle.set_em_iterations( iters )
+        
+    def set_expected_rows( self, chr_name, nrows ):
+        self._file_handle.set_expected_rows( chr_name, nrows )
+        
     def write_data( self, chr_name, jcnt_rows, responsibilities ):
+        if self._sparse_epsilon is not None:
+            non_ref_indices = self._get_non_reference_indices( jcnt_rows, responsibilities )
+            
+            self._file_handle.write_reference_table( chr_name, jcnt_rows[~non_ref_indices] )
+            
+            jcnt_rows = jcnt_rows[non_ref_indices]
+            responsibilities = responsibilities[non_ref_indices]
+        
         data = []
         
         for jcnt_row, resp in zip( jcnt_rows.tolist(), responsibilities ):
@@ -277,6 +283,22 @@ class JointMultiMixWriter:
             data.append( row )
         
         self._file_handle.write_chr_table( chr_name, data )
+    
+    def _get_non_reference_indices( self, mcnt_rows, responsibilities ):
+        '''
+        Find rows whose mass off the homozygous reference genotype exceeds the sparse threshold. Rows with an
+        ambiguous reference base are always kept.
+        '''
+        ref_bases = mcnt_rows['ref_base']
+        
+        ref_mass = np.zeros( ( responsibilities.shape[0], ) )
+        
+        for nucleotide, genotype_index in constants.multinomial_reference_genotype_indices.items():
+            nucleotide_rows = ( ref_bases == nucleotide )
+            
+            ref_mass[nucleotide_rows] = responsibilities[nucleotide_rows, genotype_index]
+        
+        return ( 1 - ref_mass ) > self._sparse_epsilon
 
     def close( self ):
         self._file_handle.close()
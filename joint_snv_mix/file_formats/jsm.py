@@ -3,117 +3,56 @@ Created on 2010-08-25
 
 @author: Andrew Roth
 '''
-import time
-
 import numpy as np
 
-from tables import openFile, Filters, Float64Atom, StringCol, IsDescription, UInt32Col, Float64Col, Leaf
+from tables import StringCol, IsDescription, UInt32Col, Float64Col
+
+from joint_snv_mix.file_formats.hdf5_file import HDF5File, join_path
+from joint_snv_mix.file_formats.jcnt import JointCountsIndexTable
+from joint_snv_mix.file_formats.shards import open_file
    
-class JointSnvMixFile:
-    def __init__( self, file_name, file_mode, compression_level=1, compression_lib='zlib' ):
-        '''Constructor
-                    
-        For compatibility it is reccomeded the compression values are left at defaults.
-        
-        Arguments:
-        file_name -- Path to file
-        file_mode -- How file should be opened i.e. r, w, a, r+
-        compression_level -- Level of compression to use from 1 to 9
-        compression_lib -- Compression library to use see PyTables docs for option.
+class JointSnvMixFile( HDF5File ):
+    groups = ['data', 'parameters', 'priors', 'reference']
+    
+    def set_sparse_epsilon( self, epsilon ):
+        self._set_attr( 'sparse_epsilon', epsilon )
+    
+    def get_sparse_epsilon( self ):
         '''
-        compression_filters = Filters( complevel=compression_level, complib=compression_lib )
-
-        if file_mode == "w":
-            self._file_handle = openFile( file_name, file_mode, filters=compression_filters )
-            self._data_group = self._file_handle.createGroup( "/", "data" )
-            self._parameters_group = self._file_handle.createGroup( "/", "parameters" )
-            self._priors_group = self._file_handle.createGroup( "/", "priors" )
-            
-            self._file_handle.setNodeAttr( '/', 'creation_date', time.ctime() )
-        else:
-            self._file_handle = openFile( file_name, file_mode )
-            self._data_group = self._file_handle.root.data
-            self._parameters_group = self._file_handle.root.parameters
-            self._priors_group = self._file_handle.root.priors
-
-        self._init_entries()
-
-        self._init_chr_tables()
-        
-    def write_priors( self, priors ):
-        priors_group = self._priors_group
+        Return the non-reference mass threshold used to write the file or None if the file is dense.
+        '''
+        return self._get_attr( 'sparse_epsilon' )
         
-        self._write_tree( priors, priors_group )
+    def write_chr_table( self, chr_name, data ):
+        # The table is always created so sparse files list chromosomes with no non-reference rows.
+        self.entries.add( chr_name )
         
-    def write_parameters( self, parameters ):    
-        params_group = self._parameters_group
+        self._get_table( '/data', chr_name, JointSnvMixTable, chr_name )
         
-        self._write_tree( parameters, params_group )
+        self._append( join_path( '/data', chr_name ), data )
     
-    def _write_tree( self, params, group ):
-        for name, value in params.items():
-            if isinstance( value, dict ):
-                new_group = self._file_handle.createGroup( group, name )
-                self._write_tree( value, new_group )
-            else:
-                atom = Float64Atom( () )
-        
-                shape = np.array( value ).shape
-        
-                parameter_array = self._file_handle.createCArray( group, name, atom, shape )
-                
-                parameter_array[:] = value[:]
-                
-    def get_priors( self ):
-        priors = {}
+    def write_reference_table( self, chr_name, index_rows ):
+        '''
+        Write the jcnt rows of positions stored with the compact reference marker.
+        '''
+        if len( index_rows ) == 0:
+            return
         
-        self._read_tree( priors, self._priors_group )
+        self._get_table( '/reference', chr_name, JointCountsIndexTable, chr_name )
         
-        return priors
+        self._append( join_path( '/reference', chr_name ), index_rows )
     
-    def get_parameters( self ):
-        parameters = {}
-        
-        self._read_tree( parameters, self._parameters_group )
+    def get_reference_rows( self, chr_name ):
+        # Files written before sparse storage was added have no reference group.
+        path = join_path( '/reference', chr_name )
         
-        return parameters
-    
-    def _read_tree( self, params, group ):
-        for entry in self._file_handle.iterNodes( where=group ):
-            name = entry._v_name 
-            
-            if isinstance( entry, Leaf ):
-                params[name] = entry[:]
-            else:
-                params[name] = {}
-                self._read_tree( params[name], entry )
-            
-            
-#    def get_parameters( self ):
-#        param_group = self._parameters_group
-#        
-#        params = {}
-#        
-#        for table in self._file_handle.iterNodes( where=param_group ):
-#            param_name = table._v_name
-#            param_value = table.read()
-#        
-#            params[param_name] = param_value
-#        
-#        return params
-            
-    def write_chr_table( self, chr_name, data ):
-        if chr_name not in self._chr_tables:
-            chr_table = self._file_handle.createTable( '/data', chr_name, JointSnvMixTable )
-            
-            self._chr_tables[chr_name] = chr_table
-        else:
-            chr_table = self._chr_tables[chr_name]        
+        if not self._has_node( path ):
+            return []
         
-        chr_table.append( data )
+        return self._get_node( path )[:]
         
     def get_responsibilities( self, chr_name ):
-        table = self._chr_tables[chr_name]
+        table = self._get_chr_table( chr_name )
         
         responsibilities = np.column_stack( ( 
                                             table.col( 'p_aa_aa' ),
@@ -130,7 +69,7 @@ class JointSnvMixFile:
         return responsibilities
     
     def get_rows( self, chr_name, row_indices=None ):
-        table = self._chr_tables[chr_name]
+        table = self._get_chr_table( chr_name )
         
         if row_indices is None:
             return table[:]
@@ -138,44 +77,56 @@ class JointSnvMixFile:
             return table[row_indices]
     
     def get_position( self, chr_name, coord ):
-        table = self._chr_tables[chr_name]
+        table = self._get_chr_table( chr_name )
         
         search_string = "position == {0}".format( coord )
         row = table.readWhere( search_string )
         
         if len( row ) == 0:
-            row = []
+            row = self._get_reference_position( chr_name, search_string )
         else:
             row = row[0].tolist()
         
         return row
+    
+    def _get_reference_position( self, chr_name, search_string ):
+        '''
+        Search the reference rows of a sparse file. Matching rows are reported with p_aa_aa set to 1.
+        '''
+        path = join_path( '/reference', chr_name )
         
+        if not self._has_node( path ):
+            return []
         
-    def close( self ):
-        self._file_handle.close()
-
-    def _init_entries( self ):
+        row = self._get_node( path ).readWhere( search_string )
+        
+        if len( row ) == 0:
+            return []
+        
+        row = list( row[0].tolist() )
+        row.extend( reference_responsibilities )
+        
+        return row
+    
+    def _get_chr_table( self, chr_name ):
         '''
-        Build the initial list of chromosomes in table.
+        Raises KeyError if the file has no table for the chromosome.
         '''
-        entries = set()
-
-        for table in self._file_handle.iterNodes( where=self._data_group ):
-            entries.add( table._v_name )
-
-        self.entries = entries
-
-    def _init_chr_tables( self ):
-        chr_tables = {}
-
-        for chr_name in self.entries:
-            chr_tables[chr_name] = self._file_handle.getNode( self._data_group, chr_name )
-
-        self._chr_tables = chr_tables
+        if chr_name not in self.entries:
+            raise KeyError( chr_name )
+        
+        return self._get_node( join_path( '/data', chr_name ) )
+    
+    def _init_entries( self ):
+        return set( self._list_nodes( '/data' ) )
 
 class JointSnvMixReader:
     def __init__( self, file_name ):
-        self._file_handle = JointSnvMixFile( file_name, 'r' )
+        '''
+        Arguments:
+        file_name -- Path to jsm file or manifest of a sharded data set to be read.
+        '''
+        self._file_handle = open_file( file_name, 'r', JointSnvMixFile )
 
     def get_chr_list( self ):
         return self._file_handle.entries
@@ -217,9 +168,21 @@ class JointSnvMixReader:
     def get_rows( self, chr_name ):
         return self._file_handle.get_rows( chr_name )
     
+    def get_reference_rows( self, chr_name ):
+        '''
+        Get the jcnt rows of positions stored with the compact reference marker in a sparse file.
+        '''
+        return self._file_handle.get_reference_rows( chr_name )
+    
+    def get_sparse_epsilon( self ):
+        return self._file_handle.get_sparse_epsilon()
+    
     def get_parameters( self ):
         return self._file_handle.get_parameters()        
     
+    def get_em_iterations( self ):
+        return self._file_handle.get_em_iterations()
+    
     def _get_rows_by_argmax( self, chr_name, class_labels ):
         responsibilities = self._file_handle.get_responsibilities( chr_name )
         
@@ -255,8 +218,21 @@ class JointSnvMixReader:
             return []
                
 class JointSnvMixWriter:
-    def __init__( self, file_name, ):
-        self._file_handle = JointSnvMixFile( file_name, 'w' )
+    def __init__( self, file_name, sparse_epsilon=None, profile='default', shard=False ):
+        '''
+        Arguments:
+        file_name -- Path to file
+        sparse_epsilon -- If set only positions with non-reference mass, 1 - p_aa_aa, above this value have their
+                          responsibilities stored. All other positions are stored as reference without probabilities.
+        profile -- Name of storage profile used to compress the file. See storage_profiles for options.
+        shard -- If set one file is written per chromosome and file_name is written as a manifest of them.
+        '''
+        self._file_handle = open_file( file_name, 'w', JointSnvMixFile, profile, shard )
+        
+        self._sparse_epsilon = sparse_epsilon
+        
+        if sparse_epsilon is not None:
+            self._file_handle.set_sparse_epsilon( sparse_epsilon )
         
     def write_priors( self, priors ):
         self._file_handle.write_priors( priors )
@@ -264,7 +240,23 @@ class JointSnvMixWriter:
     def write_parameters( self, parameters ):
         self._file_handle.write_parameters( parameters )
         
+    def set_em_iterations( self, iters ):
+        self._file_handle.set_em_iterations( iters )
+        
+    def set_expected_rows( self, chr_name, nrows ):
+        self._file_handle.set_expected_rows( chr_name, nrows )
+        
     def write_data( self, chr_name, jcnt_rows, responsibilities ):
+        if self._sparse_epsilon is not None:
+            non_ref_mass = 1 - responsibilities[:, 0]
+            
+            non_ref_indices = non_ref_mass > self._sparse_epsilon
+            
+            self._file_handle.write_reference_table( chr_name, jcnt_rows[~non_ref_indices] )
+            
+            jcnt_rows = jcnt_rows[non_ref_indices]
+            responsibilities = responsibilities[non_ref_indices]
+        
         data = []
         
         for jcnt_row, resp in zip( jcnt_rows.tolist(), responsibilities ):
@@ -278,6 +270,8 @@ class JointSnvMixWriter:
     def close( self ):
         self._file_handle.close()
     
+reference_responsibilities = ( 1., 0., 0., 0., 0., 0., 0., 0., 0. )
+    
 class JointSnvMixTable( IsDescription ):
     position = UInt32Col( pos=0 )
 
@@ -3,50 +3,27 @@ Created on 2010-08-06
 
 @author: Andrew Roth
 '''
-import time
-
 import numpy as np
 
-from tables import openFile, Filters, UInt32Col, StringCol
+from tables import UInt32Col, StringCol
 from tables.description import IsDescription
 
-class MultinomialCountsFile:
+from joint_snv_mix.file_formats.hdf5_file import HDF5File, join_path
+from joint_snv_mix.file_formats.shards import open_file
+
+class MultinomialCountsFile( HDF5File ):
     '''
     Class representing a joint counts formated file.
     
     Any acess to the underlying HDF5 file hierachy should be placed here.
     '''
-    def __init__( self, file_name, file_mode, compression_level=1, compression_lib='zlib' ):
-        '''
-        For compatibility it is recommended the compression values are left at defaults.
-        
-        Arguments:
-        file_name -- Path to file
-        file_mode -- How file should be opened i.e. r, w, a, r+
-        compression_level -- Level of compression to use from 1 to 9
-        compression_lib -- Compression library to use see PyTables docs for option.
-        '''
-        compression_filters = Filters( complevel=compression_level, complib=compression_lib )
-
-        if file_mode == "w":
-            self._file_handle = openFile( file_name, file_mode, filters=compression_filters )
-            
-            self._file_handle.setNodeAttr( '/', 'creation_date', time.ctime() )
-        else:
-            self._file_handle = openFile( file_name, file_mode )
-
-        self.entries = self._init_entries()
-
-        self._chr_tables = self._init_chr_tables()
-    
     def add_rows( self, chr_name, rows ):
-        table = self._get_chr_table( chr_name )
+        self._get_chr_table( chr_name )
         
-        table.append( rows )
-        table.flush()
+        self._append( join_path( '/', chr_name ), rows )
         
     def get_rows( self, chr_name, indices=None ):
-        table = self._get_chr_table( chr_name )
+        table = self._get_node( join_path( '/', chr_name ) )
         
         if indices is None:
             rows = table.read()
@@ -56,12 +33,9 @@ class MultinomialCountsFile:
         return rows
     
     def get_table_size( self, chr_name ):
-        table = self._get_chr_table( chr_name )
+        table = self._get_node( join_path( '/', chr_name ) )
         
         return table.nrows
-    
-    def close( self ):
-        self._file_handle.close()
 
     def _get_chr_table( self, chr_name ):
         '''
@@ -73,35 +47,14 @@ class MultinomialCountsFile:
         chr_name -- Name of table to fetch.
         
         Return:
-        chr_table -- A counts table object. See BinomialCountsTable for columns.
+        chr_table -- A counts table object. See MultinomialCountsIndexTable for columns.
         '''
-        if chr_name in self._chr_tables:
-            chr_table = self._chr_tables[chr_name]
-        else:
-            chr_table = self._file_handle.createTable( self._file_handle.root, chr_name, MultinomialCountsIndexTable )
-
-            self._chr_tables[chr_name] = chr_table
-
-        return chr_table
+        self.entries.add( chr_name )
+        
+        return self._get_table( '/', chr_name, MultinomialCountsIndexTable, chr_name )
 
     def _init_entries( self ):
-        '''
-        Build the initial list of chromosomes in table.
-        '''
-        entries = set()
-
-        for table in self._file_handle.iterNodes( where=self._file_handle.root ):
-            entries.add( table._v_name )
-
-        return entries
-
-    def _init_chr_tables( self ):
-        chr_tables = {}
-
-        for chr_name in self.entries:
-            chr_tables[chr_name] = self._file_handle.getNode( self._file_handle.root, chr_name )
-
-        return chr_tables
+        return set( self._list_nodes( '/' ) )
 
 class MultinomialCountsReader:
     '''
@@ -110,9 +63,9 @@ class MultinomialCountsReader:
     def __init__( self, file_name ):
         '''
         Arguments:
-        file_name -- Path to joint counts file to be read.
+        file_name -- Path to multinomial counts file or manifest of a sharded data set to be read.
         '''
-        self._file_handle = MultinomialCountsFile( file_name, 'r' )
+        self._file_handle = open_file( file_name, 'r', MultinomialCountsFile )
         
     def close( self ):
         '''
@@ -176,6 +129,12 @@ class MultinomialCountsReader:
     
     def get_rows( self, chr_name, indices=None ):
         return self._file_handle.get_rows( chr_name, indices )
+    
+    def get_filtered_sites( self ):
+        '''
+        Return a dictionary of the number of sites removed by the candidate site filter for each chromosome.
+        '''
+        return self._file_handle.get_filtered_sites()
 
 class MultinomialCountsIndexTable( IsDescription ):
     position = UInt32Col( pos=0 )
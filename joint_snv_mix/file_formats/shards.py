@@ -0,0 +1,288 @@
+'''
+Sharded data sets.
+
+A sharded data set is a set of ordinary files of one format, each holding some of the chromosomes, plus a small text
+manifest listing which file holds each chromosome. Since every shard is a complete file of its format a single
+chromosome can be processed on its own by passing the shard directly, and the readers open the manifest as if it were
+one file.
+
+Manifests start with the line manifest_header, followed by one line per chromosome of the form chr_name<TAB>path.
+Relative paths are taken relative to the directory of the manifest.
+
+Created on 2011-03-16
+
+@author: Andrew Roth
+'''
+import csv
+import os
+
+from tables import openFile, Table
+
+manifest_header = '#joint_snv_mix_shards'
+
+def open_file( file_name, file_mode, file_class, profile='default', shard=False ):
+    '''
+    Open a file which may be sharded.
+
+    Arguments:
+    file_name -- Path to file or manifest.
+    file_mode -- How file should be opened i.e. r, w.
+    file_class -- HDF5File subclass of the format.
+    profile -- Name of storage profile used to compress new tables.
+    shard -- If set and the file is opened for writing one shard is written per chromosome. Files opened for reading
+             are checked for a manifest so this has no effect.
+    '''
+    if file_mode == 'w':
+        is_sharded = shard
+    else:
+        is_sharded = is_manifest( file_name )
+
+    if is_sharded:
+        return ShardedFile( file_name, file_mode, file_class, profile )
+    else:
+        return file_class( file_name, file_mode, profile )
+
+def is_manifest( file_name ):
+    fh = open( file_name, 'rb' )
+
+    header = fh.read( len( manifest_header ) )
+
+    fh.close()
+
+    return header == manifest_header
+
+def read_manifest( file_name ):
+    '''
+    Return:
+    shard_file_names -- Dictionary mapping chromosome names to shard paths.
+    '''
+    shard_file_names = {}
+
+    manifest_dir = os.path.dirname( os.path.abspath( file_name ) )
+
+    reader = csv.reader( open( file_name ), delimiter='\t' )
+
+    for row in reader:
+        if len( row ) == 0 or row[0].startswith( '#' ):
+            continue
+
+        shard_file_names[row[0]] = os.path.join( manifest_dir, row[1] )
+
+    return shard_file_names
+
+def write_manifest( file_name, shard_file_names ):
+    '''
+    Write a manifest. Paths below the directory of the manifest are written relative to it so the data set can be
+    moved as a whole.
+
+    Arguments:
+    shard_file_names -- Dictionary mapping chromosome names to shard paths.
+    '''
+    manifest_dir = os.path.dirname( os.path.abspath( file_name ) )
+
+    fh = open( file_name, 'w' )
+
+    fh.write( manifest_header + "\n" )
+
+    for chr_name in sorted( shard_file_names ):
+        shard_file_name = os.path.abspath( shard_file_names[chr_name] )
+
+        if shard_file_name.startswith( manifest_dir + os.sep ):
+            shard_file_name = os.path.relpath( shard_file_name, manifest_dir )
+
+        fh.write( "\t".join( ( chr_name, shard_file_name ) ) + "\n" )
+
+    fh.close()
+
+def get_shard_file_name( file_name, chr_name ):
+    '''
+    Path of the shard holding a chromosome, placed in a directory named after the manifest.
+    '''
+    extension = os.path.splitext( file_name )[1]
+
+    return os.path.join( file_name + '.shards', chr_name + extension )
+
+def create_manifest( args ):
+    '''
+    Write a manifest for a set of existing files, for example jsm files from classifying the shards of a jcnt data set
+    on different nodes.
+    '''
+    shard_file_names = {}
+
+    for shard_file_name in args.shard_file_names:
+        for chr_name in get_entries( shard_file_name ):
+            if chr_name in shard_file_names:
+                raise Exception( 'Chromosome {0} is in {1} and {2}.'.format( chr_name,
+                                                                          shard_file_names[chr_name],
+                                                                          shard_file_name ) )
+
+            shard_file_names[chr_name] = shard_file_name
+
+    write_manifest( args.manifest_file_name, shard_file_names )
+
+def get_entries( file_name ):
+    '''
+    Return the chromosomes of a jcnt, mcnt or jsm file. Files written before the chromosome index was stored in the
+    root attribute entries are opened through the format class matching their layout, which rebuilds the index from
+    the nodes of the file as the readers do.
+    '''
+    # The format modules import this one so they can only be imported once it is loaded.
+    from joint_snv_mix.file_formats.jcnt import JointCountsFile
+    from joint_snv_mix.file_formats.jsm import JointSnvMixFile
+
+    fh = openFile( file_name, 'r' )
+
+    if 'entries' in fh.root._v_attrs:
+        entries = fh.getNodeAttr( '/', 'entries' )
+
+        fh.close()
+
+        return entries
+
+    # Classified files hold one table per chromosome under /data, counts files one per chromosome under the root.
+    if '/data' in fh:
+        file_class = JointSnvMixFile
+        chr_nodes = fh.listNodes( '/data' )
+    else:
+        file_class = JointCountsFile
+        chr_nodes = fh.listNodes( '/' )
+
+    is_supported = all( isinstance( node, Table ) for node in chr_nodes )
+
+    fh.close()
+
+    if not is_supported:
+        raise Exception( 'Can not find the chromosomes of {0}. Only jcnt, mcnt and jsm files can be listed in a '
+                         'manifest.'.format( file_name ) )
+
+    shard = file_class( file_name, 'r' )
+
+    entries = shard.entries
+
+    shard.close()
+
+    return entries
+
+class ShardedFile( object ):
+    '''
+    Present the shards of a data set through the interface of the format class.
+
+    Methods taking a chromosome name as their first argument are passed to the shard holding it. Parameters, priors
+    and settings are written to every shard and read from any one. When writing a new shard is started the first time
+    a chromosome is seen.
+    '''
+    # Methods which apply to every shard when writing.
+    broadcast_methods = ( 'write_priors', 'write_parameters', 'set_sparse_epsilon', 'set_em_iterations' )
+
+    # Methods whose value is the same for all shards when reading.
+    shared_methods = ( 'get_priors', 'get_parameters', 'get_sparse_epsilon', 'get_creation_date', 'get_em_iterations' )
+
+    def __init__( self, file_name, file_mode, file_class, profile='default' ):
+        self._file_name = file_name
+        self._file_mode = file_mode
+        self._file_class = file_class
+        self._profile = profile
+
+        # Open shards keyed by path, several chromosomes may share a shard.
+        self._shards = {}
+
+        self._broadcast_calls = []
+
+        if file_mode == 'w':
+            self._shard_file_names = {}
+        else:
+            self._shard_file_names = read_manifest( file_name )
+
+            for shard_file_name in set( self._shard_file_names.values() ):
+                self._shards[shard_file_name] = file_class( shard_file_name, file_mode )
+
+    @property
+    def entries( self ):
+        entries = set()
+
+        for shard in self._shards.values():
+            entries.update( shard.entries )
+
+        return entries
+
+    def close( self ):
+        for shard in self._shards.values():
+            shard.close()
+
+        if self._file_mode == 'w':
+            write_manifest( self._file_name, self._shard_file_names )
+
+    def write_filter_summary( self, min_var_count, min_var_freq, filtered_sites ):
+        '''
+        Store the filtered site counts of each chromosome in its own shard.
+        '''
+        for chr_name in filtered_sites:
+            self._get_shard( chr_name )
+
+        for shard_file_name, shard in self._shards.items():
+            shard_filtered_sites = {}
+
+            for chr_name, count in filtered_sites.items():
+                if self._shard_file_names[chr_name] == shard_file_name:
+                    shard_filtered_sites[chr_name] = count
+
+            shard.write_filter_summary( min_var_count, min_var_freq, shard_filtered_sites )
+
+    def get_filtered_sites( self ):
+        filtered_sites = {}
+
+        for shard in self._shards.values():
+            filtered_sites.update( shard.get_filtered_sites() )
+
+        return filtered_sites
+
+    def __getattr__( self, name ):
+        if name.startswith( '_' ):
+            raise AttributeError( name )
+
+        if name in self.broadcast_methods:
+            def method( *args ):
+                self._broadcast_calls.append( ( name, args ) )
+
+                for shard in self._shards.values():
+                    getattr( shard, name )( *args )
+        elif name in self.shared_methods:
+            def method( *args ):
+                if len( self._shards ) == 0:
+                    raise Exception( 'Manifest {0} lists no shards.'.format( self._file_name ) )
+
+                return getattr( self._shards.values()[0], name )( *args )
+        else:
+            def method( chr_name, *args, **kwargs ):
+                return getattr( self._get_shard( chr_name ), name )( chr_name, *args, **kwargs )
+
+        return method
+
+    def _get_shard( self, chr_name ):
+        if chr_name not in self._shard_file_names:
+            # KeyError as for a chromosome missing from an unsharded file.
+            if self._file_mode != 'w':
+                raise KeyError( 'Chromosome {0} is not listed in manifest {1}.'.format( chr_name, self._file_name ) )
+
+            self._shard_file_names[chr_name] = get_shard_file_name( self._file_name, chr_name )
+
+        shard_file_name = self._shard_file_names[chr_name]
+
+        if shard_file_name not in self._shards:
+            self._shards[shard_file_name] = self._open_shard( shard_file_name )
+
+        return self._shards[shard_file_name]
+
+    def _open_shard( self, shard_file_name ):
+        shard_dir = os.path.dirname( shard_file_name )
+
+        if shard_dir and not os.path.exists( shard_dir ):
+            os.makedirs( shard_dir )
+
+        shard = self._file_class( shard_file_name, self._file_mode, self._profile )
+
+        # Shards started late still get the priors, parameters and settings written so far.
+        for name, args in self._broadcast_calls:
+            getattr( shard, name )( *args )
+
+        return shard
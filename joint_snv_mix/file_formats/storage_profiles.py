@@ -0,0 +1,29 @@
+'''
+Compression profiles shared by all HDF5 file formats.
+
+The default profile matches the zlib settings used by earlier releases. The other profiles use Blosc and require a
+PyTables build with Blosc support to read the files they produce.
+'''
+from tables import Filters
+
+profiles = {
+            'default' : { 'complevel' : 1, 'complib' : 'zlib', 'shuffle' : True },
+            'fast' : { 'complevel' : 5, 'complib' : 'blosc:lz4', 'shuffle' : True },
+            'small' : { 'complevel' : 9, 'complib' : 'blosc:zstd', 'shuffle' : True }
+            }
+
+# Row count PyTables assumes when sizing chunks for a table without an expectedrows hint.
+default_expected_rows = 10000
+
+def get_filters( profile ):
+    '''
+    Build the PyTables filters for a named storage profile.
+
+    Arguments:
+    profile -- Name of profile, one of the keys of profiles.
+    '''
+    if profile not in profiles:
+        raise Exception( 'Storage profile {0} not recognised. Options are {1}.'.format( profile,
+                                                                                      ", ".join( sorted( profiles ) ) ) )
+
+    return Filters( **profiles[profile] )
@@ -0,0 +1,96 @@
+'''
+Benchmark the HDF5 storage profiles by rewriting the rows of a jcnt file under each profile.
+'''
+import os
+import tempfile
+import time
+
+from joint_snv_mix.file_formats.jcnt import JointCountsFile, JointCountsReader
+from joint_snv_mix.file_formats.storage_profiles import profiles
+
+fields = [
+          'profile',
+          'size_mb',
+          'compression_ratio',
+          'write_rows_per_sec',
+          'write_mb_per_sec',
+          'read_rows_per_sec',
+          'read_mb_per_sec'
+          ]
+
+def benchmark_storage_profiles( args ):
+    rows = load_rows( args.jcnt_file_name )
+
+    nrows = sum( [len( x ) for x in rows.values()] )
+    nbytes = sum( [x.nbytes for x in rows.values()] )
+
+    if args.profiles is None:
+        profile_names = sorted( profiles )
+    else:
+        profile_names = args.profiles
+
+    tmp_dir = tempfile.mkdtemp( dir=args.tmp_dir )
+
+    print "\t".join( fields )
+
+    for profile in profile_names:
+        file_name = os.path.join( tmp_dir, profile + ".jcnt" )
+
+        write_time = time_write( file_name, profile, rows )
+        read_time = time_read( file_name )
+
+        file_size = os.path.getsize( file_name )
+
+        os.remove( file_name )
+
+        out_row = [
+                   profile,
+                   file_size / 1e6,
+                   float( nbytes ) / file_size,
+                   nrows / write_time,
+                   nbytes / 1e6 / write_time,
+                   nrows / read_time,
+                   nbytes / 1e6 / read_time
+                   ]
+
+        print "\t".join( [str( x ) for x in out_row] )
+
+    os.rmdir( tmp_dir )
+
+def load_rows( jcnt_file_name ):
+    reader = JointCountsReader( jcnt_file_name )
+
+    rows = {}
+
+    for chr_name in reader.get_chr_list():
+        rows[chr_name] = reader.get_rows( chr_name )
+
+    reader.close()
+
+    return rows
+
+def time_write( file_name, profile, rows ):
+    start = time.time()
+
+    jcnt_file = JointCountsFile( file_name, 'w', profile )
+
+    for chr_name in sorted( rows ):
+        jcnt_file.set_expected_rows( chr_name, len( rows[chr_name] ) )
+
+        jcnt_file.add_rows( chr_name, rows[chr_name] )
+
+    jcnt_file.close()
+
+    return time.time() - start
+
+def time_read( file_name ):
+    start = time.time()
+
+    reader = JointCountsReader( file_name )
+
+    for chr_name in sorted( reader.get_chr_list() ):
+        reader.get_rows( chr_name )
+
+    reader.close()
+
+    return time.time() - start
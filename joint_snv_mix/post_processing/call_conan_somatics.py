@@ -71,7 +71,7 @@ def get_writer(args, cn_state):
 def format_row(chr_name, index_row, resp, p_genotype_str):
     row = {}
     
-    index_row = list(index_row[:])
+    index_row = list(index_row.tolist())
     
     for i, field_name in enumerate(index_fields):
         row[field_name] = index_row[i - 1]
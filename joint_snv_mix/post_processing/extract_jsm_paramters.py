@@ -1,11 +1,108 @@
+from tables import openFile
+
+from joint_snv_mix import constants
+
+from joint_snv_mix.classification.parameter_parsers import IndependentBinomialParameterParser, \
+    IndependentBetaBinomialParameterParser, JointBinomialParameterParser, JointBetaBinomialParameterParser, \
+    JointMultinomialParameterParser, JointExtendedMultinomialParameterParser
+
+from joint_snv_mix.file_formats.jemm import JointExtendedMultiMixReader
+from joint_snv_mix.file_formats.jmm import JointMultiMixReader
 from joint_snv_mix.file_formats.jsm import JointSnvMixReader
+from joint_snv_mix.file_formats.shards import is_manifest
 
 def extract_jsm_parameters( args ):
-    reader = JointSnvMixReader( args.jsm_file_name )    
-    parameters = reader.get_parameters()    
+    reader = get_reader( args.jsm_file_name )
+    parameters = reader.get_parameters()
     reader.close()
-    
-    recursive_print( parameters )
+
+    if args.params_file_name is None:
+        recursive_print( parameters )
+    else:
+        write_params_file( args.params_file_name, parameters, args.chr_name )
+
+def write_params_file( params_file_name, parameters, chr_name=None ):
+    '''
+    Write the parameters of a jsm file as a params file which can be passed to snvmix with --params_file.
+
+    Arguments:
+    params_file_name -- Path of params file to write.
+    parameters -- Parameters read from a jsm file.
+    chr_name -- Chromosome to take parameters from if the file was written by the chromosome model.
+    '''
+    if is_chromosome_parameters( parameters ):
+        if chr_name is None:
+            raise Exception( 'Parameters were trained per chromosome, use --chr_name to select one.' )
+
+        if chr_name not in parameters:
+            available = ', '.join( sorted( parameters.keys() ) )
+
+            raise Exception( 'No parameters for chromosome {0}. Available chromosomes are {1}.'.format( chr_name,
+                                                                                                    available ) )
+
+        parameters = parameters[chr_name]
+
+    parser = get_parameter_parser( parameters )
+
+    parser.save_to_file( params_file_name, parameters )
+
+def get_reader( file_name ):
+    '''
+    Open a jsm, jmm or jemm file with the reader of its format. The multinomial models store a rho parameter for each
+    genome, with one row per genotype, which separates jmm and jemm files from jsm files and from each other.
+    '''
+    # Only jsm files are sharded.
+    if is_manifest( file_name ):
+        return JointSnvMixReader( file_name )
+
+    fh = openFile( file_name, 'r' )
+
+    if '/parameters/normal/rho' in fh:
+        ngenotypes = fh.getNode( '/parameters/normal/rho' ).shape[0]
+    else:
+        ngenotypes = None
+
+    fh.close()
+
+    if ngenotypes is None:
+        return JointSnvMixReader( file_name )
+    elif ngenotypes == len( constants.extended_multinomial_genotypes ):
+        return JointExtendedMultiMixReader( file_name )
+    else:
+        return JointMultiMixReader( file_name )
+
+def is_chromosome_parameters( parameters ):
+    return 'pi' not in parameters and set( parameters.keys() ) != set( constants.genomes )
+
+def get_parameter_parser( parameters ):
+    '''
+    Pick the parameter parser matching the model and density the parameters were trained with.
+    '''
+    normal_parameters = parameters.get( 'normal', {} )
+
+    is_multinomial = 'rho' in normal_parameters
+    is_beta_binomial = 'alpha' in normal_parameters
+    is_binomial = 'mu' in normal_parameters and 'pi' not in normal_parameters
+
+    # Joint models share one set of mixture weights, independent models have one per genome.
+    if 'pi' in parameters:
+        if is_multinomial:
+            if normal_parameters['rho'].shape[0] == len( constants.extended_multinomial_genotypes ):
+                return JointExtendedMultinomialParameterParser()
+            else:
+                return JointMultinomialParameterParser()
+        elif is_beta_binomial:
+            return JointBetaBinomialParameterParser()
+        elif is_binomial:
+            return JointBinomialParameterParser()
+    elif 'pi' in normal_parameters:
+        if is_beta_binomial:
+            return IndependentBetaBinomialParameterParser()
+        elif 'mu' in normal_parameters:
+            return IndependentBinomialParameterParser()
+
+    raise Exception( 'Can not write parameters with entries {0} as a params file. Only the parameters of the snvmix '
+                     'and multimix models are supported.'.format( ', '.join( sorted( parameters.keys() ) ) ) )
 
 def recursive_print( params ):
     for name, value in sorted( params.iteritems() ):
@@ -20,7 +117,7 @@ def recursive_print( params ):
 
 if __name__ == "__main__":
     import sys
-    
+
     jsm_file_name = sys.argv[1]
-    
+
     extract_jsm_parameters( jsm_file_name )
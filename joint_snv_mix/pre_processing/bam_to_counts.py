@@ -0,0 +1,313 @@
+'''
+Build jcnt and mcnt files directly from a pair of normal and tumour BAM files, skipping the mpileup text stage.
+
+Needs pysam, which is an optional dependency of the package. jsm.py only imports this module when the bam sub-command
+is run so the other sub-commands work without it.
+
+Created on 2011-03-09
+
+@author: Andrew Roth
+'''
+import multiprocessing
+
+from collections import Counter
+
+import pysam
+
+import tables
+import warnings
+warnings.filterwarnings( 'ignore', category=tables.NaturalNameWarning )
+
+from joint_snv_mix.constants import nucleotides
+from joint_snv_mix.file_formats.jcnt import JointCountsFile
+from joint_snv_mix.file_formats.mcnt import MultinomialCountsFile
+from joint_snv_mix.file_formats.shards import open_file
+from joint_snv_mix.pre_processing.mpileup_to_jcnt import CandidateFilter, parse_counts
+
+def main( args ):
+    if args.jcnt_file_name is None and args.mcnt_file_name is None:
+        raise Exception( 'At least one of --jcnt_file_name or --mcnt_file_name must be set.' )
+
+    regions = get_regions( args.normal_bam_file_name, args.reference_genome_file_name, args.region_size )
+
+    out_files = {}
+
+    if args.jcnt_file_name is not None:
+        out_files['jcnt'] = open_file( args.jcnt_file_name, 'w', JointCountsFile, args.storage_profile, args.shard )
+
+    if args.mcnt_file_name is not None:
+        out_files['mcnt'] = open_file( args.mcnt_file_name, 'w', MultinomialCountsFile, args.storage_profile,
+                                       args.shard )
+
+    candidate_filters = {}
+
+    for file_type in out_files:
+        candidate_filters[file_type] = CandidateFilter( args.min_var_count, args.min_var_freq )
+
+    if args.num_processes == 1:
+        counter = RegionCounter( args )
+
+        for region in regions:
+            rows, filtered_sites = counter.count_region( region )
+
+            write_rows( out_files, candidate_filters, region[0], rows, filtered_sites )
+
+        counter.close()
+    else:
+        pool = multiprocessing.Pool( processes=args.num_processes, initializer=init_worker, initargs=( args, ) )
+
+        # Bound the number of regions in flight so finished regions do not pile up in memory.
+        window = 2 * args.num_processes
+
+        for i in xrange( 0, len( regions ), window ):
+            results = pool.imap( count_worker_region, regions[i:i + window] )
+
+            for region, ( rows, filtered_sites ) in zip( regions[i:i + window], results ):
+                write_rows( out_files, candidate_filters, region[0], rows, filtered_sites )
+
+        pool.close()
+        pool.join()
+
+    for file_type, out_file in out_files.items():
+        candidate_filters[file_type].write_summary( out_file )
+
+        out_file.close()
+
+def get_regions( bam_file_name, reference_genome_file_name, region_size ):
+    '''
+    Split the contigs present in both the BAM header and the reference into regions of at most region_size bases.
+
+    Return:
+    regions -- List of (chr_name, start, stop) tuples with zero based, half open coordinates.
+    '''
+    bam_file = pysam.AlignmentFile( bam_file_name, 'rb' )
+    ref_file = pysam.FastaFile( reference_genome_file_name )
+
+    ref_contigs = set( ref_file.references )
+
+    regions = []
+
+    for chr_name, chr_length in zip( bam_file.references, bam_file.lengths ):
+        if chr_name not in ref_contigs:
+            continue
+
+        for start in xrange( 0, chr_length, region_size ):
+            regions.append( ( chr_name, start, min( start + region_size, chr_length ) ) )
+
+    bam_file.close()
+    ref_file.close()
+
+    return regions
+
+def write_rows( out_files, candidate_filters, chr_name, rows, filtered_sites ):
+    for file_type, out_file in out_files.items():
+        out_file.add_rows( chr_name, rows[file_type] )
+
+        candidate_filters[file_type].add_filtered_site( chr_name, filtered_sites[file_type] )
+
+class RegionCounter:
+    '''
+    Count bases in both genomes for regions of the reference. Each instance holds its own file handles so one can be
+    used per worker process.
+    '''
+    def __init__( self, args ):
+        self._normal_bam = pysam.AlignmentFile( args.normal_bam_file_name, 'rb' )
+        self._tumour_bam = pysam.AlignmentFile( args.tumour_bam_file_name, 'rb' )
+
+        self._ref_file = pysam.FastaFile( args.reference_genome_file_name )
+
+        self._min_depth = args.min_depth
+        self._min_qual = args.min_qual
+
+        # Only used to test sites, the removed sites are counted per region and summed by the caller.
+        self._candidate_filter = CandidateFilter( args.min_var_count, args.min_var_freq )
+
+        self._file_types = []
+
+        if args.jcnt_file_name is not None:
+            self._file_types.append( 'jcnt' )
+
+        if args.mcnt_file_name is not None:
+            self._file_types.append( 'mcnt' )
+
+    def close( self ):
+        self._normal_bam.close()
+        self._tumour_bam.close()
+        self._ref_file.close()
+
+    def count_region( self, region ):
+        '''
+        Return:
+        rows -- Dictionary of jcnt and/or mcnt rows for the region keyed by file type.
+        filtered_sites -- Dictionary of the number of sites removed by the candidate site filter keyed by file type.
+        '''
+        chr_name, start, stop = region
+
+        ref_seq = self._ref_file.fetch( chr_name, start, stop ).upper()
+
+        normal_columns = iter_columns( self._normal_bam, chr_name, start, stop )
+        tumour_columns = iter_columns( self._tumour_bam, chr_name, start, stop )
+
+        rows = {}
+        filtered_sites = {}
+
+        for file_type in self._file_types:
+            rows[file_type] = []
+            filtered_sites[file_type] = 0
+
+        for pos, normal_column, tumour_column in merge_columns( normal_columns, tumour_columns ):
+            # Same depth test mpileup_to_jcnt applies to the depth column of the mpileup file.
+            if normal_column[0] < self._min_depth or tumour_column[0] < self._min_depth:
+                continue
+
+            ref_base = ref_seq[pos - start]
+
+            # mpileup coordinates are one based.
+            chr_coord = pos + 1
+
+            if 'jcnt' in rows:
+                jcnt_entry = self._get_jcnt_entry( chr_coord, ref_base, normal_column, tumour_column, filtered_sites )
+
+                if jcnt_entry is not None:
+                    rows['jcnt'].append( jcnt_entry )
+
+            if 'mcnt' in rows:
+                mcnt_entry = self._get_mcnt_entry( chr_coord, ref_base, normal_column, tumour_column, filtered_sites )
+
+                if mcnt_entry is not None:
+                    rows['mcnt'].append( mcnt_entry )
+
+        return rows, filtered_sites
+
+    def _get_jcnt_entry( self, chr_coord, ref_base, normal_column, tumour_column, filtered_sites ):
+        normal_non_ref_base, normal_counts = self._get_jcnt_counts( ref_base, normal_column )
+        tumour_non_ref_base, tumour_counts = self._get_jcnt_counts( ref_base, tumour_column )
+
+        d_N = normal_counts[0] + normal_counts[1]
+        d_T = tumour_counts[0] + tumour_counts[1]
+
+        if d_N < self._min_depth or d_T < self._min_depth:
+            return None
+
+        if not self._candidate_filter.is_candidate( ( normal_counts[1], tumour_counts[1] ), ( d_N, d_T ) ):
+            filtered_sites['jcnt'] += 1
+
+            return None
+
+        jcnt_entry = [ chr_coord, ref_base, normal_non_ref_base, tumour_non_ref_base ]
+        jcnt_entry.extend( normal_counts )
+        jcnt_entry.extend( tumour_counts )
+
+        return jcnt_entry
+
+    def _get_jcnt_counts( self, ref_base, column ):
+        depth, bases, quals = column
+
+        counter = Counter( [base for base, qual in zip( bases, quals ) if qual >= self._min_qual] )
+
+        return parse_counts( ref_base, counter )
+
+    def _get_mcnt_entry( self, chr_coord, ref_base, normal_column, tumour_column, filtered_sites ):
+        # As in mpileup_to_mcnt base qualities are not used to filter bases.
+        normal_counter = Counter( normal_column[1] )
+        tumour_counter = Counter( tumour_column[1] )
+
+        normal_counts = [normal_counter[x] for x in nucleotides]
+        tumour_counts = [tumour_counter[x] for x in nucleotides]
+
+        normal_depth = sum( normal_counts )
+        tumour_depth = sum( tumour_counts )
+
+        if normal_depth < self._min_depth or tumour_depth < self._min_depth:
+            return None
+
+        # Reference bases outside nucleotides, such as N, leave every read non-reference.
+        if ref_base in nucleotides:
+            normal_non_ref_counts = normal_depth - normal_counter[ref_base]
+            tumour_non_ref_counts = tumour_depth - tumour_counter[ref_base]
+        else:
+            normal_non_ref_counts = normal_depth
+            tumour_non_ref_counts = tumour_depth
+
+        if not self._candidate_filter.is_candidate( ( normal_non_ref_counts, tumour_non_ref_counts ),
+                                                    ( normal_depth, tumour_depth ) ):
+            filtered_sites['mcnt'] += 1
+
+            return None
+
+        mcnt_entry = [ chr_coord, ref_base ]
+        mcnt_entry.extend( normal_counts )
+        mcnt_entry.extend( tumour_counts )
+
+        return mcnt_entry
+
+def iter_columns( bam_file, chr_name, start, stop ):
+    '''
+    Iterate over the pileup of a region.
+
+    The pysam column objects are only valid until the iterator advances so the bases and qualities are copied out.
+    Reads are filtered the same way samtools mpileup does by default, deletions count towards depth but give no base.
+
+    Yield:
+    pos -- Zero based position.
+    column -- Tuple of depth, list of upper case bases and list of base qualities.
+    '''
+    pileup = bam_file.pileup( chr_name, start, stop, truncate=True, stepper='samtools', min_base_quality=0 )
+
+    for pileup_column in pileup:
+        depth = 0
+        bases = []
+        quals = []
+
+        for pileup_read in pileup_column.pileups:
+            if pileup_read.is_refskip:
+                continue
+
+            depth += 1
+
+            if pileup_read.is_del:
+                continue
+
+            read = pileup_read.alignment
+            query_pos = pileup_read.query_position
+
+            bases.append( read.query_sequence[query_pos].upper() )
+            quals.append( read.query_qualities[query_pos] )
+
+        yield pileup_column.reference_pos, ( depth, bases, quals )
+
+def merge_columns( normal_columns, tumour_columns ):
+    '''
+    Join the pileups of both genomes on position. Positions covered in only one genome are given an empty column for
+    the other.
+    '''
+    empty_column = ( 0, [], [] )
+
+    normal = next( normal_columns, None )
+    tumour = next( tumour_columns, None )
+
+    while normal is not None or tumour is not None:
+        if tumour is None or ( normal is not None and normal[0] < tumour[0] ):
+            yield normal[0], normal[1], empty_column
+
+            normal = next( normal_columns, None )
+        elif normal is None or tumour[0] < normal[0]:
+            yield tumour[0], empty_column, tumour[1]
+
+            tumour = next( tumour_columns, None )
+        else:
+            yield normal[0], normal[1], tumour[1]
+
+            normal = next( normal_columns, None )
+            tumour = next( tumour_columns, None )
+
+#=======================================================================================================================
+# Worker process state for region parallel counting.
+#=======================================================================================================================
+worker_state = {}
+
+def init_worker( args ):
+    worker_state['counter'] = RegionCounter( args )
+
+def count_worker_region( region ):
+    return worker_state['counter'].count_region( region )
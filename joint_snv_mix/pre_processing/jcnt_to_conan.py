@@ -5,6 +5,8 @@ Created on 2011-02-10
 '''
 import csv
 
+from bisect import bisect_right
+
 import numpy as np
 
 from joint_snv_mix.file_formats.jcnt import JointCountsReader
@@ -12,39 +14,20 @@ from joint_snv_mix.file_formats.cncnt import ConanCountsFile
 from argparse import Namespace
 
 
+# Segment files code chromosomes X and Y as numbers and use extra codes for copy number states.
+chr_name_map = { '23' : 'X', '24' : 'Y' }
+
+cn_status_map = { '7' : '1', '8' : '2', '9' : '4', '10' : '5', '11' : '6' }
+
 def jcnt_to_cncnt( args ):
     reader = JointCountsReader( args.jcnt_file_name )
     
     chr_list = reader.get_chr_list()
     
-    cncnt_file = ConanCountsFile( args.cncnt_file_name, 'w' )
-    
-    segment_reader = csv.reader( open( args.segment_file_name ), delimiter='\t' )
+    cncnt_file = ConanCountsFile( args.cncnt_file_name, 'w', args.storage_profile )
 
-    for row in segment_reader:
-        print row
-        
-        chr_name = row[0]
-        
-        if chr_name == '23':
-            chr_name = 'X'
-        if chr_name == '24':
-            chr_name = 'Y'
-        
-        start = int( row[1] )
-        stop = int( row[2] )
-        cn_status = row[3]
-        
-        if cn_status == '7':
-            cn_status = '1'
-        elif cn_status == '8':
-            cn_status = '2'
-        elif cn_status == '9':
-            cn_status = '4'
-        elif cn_status == '10':
-            cn_status = '5'
-        elif cn_status == '11':
-            cn_status = '6'
+    for chr_name, start, stop, cn_status in read_segments( args.segment_file_name ):
+        print chr_name, start, stop, cn_status
         
         if chr_name not in chr_list:
             continue
@@ -58,10 +41,73 @@ def jcnt_to_cncnt( args ):
         if len( segment_rows ) == 0:
             continue
         
+        # The chromosome size bounds the rows any one copy number state can receive.
+        cncnt_file.set_expected_rows( cn_status, chr_name, len( rows ) )
+        
         cncnt_file.add_rows( cn_status, chr_name, segment_rows )
     
     reader.close()
     cncnt_file.close()
+
+def read_segments( segment_file_name ):
+    '''
+    Iterate over the rows of a segment file with chromosome and copy number codes mapped to the names used in cncnt
+    files.
+    
+    Yield:
+    chr_name, start, stop, cn_status
+    '''
+    segment_reader = csv.reader( open( segment_file_name ), delimiter='\t' )
+
+    for row in segment_reader:
+        chr_name = chr_name_map.get( row[0], row[0] )
+        
+        start = int( row[1] )
+        stop = int( row[2] )
+        
+        cn_status = cn_status_map.get( row[3], row[3] )
+        
+        yield chr_name, start, stop, cn_status
+
+class SegmentIndex:
+    '''
+    Look up the copy number state of single positions. Segments of a chromosome are assumed not to overlap, as is the
+    case for files produced by fill_segment_gaps.
+    '''
+    def __init__( self, segment_file_name ):
+        self._segments = {}
+        
+        for chr_name, start, stop, cn_status in read_segments( segment_file_name ):
+            if chr_name not in self._segments:
+                self._segments[chr_name] = []
+            
+            self._segments[chr_name].append( ( start, stop, cn_status ) )
+        
+        self._starts = {}
+        
+        for chr_name, chr_segments in self._segments.items():
+            chr_segments.sort()
+            
+            self._starts[chr_name] = [x[0] for x in chr_segments]
+    
+    def get_cn_status( self, chr_name, coord ):
+        '''
+        Return the copy number state of the segment holding a position or None if no segment does.
+        '''
+        if chr_name not in self._starts:
+            return None
+        
+        i = bisect_right( self._starts[chr_name], coord ) - 1
+        
+        if i < 0:
+            return None
+        
+        start, stop, cn_status = self._segments[chr_name][i]
+        
+        if coord > stop:
+            return None
+        
+        return cn_status
         
 if __name__ == "__main__":
     import sys
@@ -71,6 +117,7 @@ if __name__ == "__main__":
     args.jcnt_file_name = sys.argv[1]
     args.cncnt_file_name = sys.argv[2]    
     args.segment_file_name = sys.argv[3]
+    args.storage_profile = 'default'
     
     
     jcnt_to_cncnt( args )
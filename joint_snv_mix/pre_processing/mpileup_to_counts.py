@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+'''
+Build jcnt, mcnt and cncnt files from a single pass over an mpileup file.
+
+Each line is split and its call strings parsed once. The base counts are then shared by all requested outputs, with
+the same filters mpileup_to_jcnt and mpileup_to_mcnt apply, so the files match those produced by running the
+converters separately.
+'''
+from collections import Counter
+
+import numpy as np
+
+import tables
+import warnings
+warnings.filterwarnings( 'ignore', category=tables.NaturalNameWarning )
+
+from joint_snv_mix.constants import nucleotides
+from joint_snv_mix.file_formats.cncnt import ConanCountsFile
+from joint_snv_mix.file_formats.jcnt import JointCountsFile
+from joint_snv_mix.file_formats.mcnt import MultinomialCountsFile
+from joint_snv_mix.file_formats.pileup import parse_call_string
+from joint_snv_mix.file_formats.shards import open_file
+from joint_snv_mix.pre_processing.jcnt_to_conan import SegmentIndex
+from joint_snv_mix.pre_processing.mpileup_to_jcnt import ascii_offset, get_reader, open_mpileup_file, parse_counts, \
+    CandidateFilter
+
+def main( args ):
+    if args.jcnt_file_name is None and args.mcnt_file_name is None and args.cncnt_file_name is None:
+        raise Exception( 'At least one of --jcnt_file_name, --mcnt_file_name or --cncnt_file_name must be set.' )
+
+    if args.cncnt_file_name is not None and args.segment_file_name is None:
+        raise Exception( '--segment_file_name is required to create a cncnt file.' )
+
+    mpileup_file = open_mpileup_file( args )
+
+    reader = get_reader( mpileup_file )
+
+    writer = CountsWriter( args )
+
+    for row in reader:
+        # Skip lines below coverage threshold.
+        if int( row['normal_depth'] ) < args.min_depth or int( row['tumour_depth'] ) < args.min_depth:
+            continue
+
+        chr_name = row['chr_name']
+        chr_coord = int( row['chr_coord'] )
+        ref_base = row['ref_base'].upper()
+
+        normal_bases, normal_quals = decode_sample( ref_base, row['normal_call_string'], row['normal_base_qual_string'] )
+        tumour_bases, tumour_quals = decode_sample( ref_base, row['tumour_call_string'], row['tumour_base_qual_string'] )
+
+        if writer.write_mcnt:
+            normal_counter = Counter( normal_bases )
+            tumour_counter = Counter( tumour_bases )
+
+            writer.add_mcnt_row( chr_name, chr_coord, ref_base, normal_counter, tumour_counter )
+
+        if writer.write_jcnt:
+            # With no quality filter the jcnt counts are built from the mcnt counters. This is safe because the mcnt
+            # row has already been taken from them when parse_counts removes the reference and N entries.
+            if args.min_qual > 0 or not writer.write_mcnt:
+                normal_counter = Counter( normal_bases[normal_quals >= args.min_qual] )
+                tumour_counter = Counter( tumour_bases[tumour_quals >= args.min_qual] )
+
+            writer.add_jcnt_row( chr_name, chr_coord, ref_base, normal_counter, tumour_counter )
+
+    writer.close()
+    mpileup_file.close()
+
+def decode_sample( ref_base, call_string, qual_string ):
+    '''
+    Parse the call string and base qualities of one sample.
+
+    Return:
+    bases -- Array of bases, reference matches are replaced by ref_base.
+    quals -- Array of base qualities.
+    '''
+    bases = np.array( parse_call_string( ref_base, call_string ) )
+
+    quals = np.fromstring( qual_string, dtype=np.byte ) - ascii_offset
+
+    return bases, quals
+
+class CountsWriter:
+    '''
+    Collect jcnt, mcnt and cncnt rows and write them in blocks.
+    '''
+    def __init__( self, args ):
+        self._min_depth = args.min_depth
+
+        self._files = {}
+
+        self._rows = {}
+
+        self._nrows = 0
+
+        if args.jcnt_file_name is not None:
+            self._files['jcnt'] = open_file( args.jcnt_file_name, 'w', JointCountsFile, args.storage_profile,
+                                             args.shard )
+
+        if args.mcnt_file_name is not None:
+            self._files['mcnt'] = open_file( args.mcnt_file_name, 'w', MultinomialCountsFile, args.storage_profile,
+                                             args.shard )
+
+        if args.cncnt_file_name is not None:
+            self._files['cncnt'] = ConanCountsFile( args.cncnt_file_name, 'w', args.storage_profile )
+
+            self._segments = SegmentIndex( args.segment_file_name )
+
+        # Each file gets its own filter so removed sites are counted with the keys of its rows.
+        self._filters = {}
+
+        for file_type in self._files:
+            self._rows[file_type] = {}
+
+            self._filters[file_type] = CandidateFilter( args.min_var_count, args.min_var_freq )
+
+        # The jcnt counts are needed for the cncnt file even when no jcnt file is written.
+        self.write_jcnt = ( 'jcnt' in self._files or 'cncnt' in self._files )
+
+        self.write_mcnt = ( 'mcnt' in self._files )
+
+    def add_jcnt_row( self, chr_name, chr_coord, ref_base, normal_counter, tumour_counter ):
+        normal_non_ref_base, normal_counts = parse_counts( ref_base, normal_counter )
+        tumour_non_ref_base, tumour_counts = parse_counts( ref_base, tumour_counter )
+
+        # Check again for lines below read depth.
+        d_N = normal_counts[0] + normal_counts[1]
+        d_T = tumour_counts[0] + tumour_counts[1]
+
+        if d_N < self._min_depth or d_T < self._min_depth:
+            return
+
+        keys = {}
+
+        if 'jcnt' in self._files:
+            keys['jcnt'] = chr_name
+
+        if 'cncnt' in self._files:
+            cn_status = self._segments.get_cn_status( chr_name, chr_coord )
+
+            if cn_status is not None:
+                keys['cncnt'] = ( cn_status, chr_name )
+
+        # The jcnt and cncnt filters share thresholds so either can test the site.
+        candidate = self._filters.values()[0].is_candidate( ( normal_counts[1], tumour_counts[1] ), ( d_N, d_T ) )
+
+        if not candidate:
+            for file_type, key in keys.items():
+                self._filters[file_type].add_filtered_site( key )
+
+            return
+
+        jcnt_entry = [ chr_coord, ref_base, normal_non_ref_base, tumour_non_ref_base ]
+        jcnt_entry.extend( normal_counts )
+        jcnt_entry.extend( tumour_counts )
+
+        for file_type, key in keys.items():
+            self._add_row( file_type, key, jcnt_entry )
+
+    def add_mcnt_row( self, chr_name, chr_coord, ref_base, normal_counter, tumour_counter ):
+        normal_counts = [normal_counter[x] for x in nucleotides]
+        tumour_counts = [tumour_counter[x] for x in nucleotides]
+
+        normal_depth = sum( normal_counts )
+        tumour_depth = sum( tumour_counts )
+
+        if normal_depth < self._min_depth or tumour_depth < self._min_depth:
+            return
+
+        # Reference bases outside nucleotides, such as N, leave every read non-reference.
+        if ref_base in nucleotides:
+            normal_non_ref_counts = normal_depth - normal_counter[ref_base]
+            tumour_non_ref_counts = tumour_depth - tumour_counter[ref_base]
+        else:
+            normal_non_ref_counts = normal_depth
+            tumour_non_ref_counts = tumour_depth
+
+        candidate_filter = self._filters['mcnt']
+
+        if not candidate_filter.is_candidate( ( normal_non_ref_counts, tumour_non_ref_counts ),
+                                              ( normal_depth, tumour_depth ) ):
+            candidate_filter.add_filtered_site( chr_name )
+
+            return
+
+        mcnt_entry = [ chr_coord, ref_base ]
+        mcnt_entry.extend( normal_counts )
+        mcnt_entry.extend( tumour_counts )
+
+        self._add_row( 'mcnt', chr_name, mcnt_entry )
+
+    def close( self ):
+        # Last call to write remaining rows.
+        self._write_rows()
+
+        for file_type, out_file in self._files.items():
+            self._filters[file_type].write_summary( out_file )
+
+            out_file.close()
+
+    def _add_row( self, file_type, key, row ):
+        rows = self._rows[file_type]
+
+        if key not in rows:
+            rows[key] = []
+
+        rows[key].append( row )
+
+        self._nrows += 1
+
+        if self._nrows >= 1e5:
+            print key, row[0]
+
+            self._write_rows()
+
+    def _write_rows( self ):
+        for file_type, rows in self._rows.items():
+            out_file = self._files[file_type]
+
+            for key, key_rows in rows.items():
+                if file_type == 'cncnt':
+                    out_file.add_rows( key[0], key[1], key_rows )
+                else:
+                    out_file.add_rows( key, key_rows )
+
+            self._rows[file_type] = {}
+
+        self._nrows = 0
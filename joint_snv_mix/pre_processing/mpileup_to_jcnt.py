@@ -1,5 +1,4 @@
 #!/usr/bin/env python
-import bz2
 import csv
 
 from collections import Counter
@@ -10,21 +9,22 @@ import tables
 import warnings
 warnings.filterwarnings( 'ignore', category=tables.NaturalNameWarning )
 
+from joint_snv_mix.file_formats.compressed_input import open_input_file
 from joint_snv_mix.file_formats.pileup import parse_call_string
 
 from joint_snv_mix.file_formats.jcnt import JointCountsFile
+from joint_snv_mix.file_formats.shards import open_file
 
 ascii_offset = 33
 
 def main( args ):
-    if args.bzip2:
-        mpileup_file = bz2.BZ2File( args.mpileup_file_name )
-    else:
-        mpileup_file = open( args.mpileup_file_name )
+    mpileup_file = open_mpileup_file( args )
     
     reader = get_reader( mpileup_file )
     
-    jcnt_file = JointCountsFile( args.jcnt_file_name, 'w' )
+    jcnt_file = open_file( args.jcnt_file_name, 'w', JointCountsFile, args.storage_profile, args.shard )
+    
+    candidate_filter = CandidateFilter( args.min_var_count, args.min_var_freq )
     
     rows = {}
     i = 0
@@ -70,6 +70,11 @@ def main( args ):
         if d_N < args.min_depth or d_T < args.min_depth:
             continue
         
+        if not candidate_filter.is_candidate( ( normal_counts[1], tumour_counts[1] ), ( d_N, d_T ) ):
+            candidate_filter.add_filtered_site( chr_name )
+            
+            continue
+        
         jcnt_entry = [ chr_coord, ref_base, normal_non_ref_base, tumour_non_ref_base ]
         jcnt_entry.extend( normal_counts )
         jcnt_entry.extend( tumour_counts )
@@ -88,10 +93,24 @@ def main( args ):
     
     # Last call to write remaining rows.
     write_rows( jcnt_file, rows )
+    
+    candidate_filter.write_summary( jcnt_file )
         
     jcnt_file.close()
     mpileup_file.close()
 
+def open_mpileup_file( args ):
+    '''
+    Open an mpileup file which may be compressed. The compression is detected from the file, the --bzip2 flag is only
+    kept so existing scripts continue to work.
+    '''
+    if args.bzip2:
+        compression = 'bz2'
+    else:
+        compression = None
+    
+    return open_input_file( args.mpileup_file_name, compression, args.decompression_threads )
+
 def get_reader( mpileup_file ):
     csv.field_size_limit( 10000000 )
     
@@ -149,3 +168,40 @@ def parse_counts( ref_base, counter ):
 def write_rows( jcnt_file, rows ):
     for chr_name, chr_rows in rows.items():
         jcnt_file.add_rows( chr_name, chr_rows )
+
+class CandidateFilter:
+    '''
+    Filter for candidate variant sites. A site is kept if either sample has at least min_var_count non-reference
+    reads which make up at least min_var_freq of its depth. With the default thresholds of zero every site is kept.
+    
+    The number of sites removed is counted per key, usually the chromosome, and stored in the output file so models
+    fit to the remaining sites can account for them.
+    '''
+    def __init__( self, min_var_count, min_var_freq ):
+        self.min_var_count = min_var_count
+        self.min_var_freq = min_var_freq
+        
+        self.filtered_sites = {}
+        
+        self._keep_all = ( min_var_count <= 0 and min_var_freq <= 0 )
+    
+    def is_candidate( self, non_ref_counts, depths ):
+        '''
+        Arguments:
+        non_ref_counts -- Non-reference read counts of each sample.
+        depths -- Depths of each sample, in the same order as non_ref_counts.
+        '''
+        if self._keep_all:
+            return True
+        
+        for non_ref_count, depth in zip( non_ref_counts, depths ):
+            if non_ref_count >= self.min_var_count and non_ref_count >= self.min_var_freq * depth:
+                return True
+        
+        return False
+    
+    def add_filtered_site( self, key, count=1 ):
+        self.filtered_sites[key] = self.filtered_sites.get( key, 0 ) + count
+    
+    def write_summary( self, out_file ):
+        out_file.write_filter_summary( self.min_var_count, self.min_var_freq, self.filtered_sites )
@@ -2,7 +2,6 @@
 import tables
 import warnings
 from joint_snv_mix.constants import nucleotides
-import bz2
 warnings.filterwarnings( 'ignore', category=tables.NaturalNameWarning )
 
 import csv
@@ -12,15 +11,16 @@ from collections import Counter
 from joint_snv_mix.file_formats.pileup import parse_call_string
 
 from joint_snv_mix.file_formats.mcnt import MultinomialCountsFile
+from joint_snv_mix.file_formats.shards import open_file
+from joint_snv_mix.pre_processing.mpileup_to_jcnt import CandidateFilter, open_mpileup_file
 
 def main( args ):
-    if args.bzip2:
-        mpileup_file = bz2.BZ2File( args.mpileup_file_name )
-    else:
-        mpileup_file = open( args.mpileup_file_name )
+    mpileup_file = open_mpileup_file( args )
     
     reader = get_reader( mpileup_file )
-    mcnt_file = MultinomialCountsFile( args.mcnt_file_name, 'w' )
+    mcnt_file = open_file( args.mcnt_file_name, 'w', MultinomialCountsFile, args.storage_profile, args.shard )
+    
+    candidate_filter = CandidateFilter( args.min_var_count, args.min_var_freq )
     
     rows = {}
     i = 0
@@ -50,25 +50,36 @@ def main( args ):
         
         normal_counts = []
         tumour_counts = []
-    
-        variant = True
+        
+        normal_non_ref_counts = 0
+        tumour_non_ref_counts = 0
     
         for nucleotide in nucleotides:
             nc = normal_counter[nucleotide]
             tc = tumour_counter[nucleotide]
             
             if nucleotide != ref_base:
-                if nc > 0 or tc > 0:
-                    variant = True
+                normal_non_ref_counts += nc
+                tumour_non_ref_counts += tc
             
             normal_counts.append( nc )
             tumour_counts.append( tc )
         
-        if sum( normal_counts ) < args.min_depth or sum( tumour_counts ) < args.min_depth:
+        normal_depth = sum( normal_counts )
+        tumour_depth = sum( tumour_counts )
+        
+        if normal_depth < args.min_depth or tumour_depth < args.min_depth:
             continue
         
+        variant = candidate_filter.is_candidate( 
+                                                ( normal_non_ref_counts, tumour_non_ref_counts ),
+                                                ( normal_depth, tumour_depth )
+                                                )
+        
         # Skip lines with no variants.
         if not variant:
+            candidate_filter.add_filtered_site( chr_name )
+            
             continue
         
         mcnt_entry = [ chr_coord, ref_base ]
@@ -89,8 +100,11 @@ def main( args ):
     
     # Last call to write remaining rows.
     write_rows( mcnt_file, rows )
+    
+    candidate_filter.write_summary( mcnt_file )
         
     mcnt_file.close()
+    mpileup_file.close()
 
 def get_reader( mpileup_file ):
     csv.field_size_limit( 10000000 )
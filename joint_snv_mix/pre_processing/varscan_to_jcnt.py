@@ -7,7 +7,7 @@ def main( args ):
     jcnt_file_name = args.jcnt_file_name
     
     varscan_reader = csv.DictReader( open( varscan_file_name ), delimiter='\t' )
-    jcnt_file = JointCountsFile( jcnt_file_name, 'w' )
+    jcnt_file = JointCountsFile( jcnt_file_name, 'w', args.storage_profile )
     
     rows = {}
     i = 0
@@ -15,6 +15,8 @@ from joint_snv_mix.pre_processing.mpileup_to_mcnt import main as mpileup_to_mcnt
 
 from joint_snv_mix.pre_processing.varscan_to_jcnt import main as varscan_to_jcnt
 
+from joint_snv_mix.pre_processing.mpileup_to_counts import main as mpileup_to_counts
+
 from joint_snv_mix.post_processing.call_jsm_somatics import call_somatics_from_jsm
 
 from joint_snv_mix.post_processing.call_conan_somatics import call_conan_somatics
@@ -30,8 +32,65 @@ from joint_snv_mix.classification.fisher_classifier import run_fisher
 from joint_snv_mix.classification.multinomial import run_multimix
 from joint_snv_mix.pre_processing.jcnt_to_conan import jcnt_to_cncnt
 from joint_snv_mix.post_processing.extract_jsm_paramters import extract_jsm_parameters
+from joint_snv_mix.post_processing.benchmark_storage_profiles import benchmark_storage_profiles
+from joint_snv_mix.file_formats.storage_profiles import profiles
+from joint_snv_mix.file_formats.shards import create_manifest
+
+def run_bam(args):
+    '''
+    pysam is an optional dependency only needed by the bam sub-command so it is imported when the command runs.
+    '''
+    try:
+        from joint_snv_mix.pre_processing.bam_to_counts import main as bam_to_counts
+    except ImportError as e:
+        raise Exception('The bam sub-command requires pysam, which could not be imported ({0}). Install pysam or '
+                        'build the counts files from an mpileup file with jcnt and mcnt.'.format(e))
+    
+    bam_to_counts(args)
+
+def add_variant_filter_arguments(parser):
+    '''
+    Add the filters on non-reference reads shared by the sub-commands which write counts files.
+    '''
+    parser.add_argument('--min_var_count', default=0, type=int,
+                        help='''Minimum number of non-reference reads in either sample for a site to be written. Sites
+                        removed by this filter or --min_var_freq are counted per chromosome in the output file. Default
+                        0 keeps all sites.''')
+    
+    parser.add_argument('--min_var_freq', default=0., type=float,
+                        help='''Minimum fraction of non-reference reads in either sample for a site to be written.
+                        Default 0 keeps all sites.''')
+
+def add_sparse_epsilon_argument(parser, extra_help=''):
+    '''
+    Add the sparse output option shared by the sub-commands which write classified files.
+    
+    Arguments:
+    parser -- Sub-command parser to add the option to.
+    extra_help -- Text appended to the help, for notes specific to the sub-command.
+    '''
+    parser.add_argument('--sparse_epsilon', default=None, type=float,
+                        help='''If set only positions with probability of not being homozygous reference in both
+                        genomes above this value have their genotype probabilities stored. All other positions are
+                        stored as reference which greatly reduces the size of the output file. ''' + extra_help)
 
 parser = argparse.ArgumentParser(prog='JointSNVMix')
+
+parser.add_argument('--storage_profile', choices=sorted(profiles), default='default',
+                    help='''Compression profile used for HDF5 files written by the sub-command. fast uses blosc+lz4 and
+                    small uses blosc+zstd, both need a PyTables build with Blosc support to read the output.''')
+
+parser.add_argument('--memory_budget', default=None, type=float,
+                    help='''Memory in MB for the arrays built while classifying a block of positions. The number of
+                    positions per block is derived from the budget, the number of classes of the model and the memory
+                    available. Applies to snvmix, multimix, conan, fisher and threshold. The budget is for the whole
+                    run, so with fisher --num_processes it is shared by the blocks of all workers. Training is not
+                    covered by the budget. If not set blocks are 100000 positions.''')
+
+parser.add_argument('--profile_blocks', action='store_true', default=False,
+                    help='''Print the size, time and throughput of each block classified followed by totals for the
+                    run. Useful for tuning --memory_budget.''')
+
 subparsers = parser.add_subparsers()
 
 #===============================================================================
@@ -56,8 +115,18 @@ parser_jcnt.add_argument('--min_qual', default=13, type=int,
                           to pre-process the bam then BAQ qualities may replace the base qualities in the 
                           mpileup file.''')
 
+add_variant_filter_arguments(parser_jcnt)
+
+parser_jcnt.add_argument('--shard', action='store_true',
+                         help='''Write one jcnt file per chromosome and make jcnt_file_name a manifest listing them.''')
+
 parser_jcnt.add_argument('--bzip2', action='store_true',
-                          help='''Set if file is in bzip2 format.''')
+                         help='''Set if file is in bzip2 format. Compression (bzip2, gzip or bgzf) is now detected automatically so
+                         this flag is no longer required.''')
+
+parser_jcnt.add_argument('--decompression_threads', default=1, type=int,
+                         help='''Number of threads used to decompress bgzf compressed input. Other compressed formats are
+                         decompressed in a single background thread.''')
 
 parser_jcnt.set_defaults(func=mpileup_to_jcnt)
 
@@ -78,11 +147,112 @@ parser_mcnt.add_argument('--min_depth', default=1, type=int,
                           help='''Minimum depth of coverage in both tumour and normal sample required to use a site in
                           the analysis.''')
 
+add_variant_filter_arguments(parser_mcnt)
+
+parser_mcnt.add_argument('--shard', action='store_true',
+                         help='''Write one mcnt file per chromosome and make mcnt_file_name a manifest listing them.''')
+
 parser_mcnt.add_argument('--bzip2', action='store_true',
-                          help='''Set if file is in bzip2 format.''')
+                         help='''Set if file is in bzip2 format. Compression (bzip2, gzip or bgzf) is now detected automatically so
+                         this flag is no longer required.''')
+
+parser_mcnt.add_argument('--decompression_threads', default=1, type=int,
+                         help='''Number of threads used to decompress bgzf compressed input. Other compressed formats are
+                         decompressed in a single background thread.''')
 
 parser_mcnt.set_defaults(func=mpileup_to_mcnt)
 
+#===============================================================================
+# Add counts sub-command
+#===============================================================================
+parser_counts = subparsers.add_parser('counts',
+                                      help='''Convert an mpileup file to jcnt, mcnt and cncnt files in a single pass.''')
+
+parser_counts.add_argument('mpileup_file_name',
+                           help='''Samtools mpileup format file. When creating file with samtools the first bam file
+                           passed as arguments should be the normal and the second the tumour file.''')
+
+parser_counts.add_argument('--jcnt_file_name', default=None,
+                           help='Name of joint counts (jcnt) output file to be created.')
+
+parser_counts.add_argument('--mcnt_file_name', default=None,
+                           help='Name of multinomial counts (mcnt) output file to be created.')
+
+parser_counts.add_argument('--cncnt_file_name', default=None,
+                           help='''Name of copy number counts (cncnt) output file to be created. Requires
+                           --segment_file_name.''')
+
+parser_counts.add_argument('--segment_file_name', default=None,
+                           help='''Segment file used to assign copy number states when creating a cncnt file.''')
+
+parser_counts.add_argument('--min_depth', default=1, type=int,
+                           help='''Minimum depth of coverage in both tumour and normal sample required to use a site in
+                           the analysis.''')
+
+parser_counts.add_argument('--min_qual', default=13, type=int,
+                           help='''Remove bases with base qualities lower than this value from the jcnt and cncnt
+                           counts. As with the mcnt sub-command base qualities are not used for the mcnt file.''')
+
+add_variant_filter_arguments(parser_counts)
+
+parser_counts.add_argument('--shard', action='store_true',
+                           help='''Write one file per chromosome for the jcnt and mcnt outputs and make the output file names manifests
+                           listing them. The cncnt output is not sharded.''')
+
+parser_counts.add_argument('--bzip2', action='store_true',
+                           help='''Set if file is in bzip2 format. Compression (bzip2, gzip or bgzf) is now detected automatically so
+                           this flag is no longer required.''')
+
+parser_counts.add_argument('--decompression_threads', default=1, type=int,
+                           help='''Number of threads used to decompress bgzf compressed input. Other compressed formats are
+                           decompressed in a single background thread.''')
+
+parser_counts.set_defaults(func=mpileup_to_counts)
+
+#===============================================================================
+# Add bam sub-command
+#===============================================================================
+parser_bam = subparsers.add_parser('bam',
+                                   help='''Build jcnt and/or mcnt files directly from normal and tumour bam files without
+                                   creating an mpileup file. Requires the optional dependency pysam.''')
+
+parser_bam.add_argument('normal_bam_file_name',
+                        help='Sorted and indexed bam file for the normal genome.')
+
+parser_bam.add_argument('tumour_bam_file_name',
+                        help='Sorted and indexed bam file for the tumour genome.')
+
+parser_bam.add_argument('reference_genome_file_name',
+                        help='Fasta file of the reference genome the bam files were aligned to.')
+
+parser_bam.add_argument('--jcnt_file_name', default=None,
+                        help='Name of joint counts (jcnt) output file to be created.')
+
+parser_bam.add_argument('--mcnt_file_name', default=None,
+                        help='Name of multinomial counts (mcnt) output file to be created.')
+
+parser_bam.add_argument('--min_depth', default=1, type=int,
+                        help='''Minimum depth of coverage in both tumour and normal sample required to use a site in
+                        the analysis.''')
+
+parser_bam.add_argument('--min_qual', default=13, type=int,
+                        help='''Remove bases with base qualities lower than this value when building the jcnt file.
+                        Unlike samtools mpileup no BAQ adjustment is applied to the base qualities.''')
+
+add_variant_filter_arguments(parser_bam)
+
+parser_bam.add_argument('--shard', action='store_true',
+                        help='''Write one file per chromosome for each output and make the output file names manifests
+                        listing them.''')
+
+parser_bam.add_argument('--num_processes', default=1, type=int,
+                        help='''Number of worker processes. Regions of the genome are counted in parallel.''')
+
+parser_bam.add_argument('--region_size', default=int(1e6), type=int,
+                        help='''Size in bases of the regions the genome is split into for counting.''')
+
+parser_bam.set_defaults(func=run_bam)
+
 #===============================================================================
 # Add varscan sub-command
 #===============================================================================
@@ -115,6 +285,22 @@ parser_mcnt.add_argument('segment_file_name',
 parser_mcnt.set_defaults(func=jcnt_to_cncnt)
 
 
+#===============================================================================
+# Add manifest sub-command
+#===============================================================================
+parser_manifest = subparsers.add_parser('manifest',
+                                        help='''Write a manifest for files holding different chromosomes of one data set,
+                                        for example jsm files from classifying the shards of a jcnt file separately.
+                                        The manifest can be read in place of a single file.''')
+
+parser_manifest.add_argument('manifest_file_name',
+                             help='Name of manifest file to be created.')
+
+parser_manifest.add_argument('shard_file_names', nargs='+',
+                             help='Files to list in the manifest. Each chromosome may appear in only one file.')
+
+parser_manifest.set_defaults(func=create_manifest)
+
 #===============================================================================
 # Add snvmix model sub-command
 #===============================================================================
@@ -152,12 +338,36 @@ train_group.add_argument('--convergence_threshold', default=1e-6, type=float,
                           help='''Convergence threshold for EM training. Once the change in objective function is below
                           this value training will end. Defaul 1e-6''')
 
+train_group.add_argument('--init_from', default=None,
+                          help='''jsm file from an earlier run whose parameters are used to start training instead of
+                          k-means clustering. Useful when training on samples similar to one already analysed.''')
+
+train_group.add_argument('--restarts', default=1, type=int,
+                          help='''Number of initialisations to try when not starting from --init_from. Each is trained
+                          for --restart_iters iterations on a subsample of at most 100000 positions and training
+                          continues from the one with the best lower bound. Default is 1 which uses k-means
+                          clustering only.''')
+
+train_group.add_argument('--restart_iters', default=10, type=int,
+                          help='''Number of EM iterations used to compare restarts. Default 10''')
+
+train_group.add_argument('--num_processes', default=1, type=int,
+                          help='''Number of worker processes used for training. The chromosome model trains chromosomes
+                          in parallel, each worker reading only the counts of its chromosomes. The independent model
+                          trains the normal and tumour genomes in parallel so uses at most two. The joint model trains
+                          its restarts in parallel. Default is 1 which trains in a single process.''')
+
 parser_snvmix.add_argument('--model', choices=['independent', 'joint', 'chromosome'],
                               default='joint', help='Model type to use for classification.')
 
 parser_snvmix.add_argument('--density', choices=['binomial', 'beta_binomial'], default='beta_binomial',
                               help='Density to be used in model.')
 
+parser_snvmix.add_argument('--shard', action='store_true',
+                              help='''Write one jsm file per chromosome and make jsm_file_name a manifest listing them.''')
+
+add_sparse_epsilon_argument(parser_snvmix)
+
 parser_snvmix.set_defaults(func=run_snvmix)
 
 #===============================================================================
@@ -192,6 +402,10 @@ parser_fisher.add_argument('--min_var_depth', default=4, type=int,
                               help='''Sites with fewer variant reads in the tumour than this will always be called
                               reference.''')
 
+parser_fisher.add_argument('--num_processes', default=1, type=int,
+                              help='''Number of worker processes used to classify blocks of positions. Each worker
+                              reads its own blocks from the jcnt file. Default is 1 which runs in a single process.''')
+
 parser_fisher.set_defaults(func=run_fisher)
 
 #===============================================================================
@@ -228,7 +442,8 @@ parser_multimix.add_argument('mcnt_file_name',
                              help='Name of joint counts (mcnt) file to be used as input.')
 
 parser_multimix.add_argument('jmm_file_name',
-                             help='Name of JointMultiMix (jmm) output files to be created.')
+                             help='''Name of JointMultiMix (jmm) output files to be created. The extended model writes
+                             jemm files.''')
 
 file_group = parser_multimix.add_mutually_exclusive_group(required=True)
 
@@ -240,8 +455,11 @@ file_group.add_argument('--priors_file', default=None,
                          help='File containing prior distribution parameters to use for training. \
                          If set the model will be trained.')
 
-parser_multimix.add_argument('--model', choices=['joint', 'chromosome'],
-                              default='joint', help='Model type to use for classification.')
+parser_multimix.add_argument('--model', choices=['joint', 'chromosome', 'extended'],
+                              default='joint', help='''Model type to use for classification. extended adds the tri and
+                              tetra-allelic genotypes and needs priors such as config/joint_extended_multi.priors.cfg.''')
+
+add_sparse_epsilon_argument(parser_multimix, 'Output of the extended model is always sparse, with a default of 1e-4.')
 
 train_group = parser_multimix.add_argument_group(title='Training Parameters',
                                                  description='Options for training the model.')
@@ -257,6 +475,24 @@ train_group.add_argument('--convergence_threshold', default=1e-6, type=float,
                           help='''Convergence threshold for EM training. Once the change in objective function is below
                           this value training will end. Defaul 1e-6''')
 
+train_group.add_argument('--init_from', default=None,
+                          help='''jmm file from an earlier run whose parameters are used to start training instead of
+                          k-means clustering. Useful when training on samples similar to one already analysed.''')
+
+train_group.add_argument('--restarts', default=1, type=int,
+                          help='''Number of initialisations to try when not starting from --init_from. Each is trained
+                          for --restart_iters iterations on a subsample of at most 100000 positions and training
+                          continues from the one with the best lower bound. Default is 1 which uses k-means
+                          clustering only.''')
+
+train_group.add_argument('--restart_iters', default=10, type=int,
+                          help='''Number of EM iterations used to compare restarts. Default 10''')
+
+train_group.add_argument('--num_processes', default=1, type=int,
+                          help='''Number of worker processes used for training. The chromosome model trains chromosomes
+                          in parallel, each worker reading only the counts of its chromosomes. The other models train
+                          their restarts in parallel. Default is 1 which trains in a single process.''')
+
 parser_multimix.set_defaults(func=run_multimix)
 #===============================================================================
 # Add conan sub-command
@@ -274,6 +510,8 @@ parser_conan.add_argument('cnsm_file_name',
 parser_conan.add_argument('--density', choices=['binomial', 'beta_binomial'], default='beta_binomial',
                               help='Density to be used in model.')
 
+add_sparse_epsilon_argument(parser_conan)
+
 train_group = parser_conan.add_argument_group(title='Training Parameters',
                                                  description='Options for training the model.')
 
@@ -288,6 +526,23 @@ train_group.add_argument('--convergence_threshold', default=1e-6, type=float,
                           help='''Convergence threshold for EM training. Once the change in objective function is below
                           this value training will end. Defaul 1e-6''')
 
+train_group.add_argument('--init_from', default=None,
+                          help='''cnsm file from an earlier run whose parameters are used to start training instead of
+                          k-means clustering. Useful when training on samples similar to one already analysed.''')
+
+train_group.add_argument('--restarts', default=1, type=int,
+                          help='''Number of initialisations to try when not starting from --init_from. Each is trained
+                          for --restart_iters iterations on a subsample of at most 100000 positions and training
+                          continues from the one with the best lower bound. Default is 1 which uses k-means
+                          clustering only.''')
+
+train_group.add_argument('--restart_iters', default=10, type=int,
+                          help='''Number of EM iterations used to compare restarts. Default 10''')
+
+train_group.add_argument('--num_processes', default=1, type=int,
+                          help='''Number of worker processes used to train restarts. Default is 1 which trains in a
+                          single process.''')
+
 train_group.set_defaults(func=run_conan)
 
 #===============================================================================
@@ -346,13 +601,40 @@ parser_extract_positions.set_defaults(func=extract_jsm_positions)
 # Add extract_parameters sub_command
 #=======================================================================================================================
 parser_extract = subparsers.add_parser('extract_parameters',
-                                        help='Extract a parameters from jsm file and print to stdout.')
+                                        help='Extract a parameters from jsm or jmm file and print to stdout.')
 
 parser_extract.add_argument('jsm_file_name',
-                             help='JSM file to extract positions from.')
+                             help='JSM or JMM file to extract parameters from.')
+
+parser_extract.add_argument('--params_file_name', default=None,
+                            help='''If set the parameters are written to this file in the format read by the
+                            --params_file option of snvmix or multimix instead of printed. A model trained once can then classify other samples
+                            without retraining.''')
+
+parser_extract.add_argument('--chr_name', default=None,
+                            help='''Chromosome whose parameters are written when the jsm file was made with the
+                            chromosome model.''')
 
 parser_extract.set_defaults(func=extract_jsm_parameters)
 
+#=======================================================================================================================
+# Add benchmark_storage sub_command
+#=======================================================================================================================
+parser_benchmark = subparsers.add_parser('benchmark_storage',
+                                         help='''Rewrite a jcnt file under each storage profile and report size and
+                                         read/write throughput.''')
+
+parser_benchmark.add_argument('jcnt_file_name',
+                              help='Joint counts (jcnt) file to benchmark with.')
+
+parser_benchmark.add_argument('--profiles', nargs='+', choices=sorted(profiles), default=None,
+                              help='Profiles to benchmark. If not set all profiles are used.')
+
+parser_benchmark.add_argument('--tmp_dir', default=None,
+                              help='Directory to write the benchmark files to. Defaults to the system temp directory.')
+
+parser_benchmark.set_defaults(func=benchmark_storage_profiles)
+
 #===============================================================================
 # Run
 #===============================================================================
@@ -2,6 +2,8 @@ from distutils.core import setup
 from distutils.extension import Extension
 from Cython.Distutils import build_ext
 
+# Requires numpy, scipy and PyTables. pysam is optional and only needed by the bam sub-command of jsm.py.
+
 ext_modules = [Extension("joint_snv_mix.file_formats.pileup", ["joint_snv_mix/file_formats/pileup.pyx"])]
 
 setup(
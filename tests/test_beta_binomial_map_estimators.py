@@ -0,0 +1,175 @@
+'''
+Check the vectorised Newton MAP estimates of the beta-binomial parameters against L-BFGS.
+
+Created on 2011-03-23
+
+@author: Andrew Roth
+'''
+import sys
+import unittest
+
+from StringIO import StringIO
+
+import numpy as np
+
+from joint_snv_mix.classification.utils.beta_binomial_map_estimators import CountHistogram, get_f, \
+    get_lbfgs_estimates, get_map_estimates, get_newton_estimates, get_penalty, min_value
+
+def get_objective( x, a, b, resp, priors ):
+    return get_f( x, a, b, resp ) + get_penalty( x, *priors )
+
+def get_priors( location_alpha, location_beta, precision_shape, precision_scale, precision_min ):
+    '''
+    Location and precision priors in the form taken by get_map_estimates.
+    '''
+    location_prior = {'alpha' : np.asarray( location_alpha, dtype=np.float64 ),
+                      'beta' : np.asarray( location_beta, dtype=np.float64 )}
+
+    precision_prior = {'shape' : np.asarray( precision_shape, dtype=np.float64 ),
+                       'scale' : np.asarray( precision_scale, dtype=np.float64 ),
+                       'min' : np.asarray( precision_min, dtype=np.float64 )}
+
+    return location_prior, precision_prior
+
+# Priors of config/joint_bb.priors.cfg and config/joint_bb.ml_priors.cfg.
+map_priors = get_priors( [1000, 500, 1], [1, 500, 1000], [1000] * 3, [1] * 3, [2] * 3 )
+ml_priors = get_priors( [1] * 3, [1] * 3, [1] * 3, [1] * 3, [0] * 3 )
+
+class TestNewtonEstimates( unittest.TestCase ):
+    def get_estimates( self, alpha, beta, a, b, resp, priors ):
+        '''
+        Fit by get_map_estimates and by L-BFGS alone from the same starting values.
+        '''
+        histogram = CountHistogram( a, b )
+
+        location_prior, precision_prior = priors
+
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+
+        try:
+            newton_alpha, newton_beta = get_map_estimates( alpha.copy(), beta.copy(), histogram, resp,
+                                                           location_prior, precision_prior )
+        finally:
+            sys.stdout = stdout
+
+        prior_arrays = [location_prior['alpha'], location_prior['beta'], precision_prior['shape'],
+                        precision_prior['scale'], precision_prior['min']]
+
+        weights = histogram.get_weights( resp )
+
+        newton_f = []
+        lbfgs_f = []
+
+        for component in range( resp.shape[1] ):
+            component_priors = [prior[component] for prior in prior_arrays]
+            component_weights = weights[:, component]
+
+            x = get_lbfgs_estimates( np.array( [alpha[component], beta[component]] ), histogram.a, histogram.b,
+                                     component_weights, *component_priors )
+
+            lbfgs_f.append( get_objective( x, histogram.a, histogram.b, component_weights, component_priors ) )
+
+            x = np.array( [newton_alpha[component], newton_beta[component]] )
+
+            newton_f.append( get_objective( x, histogram.a, histogram.b, component_weights, component_priors ) )
+
+        return newton_alpha, newton_beta, np.array( newton_f ), np.array( lbfgs_f )
+
+    def assert_not_worse_than_lbfgs( self, newton_f, lbfgs_f ):
+        self.assertTrue( np.all( np.isfinite( newton_f ) ) )
+
+        self.assertTrue( np.all( newton_f >= lbfgs_f - 1e-8 * np.abs( lbfgs_f ) ), ( newton_f, lbfgs_f ) )
+
+    def test_random_histograms( self ):
+        random_state = np.random.RandomState( 0 )
+
+        for priors in ( map_priors, ml_priors ):
+            for i in range( 10 ):
+                nrows = random_state.randint( 100, 2000 )
+
+                d = random_state.randint( 0, 200, size=nrows )
+                mu = random_state.choice( [0.01, 0.5, 0.99], size=nrows )
+                a = random_state.binomial( d, mu )
+                b = d - a
+
+                resp = random_state.dirichlet( [1, 1, 1], size=nrows )
+
+                # Start both methods far from the optimum so the damped steps are exercised, but where the precision
+                # prior is finite.
+                precision_min = priors[1]['min']
+
+                alpha = precision_min + 10 ** random_state.uniform( -2, 4, size=3 )
+                beta = precision_min + 10 ** random_state.uniform( -2, 4, size=3 )
+
+                newton_alpha, newton_beta, newton_f, lbfgs_f = self.get_estimates( alpha, beta, a, b, resp, priors )
+
+                self.assertTrue( np.all( newton_alpha >= min_value ) )
+                self.assertTrue( np.all( newton_beta >= min_value ) )
+
+                self.assert_not_worse_than_lbfgs( newton_f, lbfgs_f )
+
+    def test_location_near_zero( self ):
+        '''
+        Without a location prior a component with no a counts has its optimum at alpha = 0, below the bound.
+        '''
+        random_state = np.random.RandomState( 1 )
+
+        d = random_state.randint( 1, 60, size=500 )
+        a = np.zeros( d.shape, dtype=np.int64 )
+        b = d
+
+        resp = np.ones( ( 500, 3 ) ) / 3
+
+        alpha = np.ones( ( 3, ) )
+        beta = np.ones( ( 3, ) )
+
+        newton_alpha, newton_beta, newton_f, lbfgs_f = self.get_estimates( alpha, beta, a, b, resp, ml_priors )
+
+        self.assertTrue( np.allclose( newton_alpha, min_value ) )
+        self.assertTrue( np.all( newton_beta >= min_value ) )
+
+        self.assert_not_worse_than_lbfgs( newton_f, lbfgs_f )
+
+    def test_newton_fails_below_bound( self ):
+        '''
+        Components whose estimates leave the bounds are reported failed so they are refit by L-BFGS.
+        '''
+        a = np.array( [0, 0, 0, 5, 10] )
+        b = np.array( [10, 20, 30, 5, 10] )
+
+        resp = np.array( [[1., 0.], [1., 0.], [1., 0.], [0., 1.], [0., 1.]] )
+
+        x = np.array( [[1., 500.], [1., 500.]] )
+
+        priors = [np.array( [1., 1.] ), np.array( [1., 1.] ), np.array( [1., 1000.] ), np.array( [1., 1.] ),
+                  np.array( [0., 2.] )]
+
+        x, failed = get_newton_estimates( x, a, b, resp, *priors )
+
+        self.assertEqual( failed.tolist(), [True, False] )
+
+        self.assertTrue( np.all( x[:, 1] > min_value ) )
+
+    def test_empty_component( self ):
+        random_state = np.random.RandomState( 2 )
+
+        d = random_state.randint( 10, 100, size=1000 )
+        a = random_state.binomial( d, 0.5 )
+        b = d - a
+
+        resp = random_state.dirichlet( [1, 1, 1], size=1000 )
+        resp[:, 1] = 0
+
+        alpha = np.array( [10., 20., 30.] )
+        beta = np.array( [10., 20., 30.] )
+
+        newton_alpha, newton_beta, newton_f, lbfgs_f = self.get_estimates( alpha, beta, a, b, resp, map_priors )
+
+        self.assertEqual( newton_alpha[1], 20. )
+        self.assertEqual( newton_beta[1], 20. )
+
+        self.assert_not_worse_than_lbfgs( newton_f[[0, 2]], lbfgs_f[[0, 2]] )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+'''
+Check position lookups in jsm files for chromosomes the file does not hold.
+
+Created on 2011-03-23
+
+@author: Andrew Roth
+'''
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from StringIO import StringIO
+
+import numpy as np
+
+from joint_snv_mix.file_formats.jsm import JointSnvMixReader, JointSnvMixWriter
+from joint_snv_mix.post_processing.extract_jsm_positions import get_position_probabilities
+
+def write_jsm_file( file_name, shard=False ):
+    '''
+    Write a jsm file with two positions on chromosome 1.
+    '''
+    jcnt_rows = np.array( [( 100, 'A', 'A', 'A', 10, 0, 10, 0 ), ( 200, 'C', 'C', 'T', 10, 0, 5, 5 )],
+                          dtype=[( 'position', np.uint32 ), ( 'ref_base', 'S1' ), ( 'normal_base', 'S1' ),
+                                 ( 'tumour_base', 'S1' ), ( 'normal_counts_a', np.uint32 ),
+                                 ( 'normal_counts_b', np.uint32 ), ( 'tumour_counts_a', np.uint32 ),
+                                 ( 'tumour_counts_b', np.uint32 )] )
+
+    responsibilities = np.zeros( ( 2, 9 ) )
+    responsibilities[0, 0] = 1.
+    responsibilities[1, 1] = 1.
+
+    writer = JointSnvMixWriter( file_name, shard=shard )
+
+    writer.write_data( '1', jcnt_rows, responsibilities )
+
+    writer.close()
+
+class TestGetPositionUnknownChromosome( unittest.TestCase ):
+    def setUp( self ):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.tmp_dir )
+
+    def assert_unknown_chromosome_raises_key_error( self, shard ):
+        file_name = os.path.join( self.tmp_dir, 'test.jsm' )
+
+        write_jsm_file( file_name, shard )
+
+        reader = JointSnvMixReader( file_name )
+
+        try:
+            self.assertEqual( reader.get_position( '1', 200 )[0], 200 )
+
+            self.assertRaises( KeyError, reader.get_position, '7', 100 )
+        finally:
+            reader.close()
+
+    def test_unknown_chromosome( self ):
+        self.assert_unknown_chromosome_raises_key_error( shard=False )
+
+    def test_unknown_chromosome_sharded( self ):
+        self.assert_unknown_chromosome_raises_key_error( shard=True )
+
+    def test_extract_positions_skips_unknown_chromosome( self ):
+        file_name = os.path.join( self.tmp_dir, 'test.jsm' )
+
+        write_jsm_file( file_name )
+
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+
+        try:
+            get_position_probabilities( file_name, {'1' : ['100'], '7' : ['100']} )
+
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+        self.assertTrue( output.startswith( '1:100\t' ) )
+        self.assertTrue( '7  not in jsm file.' in output )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+'''
+Check the table based beta-binomial likelihood used for integer counts against the betaln path used for floats.
+
+Created on 2011-03-22
+
+@author: Andrew Roth
+'''
+import unittest
+
+import numpy as np
+
+from joint_snv_mix.classification.utils.log_pdf import log_beta_binomial_likelihood
+
+class TestLogBetaBinomialLikelihoodFromTables( unittest.TestCase ):
+    def assert_matches_betaln( self, k, n, alpha, beta ):
+        '''
+        Integer counts take the table path, the same counts as floats take the betaln path.
+        '''
+        k = np.asarray( k, dtype=np.uint32 )
+        n = np.asarray( n, dtype=np.uint32 )
+
+        alpha = np.asarray( alpha, dtype=np.float64 )
+        beta = np.asarray( beta, dtype=np.float64 )
+
+        from_tables = log_beta_binomial_likelihood( k, n, alpha, beta )
+        from_betaln = log_beta_binomial_likelihood( k.astype( np.float64 ), n.astype( np.float64 ), alpha, beta )
+
+        self.assertEqual( from_tables.shape, ( k.size, alpha.size ) )
+        self.assertEqual( from_tables.shape, from_betaln.shape )
+
+        self.assertTrue( np.allclose( from_tables, from_betaln, rtol=1e-12, atol=1e-10 ) )
+
+    def test_random_counts( self ):
+        random_state = np.random.RandomState( 0 )
+
+        n = random_state.randint( 0, 3001, size=1000 )
+        k = ( random_state.uniform( size=1000 ) * ( n + 1 ) ).astype( np.int64 ).clip( 0, n )
+
+        alpha = np.array( [8.8e-7, 0.5, 10., 997.] )
+        beta = np.array( [997., 2., 10., 8.8e-7] )
+
+        self.assert_matches_betaln( k, n, alpha, beta )
+
+    def test_zero_depth( self ):
+        self.assert_matches_betaln( [0, 0], [0, 0], [1., 2., 1000.], [1., 500., 3.] )
+
+    def test_no_successes( self ):
+        self.assert_matches_betaln( [0, 0, 0], [1, 10, 3000], [1., 2., 1000.], [1., 500., 3.] )
+
+    def test_all_successes( self ):
+        self.assert_matches_betaln( [1, 10, 3000], [1, 10, 3000], [1., 2., 1000.], [1., 500., 3.] )
+
+    def test_small_shape_parameters( self ):
+        k = [0, 1, 5, 100, 2999]
+        n = [3, 1, 100, 100, 3000]
+
+        self.assert_matches_betaln( k, n, [1e-6, 8.8e-7, 1e-3], [1e-6, 1e-3, 8.8e-7] )
+
+    def test_empty_input( self ):
+        self.assert_matches_betaln( [], [], [1., 2., 3.], [3., 2., 1.] )
+
+if __name__ == "__main__":
+    unittest.main()